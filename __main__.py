@@ -28,10 +28,27 @@ def parse():
     parser.add_argument('-e','--encode', action='store_true',  help='encode a text file into an image')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
+    parser.add_argument('-a','--apply',  type=str, default='', help='the operations to apply, e.g. invert,pixellate:20')
+    parser.add_argument('-o','--output', type=str, help='process the image without the GUI, saving to this file (.png or .imgr)')
+    parser.add_argument('-r','--region', type=str, help='limit the operations to the rectangle row,col,height,width')
+    parser.add_argument('-s','--scratch', type=str, help='keep all image buffers in memory-mapped scratch files in this directory')
+    parser.add_argument('-p','--proxy', action='store_true', help='preview edits of large images on a screen-sized copy')
+    parser.add_argument('--stats', type=str, nargs='?', const='', help='measure each operation, appending the measurements to this file (JSON lines) if given')
+    parser.add_argument('-m','--memory', action='store_true', help='report the memory held by the edit history when done (without the GUI)')
+    parser.add_argument('--profile', type=str, help='profile the operations without the GUI, writing collapsed stacks to this file')
+    parser.add_argument('--top', type=int, default=15, help='the number of hot functions to list when profiling')
+    parser.add_argument('--bench', action='store_true', help='time the startup of the application against a target')
+    parser.add_argument('--cache', type=int, help='the size limit of the cache of decoded images in MB (0 to not cache)')
+    parser.add_argument('--prefetch', type=int, help='the memory budget for loading neighboring files in the GUI, in MB (0 to not prefetch)')
+    parser.add_argument('--serve', type=str, help='serve operation chains over HTTP at this address (host:port, port, or Unix socket path)')
+    parser.add_argument('--workers', type=int, help='the number of worker processes for --serve (default: one per CPU)')
+    parser.add_argument('--memo', type=int, help='the memory limit of the cache of operation results in MB (0 to not cache)')
+    parser.add_argument('--memo-dir', type=str, help='save results dropped from the cache of operation results to this directory')
+    parser.add_argument('--tiled', action='store_true', help='store images in tiles with a bounded tile cache')
     return parser.parse_args()
 
 
-def launchgui(image):
+def launchgui(image, proxy=False, stats=None):
     """
     Launches the gui application with the given image and output (if specified)
     
@@ -40,9 +57,15 @@ def launchgui(image):
     
     Parameter output: The output file for saving any changes
     Precondition: output is a filename string or None
+    
+    Parameter proxy: Whether to edit large images through a proxy (see imgproxy)
+    Precondition: proxy is a bool
+    
+    Parameter stats: The file for operation measurements ('' to only show them)
+    Precondition: stats is a string or None (to not measure)
     """
     from filter import launch
-    launch(image)
+    launch(image,proxy,stats)
 
 
 def unittest():
@@ -88,6 +111,123 @@ def encode(image):
     launch(image)
 
 
+def headless(image, chain, output, region=None, stats=None, memory=False):
+    """
+    Applies an operation chain to the image without launching the GUI
+    
+    Parameter image: The image file to process
+    Precondition: image is a filename string
+    
+    Parameter chain: The operations to apply (see imgbatch)
+    Precondition: chain is a string
+    
+    Parameter output: The output file for the result (.png or .imgr)
+    Precondition: output is a filename string
+    
+    Parameter region: The rectangle to limit the operations to (see imgbatch)
+    Precondition: region is a string or None
+    
+    Parameter stats: The file for operation measurements ('' to only print them)
+    Precondition: stats is a string or None (to not measure)
+    
+    Parameter memory: Whether to print a memory report when done
+    Precondition: memory is a bool
+    """
+    import imgbatch
+    if region:
+        region = imgbatch.parse_region(region)
+    recorder = None
+    if stats is not None:
+        import imgstats
+        recorder = imgstats.Recorder(file=stats or None)
+    editor = imgbatch.process(image,imgbatch.parse_chain(chain),output,region,recorder)
+    if recorder is not None:
+        for record in recorder.getRecords():
+            print('{:<14} {:9.1f} ms  cpu {:9.1f} ms  history {:7.1f} ms  {:>9} px'.format(
+                  record['name'],record['wall']*1000,record['cpu']*1000,
+                  record['copy']*1000,record['written']))
+    if memory:
+        import imgstats
+        print(imgstats.memory_report(editor.getFootprint()))
+
+
+def profile(image, chain, collapsed, output=None, region=None, top=15):
+    """
+    Profiles an operation chain on the image without launching the GUI
+    
+    This writes the sampled call stacks to the file collapsed (for flamegraph tools), 
+    and prints the hottest functions of the image modules (see imgprofile).
+    
+    Parameter image: The image file to process
+    Precondition: image is a filename string
+    
+    Parameter chain: The operations to apply (see imgbatch)
+    Precondition: chain is a string
+    
+    Parameter collapsed: The output file for the collapsed stacks
+    Precondition: collapsed is a filename string
+    
+    Parameter output: The output file for the result (None to not save it)
+    Precondition: output is a filename string or None
+    
+    Parameter region: The rectangle to limit the operations to (see imgbatch)
+    Precondition: region is a string or None
+    
+    Parameter top: The number of functions to print
+    Precondition: top is an int >= 0
+    """
+    import imgbatch
+    import imgprofile
+    if region:
+        region = imgbatch.parse_region(region)
+    stats, sampler = imgprofile.profile_chain(image,imgbatch.parse_chain(chain),region,output)
+    sampler.write(collapsed)
+    imgprofile.report(stats,top)
+
+
+def bench(image):
+    """
+    Times the startup of the application, and exits with an error if it is too slow
+    
+    See imgbench for the steps that are timed.
+    
+    Parameter image: The image file to load (the default image if None)
+    Precondition: image is a filename string or None
+    """
+    import sys
+    import imgbench
+    if not imgbench.report(imgbench.measure(image)):
+        sys.exit(1)
+
+
+def scratch(directory):
+    """
+    Makes every loaded image use memory-mapped scratch files in the given directory
+    
+    Parameter directory: The directory for the scratch files
+    Precondition: directory is the name of an existing directory
+    """
+    import pixels
+    import imgfile
+    pixels.MappedPixels.SCRATCH_DIR = directory
+    imgfile.MAPPED_THRESHOLD = 0
+
+
+def cache(limit):
+    """
+    Sets the size limit of the cache of decoded images (see imgcache)
+    
+    Parameter limit: The size limit in megabytes (0 to not use the cache)
+    Precondition: limit is an int >= 0
+    """
+    import imgfile
+    import imgcache
+    if limit > 0:
+        imgcache.get_cache().setLimit(limit*1024*1024)
+    else:
+        imgfile.DECODE_CACHE = False
+
+
 def execute():
     """
     Executes the application, according to the command line arguments specified.
@@ -95,6 +235,21 @@ def execute():
     args = parse()
     
     image = args.image
+    if args.scratch:
+        scratch(args.scratch)
+    if args.cache is not None:
+        cache(args.cache)
+    if args.prefetch is not None:
+        import imgprefetch
+        imgprefetch.PREFETCH_BUDGET = max(0,args.prefetch)*1024*1024
+    if args.memo is not None or args.memo_dir:
+        import imgmemo
+        if args.memo is not None:
+            imgmemo.MEMO_LIMIT = max(0,args.memo)*1024*1024
+        imgmemo.MEMO_DIR = args.memo_dir
+    if args.tiled:
+        import imgfile
+        imgfile.TILED_STORAGE = True
     
     # Switch on the options
     if args.test:
@@ -103,8 +258,18 @@ def execute():
         grade(image)
     elif args.encode:
         encode(image)
+    elif args.serve:
+        import imgserver
+        imgserver.serve(args.serve,args.workers)
+    elif args.bench:
+        bench(image)
+    elif args.profile:
+        profile(image,args.apply,args.profile,args.output,args.region,args.top)
+    elif args.output:
+        headless(image,args.apply,args.output,args.region,args.stats,args.memory)
     else:
-        launchgui(image)
+        launchgui(image,args.proxy,args.stats)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not in the worker processes of imgserver, which import this module)
+if __name__ == '__main__':
+    execute()
\ No newline at end of file
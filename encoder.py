@@ -63,8 +63,9 @@ class EncoderPanel(AppPanel):
                                        save=[self.save_image], load=[self.load_image])
         self.textdrop  = FileDropDown( choices=['load','save'], 
                                        save=[self.save_text], load=[self.load_text])
-        self.editdrop  = EditDropDown( choices=['undo','reset'],
-                                       undo=[self.undo], reset=[self.clear])
+        self.editdrop  = EditDropDown( choices=['undo','redo','reset'],
+                                       undo=[self.undo], redo=[self.redo], 
+                                       reset=[self.clear])
     
     def place_image(self, path, filename):
         """
@@ -93,6 +94,17 @@ class EncoderPanel(AppPanel):
         super().undo()
         self.decode()
     
+    def redo(self):
+        """
+        Redos the last undone edit to the image.
+        
+        This method will put back the last edit that was undone.  If the ImageHistory 
+        class is not implemented correctly, this will display an error message onscreen 
+        as well as in the command line.
+        """
+        super().redo()
+        self.decode()
+    
     def clear(self):
         """
         Clears all edits to the image.
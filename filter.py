@@ -58,6 +58,17 @@ class FilterPanel(AppPanel):
     turndrop  = ObjectProperty(None)
     # The pixellate drop-down menu
     blockdrop = ObjectProperty(None)
+    # The convolution filter drop-down menu
+    convdrop  = ObjectProperty(None)
+    # Whether to edit a screen-sized proxy of large images (see imgproxy)
+    proxy     = BooleanProperty(False)
+    # The file for operation measurements ('' to only show them; None to not measure)
+    stats     = ObjectProperty(None,allownone=True)
+    # The measurements of the latest operation (see imgstats)
+    status    = StringProperty('')
+    
+    # The recorder for the operation measurements (None if not measuring)
+    recorder  = None
     
     def config(self):
         """
@@ -71,8 +82,10 @@ class FilterPanel(AppPanel):
         
         self.filedrop  = FileDropDown( choices=['load','save'], 
                                        save=[self.save_image], load=[self.load_image])
-        self.editdrop  = EditDropDown( choices=['undo','reset'],
-                                       undo=[self.undo], reset=[self.clear])
+        self.editdrop  = EditDropDown( choices=['undo','redo','reset','deselect'],
+                                       undo=[self.undo], redo=[self.redo], 
+                                       reset=[self.clear],
+                                       deselect=[self.workimage.clearSelection])
         self.axisdrop  = AxisDropDown( choices=['horizontal','vertical'],
                                        horizontal=[self.do_async,'reflectHori'], 
                                        vertical=[self.do_async,'reflectVert'])
@@ -88,8 +101,20 @@ class FilterPanel(AppPanel):
                                        p50=[self.do_async,'pixellate',50],
                                        p100=[self.do_async,'pixellate',100],
                                        p200=[self.do_async,'pixellate',200])
+        self.convdrop  = ConvolveDropDown(choices=['blur','box','sharpen','edges','emboss'],
+                                       blur=[self.do_async,'blur',3],
+                                       box=[self.do_async,'boxBlur',5],
+                                       sharpen=[self.do_async,'sharpen',2,100],
+                                       edges=[self.do_async,'edges'],
+                                       emboss=[self.do_async,'emboss'])
         self.async_action = None
         self.async_thread = None
+        self.async_region = None
+        if self.stats is not None:
+            import imgstats
+            self.recorder = imgstats.Recorder(file=self.stats or None)
+            if self.workspace is not None:
+                self.workspace.setRecorder(self.recorder)
     
     def place_image(self, path, filename):
         """
@@ -112,21 +137,78 @@ class FilterPanel(AppPanel):
         else:
             file = os.path.join(path,filename)
         
-        import a6editor
+        # Show the image first, as making the editor copies it
         self.picture = self.read_image(file)
+        self.close_workspace()
+        self.workimage.setImage(self.picture)
+        self.origimage.setImage(self.picture)
+        self.show_memory()
+        self.canvas.ask_update()
+        Clock.schedule_once(self.open_workspace)
+    
+    def close_workspace(self):
+        """
+        Drops the current editor, stopping any background work it does
+        
+        A proxy editor (see imgproxy) has a thread that would otherwise keep it alive.
+        """
+        close = getattr(self.workspace,'close',None)
+        if close is not None:
+            close()
+        self.workspace = None
+    
+    def open_workspace(self, dt=None):
+        """
+        Creates the editor for the current picture
+        
+        This is scheduled by place_image for the frame after the picture is shown, so
+        that the application is drawn before the (slow) copy of the picture is made.
+        
+        Parameter dt: The time since this was scheduled (ignored)
+        Precondition: dt is a number or None
+        """
+        if self.picture is None:
+            self.workimage.setImage(None)
+            return
         try:
-            self.workspace = a6editor.Editor(self.picture)
-            self.workimage.setImage(self.workspace.getCurrent())
-            if self.workspace.getOriginal():
-                self.origimage.setImage(self.workspace.getOriginal())
-            else:
-                self.origimage.setImage(self.picture)
+            self.workspace = self.make_editor(self.picture)
+            current = self.workspace.getCurrent()
+            if current.getWidth() != self.picture.getWidth():
+                self.workimage.setImage(current)
         except:
+            traceback.print_exc()
             self.workspace = None
             self.workimage.setImage(None)
-            self.origimage.setImage(self.picture)
+        self.show_memory()
         self.canvas.ask_update()
     
+    def make_editor(self, picture):
+        """
+        Returns: A new editor for the given image
+        
+        If proxy is True and the image is larger than the image panel, this is an 
+        imgproxy.ProxyEditor, which previews every edit on a copy the size of the panel.
+        Otherwise, it is a plain Editor.  If stats is not None, the editor measures its
+        operations (see imgstats).  The editor reuses results from the shared cache of
+        operation results (see imgmemo).
+        
+        Parameter picture: The image to edit
+        Precondition: picture is an Image object
+        """
+        import imgeditor
+        import imgmemo
+        editor = None
+        if self.proxy:
+            import imgproxy
+            factor = imgproxy.factor_for(picture,*self.workimage.inside)
+            if factor > 1:
+                editor = imgproxy.ProxyEditor(picture,factor)
+        if editor is None:
+            editor = imgeditor.Editor(picture)
+        editor.setRecorder(self.recorder)
+        editor.setMemo(imgmemo.get_memo())
+        return editor
+    
     def do_async(self,*action):
         """
         Launchs the given action in an asynchronous thread
@@ -137,18 +219,26 @@ class FilterPanel(AppPanel):
         The thread progress is monitored by async_monitor.  When the thread is done, it
         will call async_complete in the main event thread.
         
+        If the user has selected a region of the image, the action is limited to that 
+        region (and only the region is saved in the edit history).
+        
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
         """
         import threading
+        if self.workspace is None:
+            return
+        region = self.workimage.getSelection()
         self.menubar.disabled = True
-        self.workspace.increment()
+        self.workspace.increment(region)
+        self.async_region = region
         self.progress.value = 0
         self.async_action = Clock.schedule_interval(self.async_monitor,0.02)
-        self.async_thread = threading.Thread(target=self.async_work,args=action)
+        self.async_thread = threading.Thread(target=self.async_work,args=action,
+                                             kwargs={'region':region})
         self.async_thread.start()
 
-    def async_work(self,*action):
+    def async_work(self,*action,region=None):
         """
         Performs the given action asynchronously.
         
@@ -156,17 +246,24 @@ class FilterPanel(AppPanel):
         and any other elements are parameters to the callable.
         
         This is the function that is launched in a separate thread.  Even if the action
-        fails, it is guaranteed to call async_complete for clean-up
+        fails, it is guaranteed to call async_complete for clean-up.  It also prepares
+        the result for display (see ImagePanel.prepare), so that the GUI thread only has
+        to upload it.
         
         Parameter(s) *action: An expanded list defining the action
         Precondition: The first element of action is callable
+        
+        Parameter region: The region of interest (see Editor.perform)
+        Precondition: region is None or a tuple (row, col, height, width)
         """
+        frame = None
         try:
-            getattr(self.workspace,action[0])(*action[1:])
+            self.workspace.perform(action[0],*action[1:],region=region)
+            frame = self.workimage.prepare(self.workspace.getCurrent(),region)
         except:
             traceback.print_exc()
             self.error('Action '+action[0]+' could not be completed')
-        self.async_complete()
+        self.async_complete(frame)
     
     def async_monitor(self,dt):
         """
@@ -180,12 +277,28 @@ class FilterPanel(AppPanel):
             self.progress.value = int(image.getPixels().progress()*self.progress.max)
      
     @mainthread
-    def async_complete(self):
+    def async_complete(self,frame=None):
         """
         Cleans up an asynchronous thread after completion.
+        
+        Parameter frame: The prepared result to show (None to prepare it here)
+        Precondition: frame is a Frame made by the workimage panel, or None
         """
+        import time
         self.progress.value = self.progress.max
-        self.workimage.update(self.workspace.getCurrent())
+        start = time.perf_counter()
+        try:
+            if frame is None:
+                self.workimage.update(self.workspace.getCurrent(),self.async_region)
+            else:
+                self.workimage.present(frame)
+        except Exception:
+            traceback.print_exc()
+            self.error('The result could not be shown')
+        if self.recorder is not None:
+            self.recorder.addUpload(time.perf_counter()-start)
+            self.status = self.recorder.status()
+        self.show_memory()
         self.async_thread.join()
         Clock.unschedule(self.async_action)
         self.async_thread = None
@@ -218,7 +331,7 @@ class FilterApp(App):
     event loop.  It is the root class for the application.
     """
     
-    def __init__(self,file):
+    def __init__(self,file,proxy=False,stats=None):
         """
         Initializer: Creates a new application window.
         
@@ -226,15 +339,23 @@ class FilterApp(App):
         
         Parameter file: The location of the initial image file.
         Precondition: file is a string or None.
+        
+        Parameter proxy: Whether to edit large images through a proxy (see imgproxy)
+        Precondition: proxy is a bool
+        
+        Parameter stats: The file for operation measurements ('' to only show them)
+        Precondition: stats is a string or None (to not measure)
         """
         super().__init__()
         self.source = file
+        self.proxy  = proxy
+        self.stats  = stats
     
     def build(self):
         """
         Reads kivy file and performs any initial layout
         """
-        panel = FilterPanel()
+        panel = FilterPanel(proxy=self.proxy,stats=self.stats)
         if self.source:
             panel.source = self.source
         return panel
@@ -247,7 +368,7 @@ class FilterApp(App):
         self.root.config()
 
 
-def launch(image):
+def launch(image,proxy=False,stats=None):
     """
     Launches the application with the given image file.
     
@@ -255,5 +376,14 @@ def launch(image):
     
     Parameter file: The location of the initial image file.
     Precondition: file is a string or None.
+    
+    Parameter proxy: Whether to edit large images through a proxy (see imgproxy)
+    Precondition: proxy is a bool
+    
+    Parameter stats: The file for operation measurements ('' to only show them)
+    Precondition: stats is a string or None (to not measure)
     """
-    FilterApp(image).run()
+    import imgconvolve
+    # Forking the running Kivy app for the filter workers is not safe
+    imgconvolve.PARALLEL = False
+    FilterApp(image,proxy,stats).run()
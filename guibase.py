@@ -27,12 +27,18 @@ from kivy.uix.widget import Widget
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
 from kivy.graphics.texture import Texture
+from kivy.graphics import InstructionGroup, Color, Rectangle
+from kivy.graphics.scissor_instructions import ScissorPush, ScissorPop
 
 from dialogs import *
 
 import traceback
 
 
+# The image shown when an application starts without an image file
+DEFAULT_IMAGE = 'im_walker.png'
+
+
 class ImagePanel(Widget):
     """
     A controller for an ImagePanel, an widget to display an image on screen.
@@ -50,12 +56,33 @@ class ImagePanel(Widget):
     picture = ObjectProperty(None,allownone=True)
     # The image, represented as a Texture object
     texture = ObjectProperty(None)
+    # The reductions of the image for display (see imgpyramid)
+    pyramid = ObjectProperty(None,allownone=True)
+    # The pyramid level shown by the texture
+    level   = NumericProperty(0)
     # The "interior" dimensions of this panel (ignoring the border)
     inside   = ListProperty((0,0))
     # The display size of the current image
     imagesize = ListProperty((0,0))
     # The position offset of the current image
     imageoff  = ListProperty((0,0))
+    # Whether the user can drag out a selection on this panel
+    selectable = BooleanProperty(False)
+    # The selected rectangle (row, col, height, width) of the image (or empty)
+    selection = ListProperty([])
+    # The selected rectangle (x, y, width, height) in window coordinates (or empty)
+    selbox    = ListProperty([])
+    # Whether the user can zoom (with the scroll wheel) and pan (by dragging) the image
+    zoomable  = BooleanProperty(False)
+    # Whether the image is zoomed in (and drawn as tiles instead of the texture)
+    zoomed    = BooleanProperty(False)
+    
+    # The zoom and pan state, if zoomable (see imgviewport)
+    _viewport = None
+    # The uploaded tile textures, if zoomable
+    _texcache = None
+    # The canvas instructions drawing the tiles
+    _tiles    = None
     
     @classmethod
     def getResource(self,filename):
@@ -73,6 +100,27 @@ class ImagePanel(Widget):
         dir = os.path.split(__file__)[0]
         return os.path.join(dir,filename)
     
+    def __init__(self, **kwargs):
+        """
+        Initializer: Creates a new image panel
+        
+        Parameter kwargs: The Kivy widget properties
+        Precondition: kwargs are valid properties of this widget
+        """
+        import threading
+        import textures
+        super().__init__(**kwargs)
+        # Guards the pyramid, which worker threads update in prepare
+        self._lock   = threading.RLock()
+        # The textures not currently shown
+        self._pool   = textures.TexturePool()
+        # The texture shown before the current one (to draw the next frame into)
+        self._back   = None
+        # The rectangle of the display level that _back is missing (None if none)
+        self._stale  = None
+        # The number of frames shown
+        self._serial = 0
+    
     def setImage(self,picture):
         """
         Returns: True if the image panel successfully displayed picture
@@ -81,39 +129,33 @@ class ImagePanel(Widget):
         True if it is successful.  If it fails, the texture is erased and the method
         returns false.
         
+        The texture is not the picture itself, but the smallest level of its pyramid
+        (see imgpyramid) that fills the space on screen.
+        
         Parameter picture: The image to display
         Precondition: picture is an Image object or None
         """
-        import a6image
+        self.clearSelection()
+        self.resetZoom()
         try:
-            self.picture = picture
-            self.texture = Texture.create(size=(picture.getWidth(), picture.getHeight()), colorfmt='rgb', bufferfmt='ubyte')
-            self.texture.blit_buffer(picture.getPixels().buffer, colorfmt='rgb', bufferfmt='ubyte')
-            self.texture.flip_vertical()
-            
-            if self.texture.width < self.texture.height:
-                self.imagesize[0] = int(self.inside[0]*(self.texture.width/self.texture.height))
-                self.imagesize[1] = self.inside[1]
-            elif self.texture.width > self.texture.height:
-                self.imagesize[0] = self.inside[0]
-                self.imagesize[1] = int(self.inside[1]*(self.texture.height/self.texture.width))
-            else:
-                self.imagesize = self.inside
-        
-            self.imageoff[0] = (self.size[0]-self.imagesize[0])//2
-            self.imageoff[1] = (self.size[1]-self.imagesize[1])//2
-            return True
+            return self.present(self.prepare(picture,None,True))
         except:
             pass
         
-        self.picture = None
-        self.texture = None
+        with self._lock:
+            self._pool.release(self.texture)
+            self._pool.release(self._back)
+            self._back  = None
+            self._stale = None
+            self.picture = None
+            self.pyramid = None
+            self.texture = None
         self.imagesize = self.inside
         self.imageoff[0] = (self.size[0]-self.imagesize[0])//2
         self.imageoff[1] = (self.size[1]-self.imagesize[1])//2
         return False
         
-    def update(self,picture):
+    def update(self,picture,region=None):
         """
         Returns: True if the image panel successfully displayed picture
         
@@ -121,18 +163,409 @@ class ImagePanel(Widget):
         is a (dimension-preserving) modification of the current one.  Otherwise it calls
         setImage.
         
+        If region is not None, only that region of the picture has changed, and only
+        the matching part of the texture is uploaded.
+        
         Parameter picture: The image to display
         Precondition: picture is an Image object or None
+        
+        Parameter region: The changed region of the picture
+        Precondition: region is None or a tuple (row, col, height, width)
         """
         try:
-            assert picture.getWidth() == self.texture.width
-            self.picture = picture
-            self.texture.blit_buffer(self.picture.getPixels().buffer, colorfmt='rgb', bufferfmt='ubyte')
-            return True
+            return self.present(self.prepare(picture,region))
         except:
             pass
         
         return self.setImage(picture)
+    
+    def prepare(self, picture, region=None, fresh=False):
+        """
+        Returns: A Frame (see textures) that will show picture when presented
+        
+        This method does the slow part of showing an image: updating the pyramid and 
+        copying the pixels to upload.  It does not touch any Kivy objects, so it is 
+        safe to call from a worker thread (unlike present).
+        
+        If picture is the same size as the current picture, it is treated as an edit of 
+        it, and only region (if not None) has changed.  The frame then only has the
+        pixels needed to bring the back texture up to date.
+        
+        Parameter picture: The image to display
+        Precondition: picture is an Image object
+        
+        Parameter region: The changed region of the picture
+        Precondition: region is None or a tuple (row, col, height, width)
+        
+        Parameter fresh: Whether to treat picture as a new image, even if it is the 
+        same size as the current one
+        Precondition: fresh is a bool
+        """
+        import imgpyramid
+        import textures
+        with self._lock:
+            pyramid = self.pyramid
+            if (fresh or pyramid is None or picture.getWidth() != pyramid.getImage().getWidth() 
+                or picture.getHeight() != pyramid.getImage().getHeight()):
+                pyramid = imgpyramid.Pyramid(picture)
+                level   = pyramid.choose(*self._fitSize(picture))
+                changed = {}
+                rect    = (0,0)+pyramid.getSize(level)[::-1]
+            else:
+                level   = self.level
+                changed = pyramid.update(picture,region)
+                rect    = _union(self._stale,changed.get(level))
+            
+            display  = pyramid.getLevel(level)
+            colorfmt = textures.COLORFMTS[display.getChannels()]
+            if rect is None:
+                data = None
+            elif rect[2] == display.getHeight() and rect[3] == display.getWidth():
+                data = bytes(display.getPixels().buffer)
+            else:
+                data = bytes(display.getRegion(*rect).getPixels().buffer)
+            return textures.Frame(picture,pyramid,level,changed,rect,data,colorfmt,self._serial)
+    
+    def present(self, frame):
+        """
+        Returns: True once the frame is shown
+        
+        The frame is copied to a texture that is not on screen, which is then swapped 
+        with the texture that is.  This method must be called from the GUI thread.
+        
+        Parameter frame: The frame to show
+        Precondition: frame is a Frame made by prepare for this panel
+        """
+        with self._lock:
+            display = frame.pyramid.getLevel(frame.level)
+            width, height = display.getWidth(), display.getHeight()
+            
+            if frame.pyramid is not self.pyramid:
+                self.clearSelection()
+                self.resetZoom()
+                texture = self._pool.acquire(width,height,frame.colorfmt)
+                texture.blit_buffer(frame.data, colorfmt=frame.colorfmt, bufferfmt='ubyte')
+                self._pool.release(self.texture)
+                self._pool.release(self._back)
+                self._back  = None
+                self._stale = (0,0,height,width)
+                self.picture = frame.picture
+                self.pyramid = frame.pyramid
+                self.level   = frame.level
+                self.texture = texture
+                
+                self.imagesize = self._fitSize(frame.picture)
+                self.imageoff[0] = (self.size[0]-self.imagesize[0])//2
+                self.imageoff[1] = (self.size[1]-self.imagesize[1])//2
+            else:
+                self.picture = frame.picture
+                if self._texcache is not None:
+                    for level in frame.changed:
+                        self._texcache.discard(level,frame.changed[level])
+                    self._drawTiles()
+                
+                rect, data, colorfmt = frame.rect, frame.data, frame.colorfmt
+                back = self._back
+                if frame.serial != self._serial or (back is not None and back.colorfmt != colorfmt):
+                    # Another frame was shown since this one was made, or the channels
+                    # of the image changed (so the back texture cannot be patched)
+                    rect = (0,0,height,width)
+                    data = bytes(display.getPixels().buffer)
+                    colorfmt = textures.COLORFMTS[display.getChannels()]
+                if rect is not None:
+                    texture = back
+                    if texture is not None and texture.colorfmt != colorfmt:
+                        self._pool.release(texture)
+                        texture = None
+                    if texture is None:
+                        texture = self._pool.acquire(width,height,colorfmt)
+                    texture.blit_buffer(data, size=(rect[3],rect[2]), pos=(rect[1],rect[0]), 
+                                        colorfmt=colorfmt, bufferfmt='ubyte')
+                    self._back   = self.texture
+                    self._stale  = frame.changed.get(frame.level)
+                    self.texture = texture
+            self._serial += 1
+        return True
+    
+    def _fitSize(self, picture):
+        """
+        Returns: The display size [width, height] of picture, fit inside this panel
+        
+        Parameter picture: The image to display
+        Precondition: picture is an Image object
+        """
+        width  = picture.getWidth()
+        height = picture.getHeight()
+        if width < height:
+            return [int(self.inside[0]*(width/height)), self.inside[1]]
+        elif width > height:
+            return [self.inside[0], int(self.inside[1]*(height/width))]
+        return list(self.inside)
+    
+    # Region selection
+    def getSelection(self):
+        """
+        Returns: The selected rectangle (row, col, height, width) or None if no selection
+        """
+        return tuple(self.selection) if self.selection else None
+    
+    def clearSelection(self):
+        """
+        Removes the current selection (if any)
+        """
+        self.selection = []
+        self.selbox = []
+    
+    def on_touch_down(self, touch):
+        """
+        Starts a selection (or a pan) if the touch is on the image
+        
+        If this panel is zoomable, the scroll wheel zooms the image and a double tap
+        zooms it back out.  While the image is zoomed in, dragging pans it instead of
+        making a selection.
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if self.picture is None or not self._onImage(touch.pos):
+            return super().on_touch_down(touch)
+        if self.zoomable and touch.is_mouse_scrolling:
+            if touch.button in ('scrolldown','scrollleft'):
+                self.zoomBy(1.25,touch.pos)
+            elif touch.button in ('scrollup','scrollright'):
+                self.zoomBy(0.8,touch.pos)
+            return True
+        if self.zoomable and touch.is_double_tap:
+            self.resetZoom()
+            return True
+        if self.zoomed:
+            touch.grab(self)
+            touch.ud['pan'] = True
+            return True
+        if not self.selectable:
+            return super().on_touch_down(touch)
+        touch.grab(self)
+        touch.ud['anchor'] = self._toImage(touch.pos)
+        self._select(touch.ud['anchor'],touch.ud['anchor'])
+        return True
+    
+    def on_touch_move(self, touch):
+        """
+        Extends the selection being dragged out (if any)
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+        if 'pan' in touch.ud:
+            self._viewport.panBy(touch.dx,touch.dy)
+            self._drawTiles()
+        else:
+            self._select(touch.ud['anchor'],self._toImage(touch.pos))
+        return True
+    
+    def on_touch_up(self, touch):
+        """
+        Finishes the selection being dragged out (if any)
+        
+        A click without a drag clears the selection.
+        
+        Parameter touch: The touch event
+        Precondition: touch is a Kivy MotionEvent
+        """
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+        touch.ungrab(self)
+        if 'pan' in touch.ud:
+            return True
+        corner = self._toImage(touch.pos)
+        if corner == touch.ud['anchor']:
+            self.clearSelection()
+        else:
+            self._select(touch.ud['anchor'],corner)
+        return True
+    
+    # Zoom and pan
+    def zoomBy(self, factor, pos=None):
+        """
+        Zooms the image by the given factor, keeping the point under pos in place
+        
+        The image is drawn as tiles (see imgviewport) for as long as it is zoomed in.
+        Zooming in removes the current selection.
+        
+        Parameter factor: The change in magnification
+        Precondition: factor is a number > 0
+        
+        Parameter pos: The window position to zoom about (the center if None)
+        Precondition: pos is None or a pair of numbers
+        """
+        import imgviewport
+        if self.picture is None:
+            return
+        if self._viewport is None:
+            self._viewport = imgviewport.Viewport(self.picture.getWidth(),self.picture.getHeight(),self.inside)
+            self._texcache = imgviewport.TextureCache()
+        
+        if pos is not None:
+            left, bottom = self._insideOrigin()
+            pos = (pos[0]-left,pos[1]-bottom)
+        self._viewport.zoomBy(factor,pos)
+        self.zoomed = self._viewport.isZoomed()
+        if self.zoomed:
+            self.clearSelection()
+        self._drawTiles()
+    
+    def resetZoom(self):
+        """
+        Zooms out so that the entire image is shown as a single texture again
+        
+        This also drops all of the tile textures.
+        """
+        self._viewport = None
+        if self._texcache is not None:
+            self._texcache.clear()
+        self._texcache = None
+        self.zoomed = False
+        self._drawTiles()
+    
+    def _drawTiles(self):
+        """
+        Redraws the visible tiles of the zoomed image
+        
+        Tiles are taken from the texture cache, and only the tiles missing from it are
+        uploaded.  If the image is not zoomed in, this removes the tiles instead.
+        """
+        if self._tiles is None:
+            self._tiles = InstructionGroup()
+            self.canvas.add(self._tiles)
+        self._tiles.clear()
+        if not self.zoomed:
+            return
+        
+        left, bottom = self._insideOrigin()
+        scale = self._viewport.getScale()
+        level = self._viewport.getLevel(self.pyramid.getDepth())
+        factor = 1 << level
+        
+        self._tiles.add(ScissorPush(x=int(left),y=int(bottom),
+                                    width=int(self.inside[0]),height=int(self.inside[1])))
+        self._tiles.add(Color(1,1,1,1))
+        for tile in self._viewport.getTiles(level):
+            row, col, height, width = tile
+            key = (level,row,col)
+            nbytes  = width*height*self.pyramid.getImage().getChannels()
+            texture = self._texcache.fetch(key,lambda: self._makeTile(level,tile),nbytes)
+            x, y = self._viewport.toScreen(row*factor,col*factor)
+            size = (width*factor*scale,height*factor*scale)
+            self._tiles.add(Rectangle(texture=texture,size=size,pos=(left+x,bottom+y-size[1])))
+        self._tiles.add(ScissorPop())
+    
+    def _makeTile(self, level, tile):
+        """
+        Returns: A new texture for a tile of a pyramid level
+        
+        Parameter level: The pyramid level
+        Precondition: level is a valid level of the pyramid
+        
+        Parameter tile: The tile (row, col, height, width) in level pixels
+        Precondition: tile is a rectangle inside of the level
+        """
+        import textures
+        row, col, height, width = tile
+        with self._lock:
+            region   = self.pyramid.getLevel(level).getRegion(row,col,height,width)
+            data     = region.getPixels().buffer
+            colorfmt = textures.COLORFMTS[region.getChannels()]
+        texture = Texture.create(size=(width,height), colorfmt=colorfmt, bufferfmt='ubyte')
+        texture.mag_filter = 'nearest'
+        texture.blit_buffer(data, colorfmt=colorfmt, bufferfmt='ubyte')
+        texture.flip_vertical()
+        return texture
+    
+    def _insideOrigin(self):
+        """
+        Returns: The window position of the bottom left corner of the panel interior
+        """
+        return (self.x+(self.size[0]-self.inside[0])//2, self.y+(self.size[1]-self.inside[1])//2)
+    
+    def _onImage(self, pos):
+        """
+        Returns: True if the window position pos is on the displayed image
+        
+        When the image is zoomed in, this is any position in the panel interior.
+        
+        Parameter pos: A window position
+        Precondition: pos is a pair of numbers
+        """
+        if self.zoomed:
+            left, bottom = self._insideOrigin()
+            return 0 <= pos[0]-left < self.inside[0] and 0 <= pos[1]-bottom < self.inside[1]
+        x = pos[0]-self.x-self.imageoff[0]
+        y = pos[1]-self.y-self.imageoff[1]
+        return 0 <= x < self.imagesize[0] and 0 <= y < self.imagesize[1]
+    
+    def _toImage(self, pos):
+        """
+        Returns: The image pixel (row, col) under the window position pos
+        
+        Positions off the image are clamped to the nearest pixel.
+        
+        Parameter pos: A window position
+        Precondition: pos is a pair of numbers
+        """
+        width  = self.picture.getWidth()
+        height = self.picture.getHeight()
+        x = (pos[0]-self.x-self.imageoff[0])*width/self.imagesize[0]
+        y = (pos[1]-self.y-self.imageoff[1])*height/self.imagesize[1]
+        col = min(max(int(x),0),width-1)
+        row = min(max(height-1-int(y),0),height-1)
+        return (row,col)
+    
+    def _select(self, start, end):
+        """
+        Selects the rectangle with the given corners (inclusive)
+        
+        Parameter start: The first corner (row, col)
+        Precondition: start is a pair of ints inside the image
+        
+        Parameter end: The opposite corner (row, col)
+        Precondition: end is a pair of ints inside the image
+        """
+        row = min(start[0],end[0])
+        col = min(start[1],end[1])
+        height = abs(start[0]-end[0])+1
+        width  = abs(start[1]-end[1])+1
+        self.selection = [row,col,height,width]
+        
+        xscale = self.imagesize[0]/self.picture.getWidth()
+        yscale = self.imagesize[1]/self.picture.getHeight()
+        left   = self.x+self.imageoff[0]
+        top    = self.y+self.imageoff[1]+self.imagesize[1]
+        self.selbox = [left+col*xscale, top-(row+height)*yscale, width*xscale, height*yscale]
+
+
+def _union(first, second):
+    """
+    Returns: The smallest rectangle containing both rectangles
+    
+    Either rectangle may be None (for no rectangle at all).
+    
+    Parameter first: A rectangle (row, col, height, width)
+    Precondition: first is a tuple of four ints or None
+    
+    Parameter second: A rectangle (row, col, height, width)
+    Precondition: second is a tuple of four ints or None
+    """
+    if first is None:
+        return second
+    if second is None:
+        return first
+    top    = min(first[0],second[0])
+    left   = min(first[1],second[1])
+    bottom = max(first[0]+first[2],second[0]+second[2])
+    right  = max(first[1]+first[3],second[1]+second[3])
+    return (top,left,bottom-top,right-left)
 
 
 class MessagePanel(Widget):
@@ -192,13 +625,17 @@ class AppPanel(BoxLayout):
     """
     # These fields are 'hooks' to connect to the .kv file
     # The source file for the initial image
-    source = StringProperty(ImagePanel.getResource('im_walker.png'))
+    source = StringProperty(ImagePanel.getResource(DEFAULT_IMAGE))
     # The Image object for the loaded file
     picture   = ObjectProperty(None,allownone=True)
     # The editor object for working on the file
     workspace = ObjectProperty(None,allownone=True)
     # The most recent file edit
     workimage = ObjectProperty(None,allownone=True)
+    # The memory held by the edit history (see show_memory)
+    memory    = StringProperty('')
+    # The loader of neighboring files (see imgprefetch)
+    prefetcher = None
     
     def config(self):
         """
@@ -208,8 +645,10 @@ class AppPanel(BoxLayout):
         the other objects. This method does just that. It loads the currently selected 
         image file, and creates an editor for that file (if possible).
         """
+        import imgprefetch
         # For working with pop-ups (Hidden since not .kv aware)
         self._popup = None
+        self.prefetcher = imgprefetch.Prefetcher(imgprefetch.PREFETCH_BUDGET)
         self.place_image('',self.source)
     
     def undo(self):
@@ -223,10 +662,28 @@ class AppPanel(BoxLayout):
         try:
             self.workspace.undo()
             self.workimage.update(self.workspace.getCurrent())
+            self.show_memory()
             self.canvas.ask_update()
         except:
             traceback.print_exc()
             self.error('An error occurred when trying to undo')
+    
+    def redo(self):
+        """
+        Redos the last undone edit to the image.
+        
+        This method will put back the last edit that was undone, without running it 
+        again.  If the ImageHistory class is not implemented correctly, this will display
+        an error message onscreen as well as in the command line.
+        """
+        try:
+            self.workspace.redo()
+            self.workimage.update(self.workspace.getCurrent())
+            self.show_memory()
+            self.canvas.ask_update()
+        except:
+            traceback.print_exc()
+            self.error('An error occurred when trying to redo')
         
     def clear(self):
         """
@@ -239,53 +696,53 @@ class AppPanel(BoxLayout):
         try:
             self.workspace.clear()
             self.workimage.update(self.workspace.getCurrent())
+            self.show_memory()
             self.canvas.ask_update()
         except:
             traceback.print_exc()
             self.error('An error occurred when trying to clear edits')
     
+    def show_memory(self):
+        """
+        Updates the memory readout with the footprint of the edit history
+        
+        The readout is empty if there is no editor.
+        """
+        import imgstats
+        try:
+            self.memory = imgstats.memory_summary(self.workspace.getFootprint())
+        except:
+            self.memory = ''
+    
     def read_image(self, file):
         """
         Returns: An Image object for the give file.
         
-        If it cannot read the image (either Image is not defined or the file is not
-        an image file), this method returns None.
+        Native image files (see imgfile) are memory mapped instead of decoded, as are
+        files in the cache of decoded images (see imgcache).  Once the file is read, the
+        files next to it in its folder are loaded in the background (see imgprefetch), 
+        so stepping through a folder does not wait on decoding.  If it cannot read the 
+        image (either Image is not defined or the file is not an image file), this 
+        method returns None.
         
         Parameter file: An absolute path to an image file
         Precondition: file is a string
         """
-        import pixels
-        import array
-        import a6image
-        from PIL import Image as CoreImage
-
+        import imgfile
+        
         try:
-            image = CoreImage.open(file)
-            image = image.convert("RGB")
-            flatten = []
-            for pixel in image.getdata():
-                flatten.append(pixel[0])
-                flatten.append(pixel[1])
-                flatten.append(pixel[2])
-            buffer = array.array('B',flatten)
-            size  = image.size[0]*image.size[1]
-            width = image.size[0]
+            image = None
+            if self.prefetcher is not None:
+                image = self.prefetcher.take(file)
+            if image is None:
+                image = imgfile.read_image(file)
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch(file)
+            return image
         except:
             traceback.print_exc()
             self.error('Could not load the image file')
-            buffer = None
-        
-        result = None
-        if not buffer is None:
-            data = pixels.Pixels(0)
-            data._size   = size
-            data._buffer = buffer
-            try:
-                result = a6image.Image(data,width)
-            except:
-                traceback.print_exc()
-                result = None
-        return result
+        return None
     
     def place_image(self, path, filename):
         """
@@ -308,14 +765,15 @@ class AppPanel(BoxLayout):
         else:
             file = os.path.join(path,filename)
         
-        import a6editor
+        import imgeditor
         self.picture = self.read_image(file)
         try:
-            self.workspace = a6editor.Editor(self.picture)
+            self.workspace = imgeditor.Editor(self.picture)
             self.workimage.setImage(self.workspace.getCurrent())
         except:
             self.workspace = None
             self.workimage.setImage(self.picture)
+        self.show_memory()
         self.canvas.ask_update()
     
     # Dialog options
@@ -399,10 +857,11 @@ class AppPanel(BoxLayout):
     # Image saving helpers
     def check_save_png(self, path, filename):
         """
-        Saves the current image to a file, checking first that the format is PNG
+        Saves the current image to a file, checking first that the format is supported
         
-        If user uses another extension, or no extension at all, this method forces
-        the file to be a .png
+        The image may be saved as a .png or in the native format (see imgfile).  If user 
+        uses another extension, or no extension at all, this method forces the file to be 
+        a .png
         
         Parameter path: The base path to the file
         Precondition: path is a string
@@ -411,6 +870,7 @@ class AppPanel(BoxLayout):
         Precondition: filename is a string
         """
         import os.path
+        import imgfile
         self.dismiss_popup()
         
         if os.path.isabs(filename):
@@ -418,7 +878,7 @@ class AppPanel(BoxLayout):
         else:
             file = os.path.join(path,filename)
         
-        if file.lower().endswith('.png'):
+        if file.lower().endswith(imgfile.SAVE_EXTS):
             self.save_png(file)
         else:
             file = os.path.splitext(file)[0]+'.png'
@@ -435,7 +895,8 @@ class AppPanel(BoxLayout):
         Precondition: filename is a string
         """
         import os.path
-        assert filename.lower().endswith('.png')
+        import imgfile
+        assert filename.lower().endswith(imgfile.SAVE_EXTS)
         self.dismiss_popup()
         if os.path.isfile(filename):
             msg = 'File {} exists.\nOverwrite?'
@@ -447,22 +908,18 @@ class AppPanel(BoxLayout):
         """
         Saves the current image, without user confirmation.
         
+        This saves the full-resolution result of the edits (see Editor.getResult).
+        The format is chosen from the file extension (see imgfile.write_image).
+        
         Parameter filename: An absolute filename
         Precondition: filename is a string
         """
         import os.path
-        import traceback
+        import imgfile
         self.dismiss_popup()
         
-        # prepare image for saving
-        from PIL import Image as CoreImage
-
-        # This worked (Unlike Kivy)!  But is slow.
-        current = self.workspace.getCurrent()
         try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getPixels()))
-            im.save(filename,'PNG')
+            imgfile.write_image(self.workspace.getResult(),filename)
         except:
             traceback.print_exc()
-            self.error('Cannot save image file ' + os.path.split(filename)[1])
\ No newline at end of file
+            self.error('Cannot save image file ' + os.path.split(filename)[1])
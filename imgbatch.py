@@ -0,0 +1,124 @@
+"""
+Headless (GUI-less) processing for the imager application
+
+This module applies a chain of Editor operations to an image file without starting
+Kivy.  An operation chain is written as a comma separated list of Editor method names,
+with any arguments separated from the name (and each other) by colons.  For example
+
+    monochromify:true,vignette,pixellate:20
+
+Arguments that look like integers are converted to ints, and true/false are converted
+to bools.  Everything else is passed as a string.
+
+Pipelines of several processes should pass intermediate results in the native format
+(see imgfile), as those files are written and read without any encoding step.
+"""
+import imgfile
+import imgeditor
+
+
+def parse_chain(text):
+    """
+    Returns: The operation chain for the given text as a list of (name, args) pairs
+
+    The value args is a tuple of the arguments for the operation name.  An empty
+    string is an empty chain.
+
+    Parameter text: The operation chain (see the module comment)
+    Precondition: text is a string
+    """
+    assert type(text) == str, repr(text)+' is not a string'
+
+    chain = []
+    for step in text.split(','):
+        step = step.strip()
+        if not step:
+            continue
+        parts = step.split(':')
+        name  = parts[0]
+        if name.startswith('_') or not callable(getattr(imgeditor.Editor,name,None)):
+            raise ValueError(repr(name)+' is not an Editor operation')
+        chain.append((name,tuple(_parse_arg(arg) for arg in parts[1:])))
+    return chain
+
+
+def parse_region(text):
+    """
+    Returns: The rectangle (row, col, height, width) for the given text
+
+    The text is four comma separated integers, such as 10,20,100,200.
+
+    Parameter text: The rectangle text
+    Precondition: text is a string
+    """
+    values = tuple(int(value) for value in text.split(','))
+    if len(values) != 4:
+        raise ValueError(repr(text)+' is not a rectangle row,col,height,width')
+    return values
+
+
+def run_chain(editor, chain, region=None):
+    """
+    Applies the operation chain to the editor, one edit per operation
+
+    Parameter editor: The editor to modify
+    Precondition: editor is an Editor object
+
+    Parameter chain: The operations to apply
+    Precondition: chain is a list of (name, args) pairs, as returned by parse_chain
+
+    Parameter region: The region of interest (see Editor.perform)
+    Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+    """
+    for name, args in chain:
+        editor.increment(region)
+        editor.perform(name,*args,region=region)
+
+
+def process(source, chain, output, region=None, recorder=None):
+    """
+    Returns: The editor used to read source, apply the chain, and write the result
+    
+    This reads the image source, applies the operation chain, and writes the result to
+    output.  Operations use the shared cache of results (see imgmemo), so running the
+    same chain on the same image again is fast.
+
+    The output format is chosen from the output file extension (see imgfile).
+
+    Parameter source: The input image file
+    Precondition: source is a string
+
+    Parameter chain: The operations to apply
+    Precondition: chain is a list of (name, args) pairs, as returned by parse_chain
+
+    Parameter output: The output image file
+    Precondition: output is a string
+
+    Parameter region: The region of interest (see Editor.perform)
+    Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+    
+    Parameter recorder: The recorder to measure the operations with (see imgstats)
+    Precondition: recorder is an imgstats.Recorder object or None
+    """
+    import imgmemo
+    editor = imgeditor.Editor(imgfile.read_image(source))
+    editor.setRecorder(recorder)
+    editor.setMemo(imgmemo.get_memo())
+    run_chain(editor,chain,region)
+    imgfile.write_image(editor.getCurrent(),output)
+    return editor
+
+
+def _parse_arg(text):
+    """
+    Returns: The argument value for the given text
+
+    Parameter text: The argument text
+    Precondition: text is a string
+    """
+    if text.lower() in ('true','false'):
+        return text.lower() == 'true'
+    try:
+        return int(text)
+    except ValueError:
+        return text
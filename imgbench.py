@@ -0,0 +1,125 @@
+"""
+A startup benchmark for the imager application
+
+Every start of the application imports the image modules, loads the default image and
+makes an Editor for it.  The GUI also imports Kivy.  This module times each of those
+steps in a fresh Python process, since only a fresh process pays for the imports.  The
+first run is a warm up that is not counted (it puts the image in the cache of decoded
+images, see imgcache); the other runs report the fastest time of each step.
+
+The benchmark passes if the total time, including starting Python, is under a target.
+The GUI import is timed only if Kivy is installed, and is never counted in the total,
+as it depends more on the graphics drivers than on this application.
+"""
+import os
+import sys
+import json
+import subprocess
+
+
+# The time allowed for a start without the GUI, in seconds
+STARTUP_TARGET = 0.5
+
+# The steps that are timed, in order
+STEPS = ('import','load','editor','gui')
+
+# The program run in each process.  Arguments are the image file and whether to time the GUI.
+_PROGRAM = '''
+import sys, time, json
+times = {}
+start = time.perf_counter()
+import imgfile, imgeditor
+times['import'] = time.perf_counter()-start
+start = time.perf_counter()
+image = imgfile.read_image(sys.argv[1],cached=True)
+times['load'] = time.perf_counter()-start
+start = time.perf_counter()
+editor = imgeditor.Editor(image)
+times['editor'] = time.perf_counter()-start
+if sys.argv[2] == '1':
+    start = time.perf_counter()
+    import filter
+    times['gui'] = time.perf_counter()-start
+print(json.dumps(times))
+'''
+
+
+def default_image():
+    """
+    Returns: The absolute path of the image shown when the GUI starts without one
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),'im_walker.png')
+
+
+def has_gui():
+    """
+    Returns: True if Kivy is installed, so the GUI import can be timed
+    """
+    import importlib.util
+    return importlib.util.find_spec('kivy') is not None
+
+
+def measure(image=None, gui=None, runs=3):
+    """
+    Returns: The fastest time of each startup step, as a dictionary
+
+    The dictionary maps each step in STEPS (that was timed) to its time in seconds.  It
+    also has the key 'total', for the time to start Python and run every step but 'gui'.
+
+    Parameter image: The image file to load (the default image if None)
+    Precondition: image is a filename string or None
+
+    Parameter gui: Whether to time the GUI import (if Kivy is installed when None)
+    Precondition: gui is a bool or None
+
+    Parameter runs: The number of counted runs
+    Precondition: runs is an int > 0
+    """
+    import time
+    assert type(runs) == int and runs > 0, repr(runs)+' is not a valid number of runs'
+    image = default_image() if image is None else os.path.abspath(image)
+    gui = has_gui() if gui is None else gui
+
+    env = dict(os.environ)
+    env['KIVY_NO_ARGS'] = '1'
+    env['KIVY_NO_CONSOLELOG'] = '1'
+    folder = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join([folder]+([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    command = [sys.executable,'-c',_PROGRAM,image,'1' if gui else '0']
+
+    result = {}
+    for run in range(runs+1):
+        start = time.perf_counter()
+        output = subprocess.run(command,env=env,cwd=folder,check=True,
+                                stdout=subprocess.PIPE,universal_newlines=True).stdout
+        total = time.perf_counter()-start
+        times = json.loads(output.strip().splitlines()[-1])
+        # The GUI import is not part of the total
+        times['total'] = total-times.get('gui',0)
+        if run > 0:
+            for key, value in times.items():
+                result[key] = min(value,result.get(key,value))
+    return result
+
+
+def report(times, target=STARTUP_TARGET, out=None):
+    """
+    Returns: True if the total startup time is under target, after printing the times
+
+    Parameter times: The startup times
+    Precondition: times is a dictionary returned by measure
+
+    Parameter target: The time allowed for a start without the GUI, in seconds
+    Precondition: target is a number > 0
+
+    Parameter out: The stream to print to (standard output if None)
+    Precondition: out is a text stream or None
+    """
+    out = sys.stdout if out is None else out
+    for step in STEPS:
+        if step in times:
+            print('{:<8} {:>8.1f} ms'.format(step,times[step]*1000),file=out)
+    passed = times['total'] < target
+    print('{:<8} {:>8.1f} ms (target {:.0f} ms): {}'.format('total',times['total']*1000,
+          target*1000,'pass' if passed else 'FAIL'),file=out)
+    return passed
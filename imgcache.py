@@ -0,0 +1,238 @@
+"""
+An on-disk cache of decoded images
+
+Decoding a large PNG or JPEG with PIL (and flattening it into a pixel buffer) is by far
+the slowest part of opening it.  So the first time an image file is decoded, a copy is
+saved in this cache in the native format (see imgfile).  The next time the same file is
+opened, the copy is memory mapped instead, which takes almost no time.
+
+An entry belongs to one version of one file.  Its name is a hash of the absolute path,
+size and modification time of the file, so an entry is never used once the file has
+changed (or moved).  Those old entries are never read again, and age out of the cache.
+
+The cache has a size limit.  When it is over that limit, the least recently used entries
+are removed.  The use of an entry is its modification time, which is updated on every
+hit.  Several processes (such as the GUI and a batch job) may share one cache, as
+entries are written atomically.
+"""
+import os
+import hashlib
+import imgfile
+
+
+# The default directory of the cache
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),'.cache'),'imager')
+
+# The default size limit of the cache, in bytes
+CACHE_LIMIT = 1024*1024*1024
+
+
+class DecodeCache(object):
+    """
+    A class representing a directory of decoded images
+
+    MUTABLE ATTRIBUTES
+        _limit: The most bytes of entries to keep             [int >= 0]
+
+    IMMUTABLE ATTRIBUTES
+        _directory: The directory of the entries              [str]
+    """
+
+    def getDirectory(self):
+        """
+        Returns: The directory of the cache entries
+        """
+        return self._directory
+
+    def getLimit(self):
+        """
+        Returns: The most bytes of entries that this cache keeps
+        """
+        return self._limit
+
+    def setLimit(self, value):
+        """
+        Sets the most bytes of entries that this cache keeps, removing entries if needed
+
+        Parameter value: The new limit (0 to not cache anything)
+        Precondition: value is an int >= 0
+        """
+        assert type(value) == int and value >= 0, repr(value)+' is not a valid limit'
+        self._limit = value
+        self.trim()
+
+    def getUsed(self):
+        """
+        Returns: The bytes of entries in this cache
+        """
+        return sum(size for _, _, size in self._entries())
+
+    def __init__(self, directory=CACHE_DIR, limit=CACHE_LIMIT):
+        """
+        Initializer: Creates a cache in the given directory
+
+        The directory is made when the first entry is saved.
+
+        Parameter directory: The directory of the entries
+        Precondition: directory is a string
+
+        Parameter limit: The most bytes of entries to keep
+        Precondition: limit is an int >= 0
+        """
+        assert type(directory) == str, repr(directory)+' is not a valid directory'
+        assert type(limit) == int and limit >= 0, repr(limit)+' is not a valid limit'
+        self._directory = directory
+        self._limit = limit
+
+    def entry(self, file):
+        """
+        Returns: The path of the cache entry for the current version of file
+
+        Parameter file: An image file
+        Precondition: file is the name of an existing file
+        """
+        info = os.stat(file)
+        key = '{}|{}|{}'.format(os.path.abspath(file),info.st_size,info.st_mtime_ns)
+        return self.path(hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def path(self, name):
+        """
+        Returns: The path of the cache entry with the given name
+
+        Parameter name: The entry name (without the extension)
+        Precondition: name is a string of letters and digits
+        """
+        return os.path.join(self._directory,name+imgfile.NATIVE_EXT)
+
+    def lookup(self, file):
+        """
+        Returns: The cached Image for file, or None if it is not cached
+
+        The Image is backed by a memory map of the entry (see imgfile.read_native).
+
+        Parameter file: An image file
+        Precondition: file is the name of an existing file
+        """
+        return self.get(self.entry(file))
+
+    def store(self, file, image):
+        """
+        Saves image as the cache entry for file, and removes the oldest entries if needed
+
+        Nothing is saved if the image alone is over the limit, or if the entry cannot be
+        written (such as on a full disk).
+
+        Parameter file: An image file
+        Precondition: file is the name of an existing file
+
+        Parameter image: The decoded contents of file
+        Precondition: image is an Image object
+        """
+        self.put(self.entry(file),image)
+
+    def get(self, entry):
+        """
+        Returns: The Image in the given cache entry, or None if there is no such entry
+
+        Parameter entry: The entry path (see entry and path)
+        Precondition: entry is a string
+        """
+        try:
+            image = imgfile.read_native(entry)
+            os.utime(entry)
+            return image
+        except (OSError, ValueError):
+            return None
+
+    def put(self, entry, image):
+        """
+        Saves image in the given cache entry, and removes the oldest entries if needed
+
+        Nothing is saved if the image alone is over the limit, or if the entry cannot be
+        written.
+
+        Parameter entry: The entry path (see entry and path)
+        Precondition: entry is a string
+
+        Parameter image: The image to save
+        Precondition: image is an Image object
+        """
+        if image.getLength()*image.getChannels() > self._limit:
+            return
+        try:
+            os.makedirs(self._directory,exist_ok=True)
+            imgfile.write_native(image,entry)
+        except OSError:
+            return
+        self.trim()
+
+    def fetch(self, file):
+        """
+        Returns: The Image stored in file, decoding it only if it is not cached
+
+        Parameter file: An image file (PNG, JPEG, GIF)
+        Precondition: file is the name of an existing file
+        """
+        image = self.lookup(file)
+        if image is None:
+            image = imgfile.decode_file(file)
+            self.store(file,image)
+        return image
+
+    def trim(self):
+        """
+        Removes the least recently used entries until the cache is within its limit
+        """
+        entries = sorted(self._entries())
+        used = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if used <= self._limit:
+                break
+            try:
+                os.remove(path)
+                used -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        """
+        Removes every entry in the cache
+        """
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _entries(self):
+        """
+        Returns: A list of (last use, path, size) for each entry in the cache
+        """
+        result = []
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return result
+        for name in names:
+            if name.endswith(imgfile.NATIVE_EXT):
+                path = os.path.join(self._directory,name)
+                try:
+                    info = os.stat(path)
+                    result.append((info.st_mtime_ns,path,info.st_size))
+                except OSError:
+                    pass
+        return result
+
+
+# The cache shared by every reader in this process (see get_cache)
+_shared = None
+
+
+def get_cache():
+    """
+    Returns: The decode cache shared by this process, made on first use
+    """
+    global _shared
+    if _shared is None:
+        _shared = DecodeCache()
+    return _shared
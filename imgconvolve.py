@@ -0,0 +1,614 @@
+"""
+Convolution filters for images
+
+The functions in this module blur, sharpen, find edges and emboss an Image.  Each filter
+is a convolution with a separable kernel (or a combination of two), so it is computed
+as two 1-D passes: one along the rows and one along the columns.  A pass works on one
+color channel of the image (a plane) at a time, kept as a flat list of ints, and each
+tap of the kernel is a single map over a shifted slice of that list.  So the passes loop
+in C, like the kernels of imgkernels.
+
+Box kernels do not even need one map per tap.  A pass of a box blur is a sliding window
+sum, which is the difference of two shifted slices of the running sums of the plane.  So
+its cost does not depend on the radius.  The Gaussian kernel does not allow this, and
+costs one map per tap in each pass.
+
+The filters use integer weights, and only round once (after both passes).  Pixels past
+the edge of the image count as copies of the nearest edge pixel.  Like the Editor
+methods, the filters never change the alpha of pixels with alpha, and grey images stay
+grey.
+
+Large images are split into bands of rows, with enough rows above and below each band
+for the kernel, and the bands are filtered in a pool of worker processes (the filters
+are pure Python, so threads would share one interpreter lock).  See PARALLEL_PIXELS.
+The pool is made on first use and shared by every filter after that.  By default, the
+filters do not start processes when they are already running in a worker (a worker
+process, or a thread other than the main one), or when PARALLEL is False.
+"""
+import math
+import operator
+import itertools
+import os
+import threading
+import pixels
+
+
+# The fewest pixels in an image that is filtered with worker processes (by default)
+PARALLEL_PIXELS = 1 << 20
+
+# Whether the filters may start worker processes by default (the GUI turns this off)
+PARALLEL = True
+
+# The pool of worker processes shared by the filters (see _get_pool)
+_pool = None
+
+# The number of processes in the shared pool
+_pool_size = 0
+
+# The lock guarding the shared pool
+_pool_lock = threading.Lock()
+
+# The weights of the Sobel kernels (see sobel_edges)
+_SMOOTH = (1, 2, 1)
+_SLOPE  = (-1, 0, 1)
+
+# The scale of the Gaussian weights (the weight of the center tap)
+_SCALE = 1024
+
+
+def gaussian_blur(image, radius, workers=None):
+    """
+    Blurs the image with a Gaussian kernel of the given radius
+
+    The kernel has standard deviation radius/2, and is cut off after radius pixels on
+    each side of the center.
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter radius: The radius of the kernel
+    Precondition: radius is an int > 0
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    assert type(radius) == int and radius > 0, repr(radius)+' is not a valid radius'
+    _filter(image,'gaussian',(radius,),radius,workers)
+
+
+def box_blur(image, radius, workers=None):
+    """
+    Blurs the image with a box kernel of the given radius
+
+    Each pixel becomes the average of the (2*radius+1) x (2*radius+1) square around it.
+    The cost does not depend on the radius.
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter radius: The radius of the kernel
+    Precondition: radius is an int > 0
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    assert type(radius) == int and radius > 0, repr(radius)+' is not a valid radius'
+    _filter(image,'box',(radius,),radius,workers)
+
+
+def unsharp_mask(image, radius, amount, workers=None):
+    """
+    Sharpens the image with an unsharp mask
+
+    Each pixel moves away from the Gaussian blur of the image (see gaussian_blur) by
+    amount percent of its difference to the blur.
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter radius: The radius of the blur
+    Precondition: radius is an int > 0
+
+    Parameter amount: The strength of the sharpening, in percent
+    Precondition: amount is an int >= 0
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    assert type(radius) == int and radius > 0, repr(radius)+' is not a valid radius'
+    assert type(amount) == int and amount >= 0, repr(amount)+' is not a valid amount'
+    _filter(image,'unsharp',(radius,amount),radius,workers)
+
+
+def sobel_edges(image, workers=None):
+    """
+    Replaces the image with the strength of its edges
+
+    The strength is the length of the gradient computed by the Sobel kernels, and is
+    cut off at 255.  Each color channel is filtered on its own.
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    _filter(image,'sobel',(),1,workers)
+
+
+def emboss(image, workers=None):
+    """
+    Embosses the image, so that it looks like a relief
+
+    The result is mid grey (128) plus half the sum of the two Sobel gradients.  So flat
+    areas are grey, and edges are lighter (or darker) if the image gets brighter (or
+    darker) towards the bottom right.
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    _filter(image,'emboss',(),1,workers)
+
+
+def gaussian_weights(radius):
+    """
+    Returns: The integer weights of the Gaussian kernel with the given radius
+
+    The result has 2*radius+1 weights, and the center one is _SCALE.
+
+    Parameter radius: The radius of the kernel
+    Precondition: radius is an int > 0
+    """
+    sigma = radius/2
+    return [round(_SCALE*math.exp(-offset*offset/(2*sigma*sigma))) for offset in range(-radius,radius+1)]
+
+
+# HIDDEN FUNCTIONS
+def _filter(image, name, args, halo, workers):
+    """
+    Replaces the image with the result of the filter name
+
+    Parameter image: The image to filter
+    Precondition: image is an Image object
+
+    Parameter name: The filter to apply
+    Precondition: name is a key of _PLANES
+
+    Parameter args: The arguments of the filter
+    Precondition: args is a tuple of valid arguments for the filter
+
+    Parameter halo: The number of rows above and below a pixel that the filter reads
+    Precondition: halo is an int >= 0
+
+    Parameter workers: The number of worker processes (see PARALLEL_PIXELS if None)
+    Precondition: workers is an int > 0 or None
+    """
+    assert workers is None or (type(workers) == int and workers > 0), repr(workers)+' is not a valid worker count'
+    width  = image.getWidth()
+    height = image.getHeight()
+    if workers is None:
+        workers = (os.cpu_count() or 1) if width*height >= PARALLEL_PIXELS and _may_fork() else 1
+    workers = min(workers,height)
+
+    data     = image.getPixels()[0:width*height]
+    channels = data.channels
+    source   = bytes(data.buffer)
+    if workers == 1:
+        result = _filter_band(name,args,source,channels,width,height,0)
+    else:
+        span  = width*channels
+        rows  = -(-height // workers)
+        tasks = []
+        for top in range(0,height,rows):
+            count = min(rows,height-top)
+            above = min(halo,top)
+            below = min(halo,height-top-count)
+            band  = source[(top-above)*span:(top+count+below)*span]
+            tasks.append((band,above+count+below,above,count))
+        pool = _get_pool(len(tasks))
+        futures = [pool.submit(_filter_band,name,args,band,channels,width,total,above)
+                   for band, total, above, count in tasks]
+        result = b''.join(future.result()[:task[3]*span] for future, task in zip(futures,tasks))
+    image.getPixels()[0:width*height] = pixels.Pixels.fromBuffer(bytearray(result),channels)
+
+
+def _may_fork():
+    """
+    Returns: True if the filters may start worker processes by default
+
+    This is False if PARALLEL is False, in a worker process (such as those of imgserver
+    or imgbatch), and in any thread other than the main one.  Those are already one of
+    many workers, and forking a process with other running threads is not safe.
+    """
+    import multiprocessing
+    if not PARALLEL or multiprocessing.parent_process() is not None:
+        return False
+    return threading.current_thread() is threading.main_thread()
+
+
+def _get_pool(workers):
+    """
+    Returns: The pool of worker processes shared by the filters
+
+    The pool is made on first use.  If it has fewer than workers processes, it is
+    replaced by a larger one (the tasks of the old pool still finish).
+
+    Parameter workers: The number of processes needed
+    Precondition: workers is an int > 0
+    """
+    import concurrent.futures
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size < workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = concurrent.futures.ProcessPoolExecutor(workers)
+            _pool_size = workers
+        return _pool
+
+
+def _filter_band(name, args, source, channels, width, height, above):
+    """
+    Returns: The filtered bytes of a band of rows, without the rows above it
+
+    This is the work of one worker process.  The band is filtered as if it were the
+    entire image, so the halo rows (above and below it) are only read.  The result ends
+    with the halo rows below the band, which the caller drops.
+
+    Parameter name: The filter to apply
+    Precondition: name is a key of _PLANES
+
+    Parameter args: The arguments of the filter
+    Precondition: args is a tuple of valid arguments for the filter
+
+    Parameter source: The bytes of the band, including the halo rows
+    Precondition: source is a bytes object of width*height pixels
+
+    Parameter channels: The number of channels of each pixel
+    Precondition: channels is 1, 3 or 4
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows in source (including the halo rows)
+    Precondition: height is an int > 0
+
+    Parameter above: The number of halo rows above the band
+    Precondition: above is an int >= 0
+    """
+    plane  = _PLANES[name]
+    start  = above*width*channels
+    result = bytearray(source[start:])
+    for channel in range(min(channels,3)):
+        values = plane(list(source[channel::channels]),width,height,*args)
+        result[channel::channels] = bytes(values[above*width:])
+    return bytes(result)
+
+
+def _gaussian_plane(values, width, height, radius):
+    """
+    Returns: The plane values blurred with a Gaussian kernel (see gaussian_blur)
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The radius of the kernel
+    Precondition: radius is an int > 0
+    """
+    weights = gaussian_weights(radius)
+    values  = _convolve_cols(_convolve_rows(values,width,height,weights),width,height,weights)
+    return _divide(values,sum(weights)**2)
+
+
+def _box_plane(values, width, height, radius):
+    """
+    Returns: The plane values blurred with a box kernel (see box_blur)
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The radius of the kernel
+    Precondition: radius is an int > 0
+    """
+    values = _slide_cols(_slide_rows(values,width,height,radius),width,height,radius)
+    return _divide(values,(2*radius+1)**2)
+
+
+def _unsharp_plane(values, width, height, radius, amount):
+    """
+    Returns: The plane values sharpened with an unsharp mask (see unsharp_mask)
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The radius of the blur
+    Precondition: radius is an int > 0
+
+    Parameter amount: The strength of the sharpening, in percent
+    Precondition: amount is an int >= 0
+    """
+    blurred = _gaussian_plane(values,width,height,radius)
+    detail  = map(operator.sub,values,blurred)
+    shifts  = map((100).__rfloordiv__,map((50).__add__,map(amount.__mul__,detail)))
+    return _clamp(map(operator.add,values,shifts))
+
+
+def _sobel_plane(values, width, height):
+    """
+    Returns: The strength of the edges of the plane values (see sobel_edges)
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+    """
+    across, down = _gradients(values,width,height)
+    return _clamp(map(int,map(math.hypot,across,down)))
+
+
+def _emboss_plane(values, width, height):
+    """
+    Returns: The plane values embossed (see emboss)
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+    """
+    across, down = _gradients(values,width,height)
+    return _clamp(map((128).__add__,map((2).__rfloordiv__,map(operator.add,across,down))))
+
+
+# The plane function of each filter
+_PLANES = {'gaussian': _gaussian_plane, 'box': _box_plane, 'unsharp': _unsharp_plane,
+           'sobel': _sobel_plane, 'emboss': _emboss_plane}
+
+
+def _gradients(values, width, height):
+    """
+    Returns: The pair of the horizontal and vertical Sobel gradients of values
+
+    Each Sobel kernel is a slope along one axis, smoothed along the other.
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints 0..255
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+    """
+    across = _convolve_rows(_convolve_cols(values,width,height,_SMOOTH),width,height,_SLOPE)
+    down   = _convolve_cols(_convolve_rows(values,width,height,_SMOOTH),width,height,_SLOPE)
+    return across, down
+
+
+def _convolve_rows(values, width, height, weights):
+    """
+    Returns: The convolution of each row of values with the given weights
+
+    Each row is padded with copies of its end pixels, and the rows are joined.  Then
+    every tap is one map over a slice of the padded rows.  Only the sums that start in
+    a row (and not the padding) are kept.
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter weights: The weights of the kernel, centered on the pixel
+    Precondition: weights is a sequence of an odd number of ints
+    """
+    radius = len(weights)//2
+    padded = _pad_rows(values,width,height,radius)
+    sums   = _taps(padded,weights,1,len(padded)-2*radius)
+    span   = width+2*radius
+    result = []
+    for start in range(0,height*span,span):
+        result += sums[start:start+width]
+    return result
+
+
+def _convolve_cols(values, width, height, weights):
+    """
+    Returns: The convolution of each column of values with the given weights
+
+    The plane is padded with copies of its first and last rows.  Then every tap is one
+    map over a slice of the padded plane, shifted by whole rows.
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter weights: The weights of the kernel, centered on the pixel
+    Precondition: weights is a sequence of an odd number of ints
+    """
+    radius = len(weights)//2
+    padded = values[:width]*radius+values+values[-width:]*radius
+    return _taps(padded,weights,width,width*height)
+
+
+def _slide_rows(values, width, height, radius):
+    """
+    Returns: The sums of the 2*radius+1 pixels around each pixel of its row
+
+    The sums are the differences of the running sums of the padded rows (see
+    _convolve_rows), so the cost does not depend on the radius.
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The radius of the window
+    Precondition: radius is an int > 0
+    """
+    running = list(itertools.accumulate(_pad_rows(values,width,height,radius),initial=0))
+    size    = 2*radius+1
+    sums    = list(map(operator.sub,running[size:],running[:-size]))
+    span    = width+2*radius
+    result  = []
+    for start in range(0,height*span,span):
+        result += sums[start:start+width]
+    return result
+
+
+def _slide_cols(values, width, height, radius):
+    """
+    Returns: The sums of the 2*radius+1 pixels around each pixel of its column
+
+    The running sums of each column are computed one row at a time, and the sums are
+    their differences (so the cost does not depend on the radius).
+
+    Parameter values: The plane to filter
+    Precondition: values is a list of width*height ints
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The radius of the window
+    Precondition: radius is an int > 0
+    """
+    padded  = values[:width]*radius+values+values[-width:]*radius
+    total   = [0]*width
+    running = list(total)
+    for start in range(0,len(padded),width):
+        total = list(map(operator.add,total,padded[start:start+width]))
+        running += total
+    size = (2*radius+1)*width
+    return list(map(operator.sub,running[size:],running[:-size]))
+
+
+def _pad_rows(values, width, height, radius):
+    """
+    Returns: The rows of values joined, each with radius copies of its end pixels
+
+    Parameter values: The plane to pad
+    Precondition: values is a list of width*height ints
+
+    Parameter width: The number of pixels in a row
+    Precondition: width is an int > 0
+
+    Parameter height: The number of rows
+    Precondition: height is an int > 0
+
+    Parameter radius: The number of copies at each end
+    Precondition: radius is an int >= 0
+    """
+    padded = []
+    for start in range(0,width*height,width):
+        padded += [values[start]]*radius
+        padded += values[start:start+width]
+        padded += [values[start+width-1]]*radius
+    return padded
+
+
+def _taps(padded, weights, stride, length):
+    """
+    Returns: The weighted sums of the padded values, for each of the first length starts
+
+    The sum for start pos is the sum of weights[k]*padded[pos+k*stride].  Two mirrored
+    taps with the same weight (or opposite weights) are added (or subtracted) first, so
+    they only need one multiplication.
+
+    Parameter padded: The values to sum
+    Precondition: padded is a list of ints with (len(weights)-1)*stride+length elements
+
+    Parameter weights: The weights of the taps
+    Precondition: weights is a sequence of an odd number of ints
+
+    Parameter stride: The distance between taps
+    Precondition: stride is an int > 0
+
+    Parameter length: The number of sums
+    Precondition: length is an int >= 0
+    """
+    last  = len(weights)-1
+    terms = []
+    for pos in range(last//2+1):
+        weight  = weights[pos]
+        mirror  = weights[last-pos]
+        shifted = padded[pos*stride:pos*stride+length]
+        if pos < last-pos:
+            other = padded[(last-pos)*stride:(last-pos)*stride+length]
+            if mirror == weight:
+                shifted = map(operator.add,shifted,other)
+            elif mirror == -weight:
+                shifted = map(operator.sub,shifted,other)
+            elif mirror != 0:
+                terms.append(map(mirror.__mul__,other))
+        if weight != 0:
+            terms.append(shifted if weight == 1 else map(weight.__mul__,shifted))
+    sums = list(terms[0]) if terms else [0]*length
+    for term in terms[1:]:
+        sums = list(map(operator.add,sums,term))
+    return sums
+
+
+def _divide(values, total):
+    """
+    Returns: The values divided by total, rounded to the nearest int
+
+    Parameter values: The sums to divide
+    Precondition: values is an iterable of ints >= 0
+
+    Parameter total: The divisor
+    Precondition: total is an int > 0
+    """
+    return list(map(total.__rfloordiv__,map((total//2).__add__,values)))
+
+
+def _clamp(values):
+    """
+    Returns: The values cut off to the range 0..255
+
+    Parameter values: The values to cut off
+    Precondition: values is an iterable of ints
+    """
+    return list(map(min,map(max,values,itertools.repeat(0)),itertools.repeat(255)))
@@ -0,0 +1,366 @@
+"""
+Drawing primitives for images
+
+The functions in this module draw filled rectangles, lines, circles and polygons on an
+Image, as well as overlays (borders, grids and crop marks) built from them.  Every
+shape is broken up into runs of pixels, and each run is written with a single slice
+assignment to the pixel list (see Pixels.__setitem__), rather than one setPixel call
+per pixel.  A run is part of a row, or for a narrow rectangle of a flat pixel list, a
+column (which is an extended slice).  So drawing works at the speed of copying memory.
+
+Shapes are clipped to the image, so they can be partly (or entirely) outside of it.
+Like setPixel, drawing keeps the alpha of pixels with alpha, and drawing a color that
+is not grey on a grey image converts it to 3 channels.
+
+Positions are given as row and column, in the same order as getPixel.
+"""
+import math
+import pixels
+
+
+def fill_rect(image, row, col, height, width, pixel):
+    """
+    Fills a rectangle of the image with the given color
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter row: The top row of the rectangle
+    Precondition: row is an int
+
+    Parameter col: The left column of the rectangle
+    Precondition: col is an int
+
+    Parameter height: The number of rows in the rectangle
+    Precondition: height is an int >= 0
+
+    Parameter width: The number of columns in the rectangle
+    Precondition: width is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert type(row) == int and type(col) == int, repr((row,col))+' is not a position'
+    assert type(height) == int and height >= 0, repr(height)+' is not a valid height'
+    assert type(width) == int and width >= 0, repr(width)+' is not a valid width'
+    _check_pixel(pixel)
+
+    across = image.getWidth()
+    top    = max(row,0)
+    bottom = min(row+height,image.getHeight())
+    left   = max(col,0)
+    right  = min(col+width,across)
+    if top >= bottom or left >= right:
+        return
+
+    data = image.getPixels()
+    if left == 0 and right == across:
+        _paint(data,slice(top*across,bottom*across),(bottom-top)*across,pixel)
+    elif right-left < bottom-top and type(data) == pixels.Pixels:
+        for pos in range(left,right):
+            _paint(data,slice(top*across+pos,(bottom-1)*across+pos+1,across),bottom-top,pixel)
+    else:
+        for pos in range(top,bottom):
+            _paint(data,slice(pos*across+left,pos*across+right),right-left,pixel)
+
+
+def hline(image, row, col, length, pixel):
+    """
+    Draws a horizontal line of the given length, starting at (row, col) going right
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter row: The row of the line
+    Precondition: row is an int
+
+    Parameter col: The leftmost column of the line
+    Precondition: col is an int
+
+    Parameter length: The number of pixels in the line
+    Precondition: length is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    fill_rect(image,row,col,1,length,pixel)
+
+
+def vline(image, row, col, length, pixel):
+    """
+    Draws a vertical line of the given length, starting at (row, col) going down
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter row: The top row of the line
+    Precondition: row is an int
+
+    Parameter col: The column of the line
+    Precondition: col is an int
+
+    Parameter length: The number of pixels in the line
+    Precondition: length is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    fill_rect(image,row,col,length,1,pixel)
+
+
+def line(image, row0, col0, row1, col1, pixel):
+    """
+    Draws a line from (row0, col0) to (row1, col1), including both ends
+
+    The pixels of the line are chosen with Bresenham's algorithm.  Consecutive pixels
+    in the same row are drawn as a single run.
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter row0: The row of the first end
+    Precondition: row0 is an int
+
+    Parameter col0: The column of the first end
+    Precondition: col0 is an int
+
+    Parameter row1: The row of the second end
+    Precondition: row1 is an int
+
+    Parameter col1: The column of the second end
+    Precondition: col1 is an int
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert all(type(value) == int for value in (row0,col0,row1,col1)), 'line ends must be ints'
+    _check_pixel(pixel)
+
+    drow  = abs(row1-row0)
+    dcol  = abs(col1-col0)
+    srow  = 1 if row1 >= row0 else -1
+    scol  = 1 if col1 >= col0 else -1
+    error = dcol-drow
+    row, col = row0, col0
+    start = col
+    while row != row1 or col != col1:
+        twice = 2*error
+        after = col
+        if twice > -drow:
+            error -= drow
+            after += scol
+        if twice < dcol:
+            error += dcol
+            hline(image,row,min(start,col),abs(col-start)+1,pixel)
+            row  += srow
+            start = after
+        col = after
+    hline(image,row,min(start,col),abs(col-start)+1,pixel)
+
+
+def circle(image, row, col, radius, pixel, fill=False):
+    """
+    Draws a circle with the given center and radius
+
+    A pixel is inside the circle if its squared distance to the center is at most
+    radius*(radius+1).  The outline is the pixels inside this circle, but not inside
+    the circle with radius-1.  Each row of the circle is drawn as one run (if filled)
+    or two (if not).
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter row: The row of the center
+    Precondition: row is an int
+
+    Parameter col: The column of the center
+    Precondition: col is an int
+
+    Parameter radius: The radius of the circle
+    Precondition: radius is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+
+    Parameter fill: Whether to fill the circle (instead of drawing the outline)
+    Precondition: fill is a bool
+    """
+    assert type(row) == int and type(col) == int, repr((row,col))+' is not a position'
+    assert type(radius) == int and radius >= 0, repr(radius)+' is not a valid radius'
+    assert type(fill) == bool, repr(fill)+' is not a bool'
+    _check_pixel(pixel)
+
+    for offset in range(-radius,radius+1):
+        outer = _half_width(radius,offset)
+        inner = -1 if fill else _half_width(radius-1,offset)
+        if inner < 0:
+            hline(image,row+offset,col-outer,2*outer+1,pixel)
+        else:
+            hline(image,row+offset,col-outer,outer-inner,pixel)
+            hline(image,row+offset,col+inner+1,outer-inner,pixel)
+
+
+def polygon(image, points, pixel):
+    """
+    Fills the polygon with the given corners
+
+    The polygon is filled one row at a time, with the even-odd rule.  A pixel is filled
+    if its position is inside the polygon, or on its top or left edge.  So polygons
+    that share an edge never overlap.
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter points: The corners of the polygon, in order
+    Precondition: points is a list of at least 3 (row, col) pairs of numbers
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert type(points) in (list,tuple) and len(points) >= 3, repr(points)+' is not a polygon'
+    _check_pixel(pixel)
+
+    edges = list(zip(points,list(points[1:])+list(points[:1])))
+    first = max(0,math.ceil(min(point[0] for point in points)))
+    last  = min(image.getHeight()-1,math.floor(max(point[0] for point in points)))
+    for row in range(first,last+1):
+        crossings = []
+        for (row0, col0), (row1, col1) in edges:
+            if row0 <= row < row1 or row1 <= row < row0:
+                crossings.append(col0+(row-row0)*(col1-col0)/(row1-row0))
+        crossings.sort()
+        for start, stop in zip(crossings[0::2],crossings[1::2]):
+            left = math.ceil(start)
+            if math.ceil(stop) > left:
+                hline(image,row,left,math.ceil(stop)-left,pixel)
+
+
+def border(image, size, pixel):
+    """
+    Draws a border of the given thickness around the edge of the image
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter size: The thickness of the border in pixels
+    Precondition: size is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert type(size) == int and size >= 0, repr(size)+' is not a valid size'
+    width  = image.getWidth()
+    height = image.getHeight()
+    fill_rect(image,0,0,size,width,pixel)
+    fill_rect(image,height-size,0,size,width,pixel)
+    fill_rect(image,size,0,max(0,height-2*size),size,pixel)
+    fill_rect(image,size,width-size,max(0,height-2*size),size,pixel)
+
+
+def grid(image, step, pixel):
+    """
+    Draws 1 pixel wide grid lines, dividing the image into step x step cells
+
+    The lines are drawn at every row and column that is a (positive) multiple of step.
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter step: The size of a grid cell
+    Precondition: step is an int > 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert type(step) == int and step > 0, repr(step)+' is not a valid step'
+    width  = image.getWidth()
+    height = image.getHeight()
+    for row in range(step,height,step):
+        hline(image,row,0,width,pixel)
+    for col in range(step,width,step):
+        vline(image,0,col,height,pixel)
+
+
+def crop_marks(image, length, pixel):
+    """
+    Draws 1 pixel wide crop marks at the four corners of the image
+
+    Each mark is a right angle with two arms of the given length, along the edges of
+    the image.
+
+    Parameter image: The image to draw on
+    Precondition: image is an Image object
+
+    Parameter length: The length of each arm of a mark
+    Precondition: length is an int >= 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    assert type(length) == int and length >= 0, repr(length)+' is not a valid length'
+    width  = image.getWidth()
+    height = image.getHeight()
+    for row in (0,height-1):
+        hline(image,row,0,length,pixel)
+        hline(image,row,width-length,length,pixel)
+    for col in (0,width-1):
+        vline(image,0,col,length,pixel)
+        vline(image,height-length,col,length,pixel)
+
+
+def _half_width(radius, offset):
+    """
+    Returns: The half width of a circle row, or -1 if the row is outside of the circle
+
+    The row covers the columns -result..result of the center (see circle).
+
+    Parameter radius: The radius of the circle
+    Precondition: radius is an int
+
+    Parameter offset: The row, relative to the center
+    Precondition: offset is an int
+    """
+    extent = radius*(radius+1)-offset*offset
+    if radius < 0 or extent < 0:
+        return -1
+    return math.isqrt(extent)
+
+
+def _paint(data, index, count, pixel):
+    """
+    Sets the pixels of data in the slice index to the given color
+
+    Parameter data: The pixel list to draw on
+    Precondition: data is a Pixels object
+
+    Parameter index: The pixels to set
+    Precondition: index is a slice of data with count positions
+
+    Parameter count: The number of pixels to set
+    Precondition: count is an int > 0
+
+    Parameter pixel: The color to draw with
+    Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+    """
+    channels = data.channels
+    if channels == 4:
+        run = bytearray(data[index].buffer)
+        for channel in range(3):
+            run[channel::4] = bytes((pixel[channel],))*count
+    elif channels == 1 and pixel[0] == pixel[1] == pixel[2]:
+        run = bytearray((pixel[0],))*count
+    else:
+        channels = 3
+        run = bytearray(bytes(pixel))*count
+    data[index] = pixels.Pixels.fromBuffer(run,channels)
+
+
+def _check_pixel(pixel):
+    """
+    Asserts that pixel is a valid color
+
+    Parameter pixel: The value to check
+    Precondition: NONE (pixel can be any value)
+    """
+    assert type(pixel) == tuple and len(pixel) == 3, repr(pixel)+' is not a pixel'
+    assert all(type(value) == int and 0 <= value <= 255 for value in pixel), repr(pixel)+' is not a pixel'
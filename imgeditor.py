@@ -11,6 +11,9 @@ Author: Walker M. White (wmw2)
 Date:    October 20, 2017 (Python 3 Version)
 """
 import imghistory
+import imgmask
+import imgdraw
+import imgconvolve
 import math
 
 
@@ -30,21 +33,170 @@ class Editor(imghistory.ImageHistory):
     
     Each one of the non-hidden functions should edit the most recent image in the
     edit history (which is inherited from ImageHistory).
+    
+    Any of these functions can be limited to a region of interest by calling it through
+    the method perform.  While it runs, getCurrent returns a view of just that region
+    (see Image.getRegion), so the cost of the operation is proportional to the area of
+    the region, and not the image.
+    
+    Operations run through perform use the kernel of imgkernels for that operation (if
+    it has one) while ACCELERATE is True.  Calling a method directly always runs the
+    method itself.
     """
     
+    # The operations that change the image dimensions (and need square regions)
+    RESHAPING = ('transpose','rotateLeft','rotateRight')
+    
+    # The region view while perform is running (None otherwise)
+    _target = None
+    
+    # The recorder measuring the operations (None if not measuring)
+    _recorder = None
+    
+    # The cache of operation results (None to always run operations)
+    _memo = None
+    
+    # The operations whose results are never cached (they return values)
+    UNCACHED = ('encode','decode')
+    
+    # Whether perform uses the fast kernels of imgkernels for the operations that have one
+    ACCELERATE = True
+    
+    # The color of the overlays (grid, frame and crop marks)
+    OVERLAY = (255, 255, 255)
+    
+    def getRecorder(self):
+        """
+        Returns: The recorder measuring operations on this editor (or None)
+        """
+        return self._recorder
+    
+    def setRecorder(self, recorder):
+        """
+        Sets the recorder to measure operations on this editor
+        
+        Only operations run through perform are measured (see imgstats).
+        
+        Parameter recorder: The recorder (or None to stop measuring)
+        Precondition: recorder is an imgstats.Recorder object or None
+        """
+        self._recorder = recorder
+    
+    def getMemo(self):
+        """
+        Returns: The cache of operation results used by this editor (or None)
+        """
+        return self._memo
+    
+    def setMemo(self, memo):
+        """
+        Sets the cache of operation results for this editor
+        
+        Operations run through perform are looked up in the cache first.  If the same
+        operation (with the same arguments) was applied to an image with the same pixels
+        before, the cached result is copied instead of running it (see imgmemo).
+        
+        Parameter memo: The result cache (or None to always run operations)
+        Precondition: memo is an imgmemo.ResultCache object or None
+        """
+        self._memo = memo
+    
+    def getCurrent(self):
+        """
+        Returns: The most recent edit, or the region of it being edited
+        
+        While an operation runs through perform with a region, this returns the view of
+        that region instead of the entire image.
+        """
+        if self._target is not None:
+            return self._target
+        return super().getCurrent()
+
+    def getResult(self):
+        """
+        Returns: The image to save, with all of the edits applied
+
+        For this class, this is the same as getCurrent.  An editor that previews its
+        edits on a smaller copy (see imgproxy) returns the full-resolution image instead.
+        """
+        return self.getCurrent()
+
+    def perform(self, name, *args, region=None):
+        """
+        Returns: The result of the operation name applied to the current image
+        
+        The operation is any of the non-hidden methods of this class, and args are its
+        arguments.  If region is not None, the operation only sees (and modifies) that
+        region of the current image.  For a Mask, the pixels of the bounding rectangle
+        that are not selected are restored after the operation.
+        
+        This method does not add to the edit history.  Call increment first, with the
+        same region, so that only the region is saved.
+        
+        Parameter name: The name of the operation
+        Precondition: name is the name of a non-hidden method of this class
+        
+        Parameter args: The operation arguments
+        Precondition: args are valid arguments for the operation
+        
+        Parameter region: The region of interest
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width) 
+        inside the image; the region is square if name is in RESHAPING
+        """
+        assert not name.startswith('_') and callable(getattr(self,name,None)), repr(name)+' is not an operation'
+        if region is None:
+            return self._measure(name,args,None,self.getCurrent())
+        
+        row, col, height, width = imgmask.bounds(region)
+        assert height == width or not name in self.RESHAPING, repr(name)+' needs a square region'
+        
+        target = super().getCurrent().getRegion(row,col,height,width)
+        saved  = target.copy() if isinstance(region, imgmask.Mask) else None
+        self._target = target
+        try:
+            result = self._measure(name,args,region,target)
+        finally:
+            self._target = None
+        
+        if saved is not None:
+            for pos in range(target.getLength()):
+                if not region.isSelected(row+pos // width,col+pos % width):
+                    target.setFlatPixel(pos,saved.getFlatPixel(pos))
+        return result
+    
+    def increment(self, region=None):
+        """
+        Adds a new copy of the image to the edit history.
+        
+        See ImageHistory.increment.  If this editor has a recorder, the time it takes is
+        added to the record of the next operation.
+        
+        Parameter region: The region that the next edit will modify
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+        """
+        if self._recorder is None:
+            super().increment(region)
+        else:
+            with self._recorder.copying():
+                super().increment(region)
+    
     # PROVIDED ACTIONS (STUDY THESE)
     def invert(self):
         """
         Inverts the current image, replacing each element with its color complement
+        
+        The image is processed one storage tile at a time (see Image.getTiles).
         """
         current = self.getCurrent()
-        for pos in range(current.getLength()):
-            rgb = current.getFlatPixel(pos)
-            red   = 255 - rgb[0]
-            green = 255 - rgb[1]
-            blue  = 255 - rgb[2]
-            rgb = (red,green,blue) # New pixel value
-            current.setFlatPixel(pos,rgb)
+        for top, left, height, width in current.getTiles():
+            for row in range(top,top+height):
+                for pos in range(row*current.getWidth()+left,row*current.getWidth()+left+width):
+                    rgb = current.getFlatPixel(pos)
+                    red   = 255 - rgb[0]
+                    green = 255 - rgb[1]
+                    blue  = 255 - rgb[2]
+                    rgb = (red,green,blue) # New pixel value
+                    current.setFlatPixel(pos,rgb)
     
     def transpose(self):
         """
@@ -63,7 +215,7 @@ class Editor(imghistory.ImageHistory):
         
         for row in range(current.getHeight()):
             for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(col,row))
+                current.setPixelUnchecked(row,col,original.getPixelUnchecked(col,row))
     
     def reflectHori(self):
         """
@@ -73,7 +225,9 @@ class Editor(imghistory.ImageHistory):
         for h in range(current.getWidth()//2):
             for row in range(current.getHeight()):
                 k = current.getWidth()-1-h
-                current.swapPixels(row,h,row,k)
+                temp = current.getPixelUnchecked(row,h)
+                current.setPixelUnchecked(row,h,current.getPixelUnchecked(row,k))
+                current.setPixelUnchecked(row,k,temp)
     
     def rotateRight(self):
         """
@@ -88,7 +242,7 @@ class Editor(imghistory.ImageHistory):
         
         for row in range(current.getHeight()):
             for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
+                current.setPixelUnchecked(row,col,original.getPixelUnchecked(original.getHeight()-col-1,row))
     
     def rotateLeft(self):
         """
@@ -103,8 +257,96 @@ class Editor(imghistory.ImageHistory):
         
         for row in range(current.getHeight()):
             for col in range(current.getWidth()):
-                current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
+                current.setPixelUnchecked(row,col,original.getPixelUnchecked(col,original.getWidth()-row-1))
+    
     
+    def grid(self, step):
+        """
+        Draws grid lines over the current image, dividing it into step x step cells
+        
+        The lines are one pixel wide, in the color OVERLAY (see imgdraw.grid).
+        
+        Parameter step: The size of a grid cell
+        Precondition: step is an int > 0
+        """
+        assert isinstance(step, int) and step > 0
+        imgdraw.grid(self.getCurrent(), step, self.OVERLAY)
+    
+    def frame(self, size):
+        """
+        Draws a frame of the given thickness around the edge of the current image
+        
+        The frame is in the color OVERLAY (see imgdraw.border).
+        
+        Parameter size: The thickness of the frame in pixels
+        Precondition: size is an int > 0
+        """
+        assert isinstance(size, int) and size > 0
+        imgdraw.border(self.getCurrent(), size, self.OVERLAY)
+    
+    def cropMarks(self, length):
+        """
+        Draws crop marks at the four corners of the current image
+        
+        Each mark is a right angle with two one pixel wide arms of the given length, in 
+        the color OVERLAY (see imgdraw.crop_marks).
+        
+        Parameter length: The length of each arm of a mark
+        Precondition: length is an int > 0
+        """
+        assert isinstance(length, int) and length > 0
+        imgdraw.crop_marks(self.getCurrent(), length, self.OVERLAY)
+    
+    def blur(self, radius):
+        """
+        Blurs the current image with a Gaussian kernel (see imgconvolve.gaussian_blur)
+        
+        Parameter radius: The radius of the kernel
+        Precondition: radius is an int > 0
+        """
+        assert isinstance(radius, int) and radius > 0
+        imgconvolve.gaussian_blur(self.getCurrent(), radius)
+    
+    def boxBlur(self, radius):
+        """
+        Blurs the current image with a box kernel (see imgconvolve.box_blur)
+        
+        Each pixel becomes the average of the square around it.  This takes the same
+        time for any radius.
+        
+        Parameter radius: The radius of the kernel
+        Precondition: radius is an int > 0
+        """
+        assert isinstance(radius, int) and radius > 0
+        imgconvolve.box_blur(self.getCurrent(), radius)
+    
+    def sharpen(self, radius, amount):
+        """
+        Sharpens the current image with an unsharp mask (see imgconvolve.unsharp_mask)
+        
+        Parameter radius: The radius of the blur that is subtracted
+        Precondition: radius is an int > 0
+        
+        Parameter amount: The strength of the sharpening, in percent
+        Precondition: amount is an int >= 0
+        """
+        assert isinstance(radius, int) and radius > 0
+        assert isinstance(amount, int) and amount >= 0
+        imgconvolve.unsharp_mask(self.getCurrent(), radius, amount)
+    
+    def edges(self):
+        """
+        Replaces the current image with the strength of its edges
+        
+        See imgconvolve.sobel_edges.
+        """
+        imgconvolve.sobel_edges(self.getCurrent())
+    
+    def emboss(self):
+        """
+        Embosses the current image (see imgconvolve.emboss)
+        """
+        imgconvolve.emboss(self.getCurrent())
     
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
     def reflectVert(self):
@@ -116,7 +358,9 @@ class Editor(imghistory.ImageHistory):
         for w in range(current.getHeight()//2):
             for col in range(current.getWidth()):
                 k = current.getHeight()-1-w
-                current.swapPixels(w, col, k, col)
+                temp = current.getPixelUnchecked(w, col)
+                current.setPixelUnchecked(w, col, current.getPixelUnchecked(k, col))
+                current.setPixelUnchecked(k, col, temp)
     
     def monochromify(self, sepia):
         """
@@ -131,22 +375,30 @@ class Editor(imghistory.ImageHistory):
         If sepia is True, it makes the same computations as before but sets green to
         0.6 * brightness and blue to 0.4 * brightness.
         
+        A greyscale image is then stored with one byte per pixel, instead of three.
+        
         Parameter sepia: Whether to use sepia tone instead of greyscale.
         Precondition: sepia is a bool
         """
         assert isinstance(sepia, bool)
         
         current = self.getCurrent()
-        for pos in range(current.getLength()):
-            rgb = current.getFlatPixel(pos)
-            #rgb[0] = red
-            brightness = 0.3 * rgb[0] + 0.6 * rgb[1] + 0.1 * rgb[2]
-            if(sepia == False):
-                newRGB = (int(brightness), int(brightness), int(brightness))
-            else:
-                newRGB = (rgb[0], int(0.6 * brightness), int(0.4 * brightness))
-                #looks too dark??
-            current.setFlatPixel(pos,newRGB)
+        for top, left, height, width in current.getTiles():
+            for row in range(top,top+height):
+                for pos in range(row*current.getWidth()+left,row*current.getWidth()+left+width):
+                    rgb = current.getFlatPixel(pos)
+                    #rgb[0] = red
+                    brightness = 0.3 * rgb[0] + 0.6 * rgb[1] + 0.1 * rgb[2]
+                    if(sepia == False):
+                        newRGB = (int(brightness), int(brightness), int(brightness))
+                    else:
+                        newRGB = (rgb[0], int(0.6 * brightness), int(0.4 * brightness))
+                        #looks too dark??
+                    current.setFlatPixel(pos,newRGB)
+        
+        if not sepia:
+            # Grey pixels only need one byte each (see Pixels.compact)
+            current.getPixels().compact()
 
     def jail(self):
         """
@@ -199,14 +451,16 @@ class Editor(imghistory.ImageHistory):
         hfD = math.sqrt(current.getWidth()**2 + current.getHeight()**2)/2
         centerx = current.getWidth()/2
         centery = current.getHeight()/2
-        for row in range(current.getHeight()):
-            for col in range(current.getWidth()):
-                factor = 1 - (math.sqrt((centerx-col)**2 + (centery-row)**2)/hfD)**2
-                red = current.getPixel(row, col)[0] * factor
-                green = current.getPixel(row, col)[1] * factor
-                blue = current.getPixel(row, col)[2] * factor
-                current.setPixel(row, col,
-                        (int(round(red)), int(round(green)), int(round(blue))))
+        for top, left, height, width in current.getTiles():
+            for row in range(top,top+height):
+                for col in range(left,left+width):
+                    factor = 1 - (math.sqrt((centerx-col)**2 + (centery-row)**2)/hfD)**2
+                    rgb = current.getPixelUnchecked(row, col)
+                    red = rgb[0] * factor
+                    green = rgb[1] * factor
+                    blue = rgb[2] * factor
+                    current.setPixelUnchecked(row, col,
+                            (int(round(red)), int(round(green)), int(round(blue))))
         
     
     def pixellate(self,step):
@@ -261,9 +515,10 @@ class Editor(imghistory.ImageHistory):
         pixels to store the text, this method returns False without storing the message.
         
         Parameter text: a message to hide
-        Precondition: text is a string
+        Precondition: text is a string of characters with codes 0..255
         """
         assert isinstance(text, str)
+        assert all(ord(char) <= 255 for char in text)
         
         current = self.getCurrent()
         
@@ -301,11 +556,14 @@ class Editor(imghistory.ImageHistory):
         start marker 'START'. The next 6 pixels decode to the length
         of the message.
         
-        If no message is detected, it returns None
+        If no message is detected (or the image is too small for the message it claims
+        to have), it returns None
         """
         current = self.getCurrent()
         msg = ''
         start = ''
+        if current.getLength() < 11:
+            return None
        
         #detect start
         for pos in range(11):
@@ -314,6 +572,8 @@ class Editor(imghistory.ImageHistory):
             return None
         
         lenText = int(start[5:11])
+        if lenText+11 > current.getLength():
+            return None
        # print('start is ' + start + ' lenText is ' + repr(lenText))
         
         #while loop
@@ -327,13 +587,95 @@ class Editor(imghistory.ImageHistory):
     
     
     # HELPER FUNCTIONS
+    def _measure(self, name, args, region, image):
+        """
+        Returns: The result of the operation name, measured by the recorder (if any)
+        
+        Parameter name: The name of the operation
+        Precondition: name is the name of a non-hidden method of this class
+        
+        Parameter args: The operation arguments
+        Precondition: args is a tuple of valid arguments for the operation
+        
+        Parameter region: The region of interest
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+        
+        Parameter image: The image that the operation modifies
+        Precondition: image is the value of getCurrent() while it runs
+        """
+        recorder = self._recorder
+        if recorder is None:
+            return self._recall(name,args,image)
+        record = recorder.begin(name,args,region,image)
+        try:
+            return self._recall(name,args,image)
+        finally:
+            recorder.end(record,image)
+    
+    def _recall(self, name, args, image):
+        """
+        Returns: The result of the operation name, copying a cached result if possible
+        
+        Tiled images are never cached.  They keep no chunk hashes, so the key would cost
+        a full copy and hash of the image on every operation.
+        
+        Parameter name: The name of the operation
+        Precondition: name is the name of a non-hidden method of this class
+        
+        Parameter args: The operation arguments
+        Precondition: args is a tuple of valid arguments for the operation
+        
+        Parameter image: The image that the operation modifies
+        Precondition: image is the value of getCurrent() while it runs
+        """
+        import imgtiles
+        memo = self._memo
+        if memo is None or name in self.UNCACHED or isinstance(image.getPixels(),imgtiles.TiledPixels):
+            return self._run(name,args,image)
+        
+        key = memo.key(image,name,args)
+        cached = memo.lookup(key)
+        if cached is None:
+            result = self._run(name,args,image)
+            memo.store(key,image)
+            return result
+        
+        image.getPixels()[0:cached.getLength()] = cached.getPixels()
+        image.setWidth(cached.getWidth())
+    
+    def _run(self, name, args, image):
+        """
+        Returns: The result of the operation name, using a kernel if possible
+        
+        If ACCELERATE is True and imgkernels has a kernel for the operation, the kernel
+        edits the image instead of the method.  The kernels give exactly the same pixels
+        as the methods of this class, so they are not used for a subclass that overrides
+        the method.
+        
+        Parameter name: The name of the operation
+        Precondition: name is the name of a non-hidden method of this class
+        
+        Parameter args: The operation arguments
+        Precondition: args is a tuple of valid arguments for the operation
+        
+        Parameter image: The image that the operation modifies
+        Precondition: image is the value of getCurrent() while it runs
+        """
+        if self.ACCELERATE and getattr(type(self),name) is getattr(Editor,name,None):
+            import imgkernels
+            kernel = imgkernels.KERNELS.get(name)
+            if kernel is not None and kernel(image,*args):
+                return None
+        return getattr(self,name)(*args)
+    
     def _drawHBar(self, row, pixel):
         """
         Draws a horizontal bar on the current image at the given row.
         
         This method draws a horizontal 3-pixel-wide bar at the given row of the current
         image. This means that the bar includes the pixels row, row+1, and row+2.
-        The bar uses the color given by the pixel value.
+        The bar uses the color given by the pixel value.  It is drawn with imgdraw, 
+        so the preconditions are only checked once for the entire bar.
         
         Parameter row: The start of the row to draw the bar
         Precondition: row is an int, with 0 <= row  &&  row+2 < image height
@@ -348,10 +690,7 @@ class Editor(imghistory.ImageHistory):
         assert 0 <= pixel[2] and pixel[2] <= 255
         
         current = self.getCurrent()
-        for col in range(current.getWidth()):
-            current.setPixel(row,   col, pixel)
-            current.setPixel(row+1, col, pixel)
-            current.setPixel(row+2, col, pixel)
+        imgdraw.fill_rect(current, row, 0, 3, current.getWidth(), pixel)
             
     def _drawVBar(self, col, pixel):
         """
@@ -359,7 +698,8 @@ class Editor(imghistory.ImageHistory):
         
         This method draws a 4-pixel vertical bars at the given col of the current image.
         This means that the bar includes the pixels col, col+1, col+2, and col+3.
-        The bar uses the color given by the pixel value.
+        The bar uses the color given by the pixel value.  It is drawn with imgdraw, 
+        so the preconditions are only checked once for the entire bar.
         
         Parameter col: The start of the col to draw the bar
         Precondition: col is an int, with 0 <= col  &&  col+3 < image width
@@ -375,11 +715,7 @@ class Editor(imghistory.ImageHistory):
         assert 0 <= pixel[2] and pixel[2] <= 255
         
         current = self.getCurrent()
-        for row in range(current.getHeight()):
-            current.setPixel(row, col, pixel)
-            current.setPixel(row, col + 1, pixel)
-            current.setPixel(row, col + 2, pixel)
-            current.setPixel(row, col + 3, pixel)
+        imgdraw.fill_rect(current, 0, col, current.getHeight(), 4, pixel)
     
     def _average(self, row, col, step1, step2):
         """
@@ -399,21 +735,21 @@ class Editor(imghistory.ImageHistory):
         
         Parameter step2: The positions right to average from starting col
         Precondition: step2 is an int >= 0        
+        
+        The preconditions are not enforced here, as this is called for every block.
+        Instead, pixellate checks its step once, and only passes blocks inside the image.
         """
-        assert isinstance(row, int) and 0<=row and isinstance(step1, int) and step1 >= 0
-        assert isinstance(col, int) and 0<=col and isinstance(step2, int) and step2 >= 0 
-        assert row+step1 <= self.getCurrent().getHeight() 
-        assert col+step2 <= self.getCurrent().getWidth()
-
         current = self.getCurrent()
-        sum_red=current.getPixel(row,col)[0]
-        sum_green=current.getPixel(row,col)[1]
-        sum_blue=current.getPixel(row,col)[2]
+        rgb = current.getPixelUnchecked(row,col)
+        sum_red=rgb[0]
+        sum_green=rgb[1]
+        sum_blue=rgb[2]
         for row1 in range(row,row+step1):
             for col1 in range(col,col+step2):
-                sum_red=sum_red+current.getPixel(row1,col1)[0]
-                sum_green=sum_green+current.getPixel(row1,col1)[1]
-                sum_blue=sum_blue+current.getPixel(row1,col1)[2]
+                rgb = current.getPixelUnchecked(row1,col1)
+                sum_red=sum_red+rgb[0]
+                sum_green=sum_green+rgb[1]
+                sum_blue=sum_blue+rgb[2]
         for row1 in range(row,row+step1):
             for col1 in range(col,col+step2):
                 avg = (int(round(sum_red/(step1*step2))),
@@ -422,7 +758,7 @@ class Editor(imghistory.ImageHistory):
                 #    print('average for row ' + repr(row1) + ' through ' + repr(row1+step1-1) +
                 #    ' and col ' + repr(col1) +
                 #          ' through ' + repr(col1+step2-1) + ' is ' + repr(avg))
-                current.setPixel(row1,col1, avg)       
+                current.setPixelUnchecked(row1,col1, avg)
         
    
     def _decode_pixel(self, pos):
@@ -434,10 +770,10 @@ class Editor(imghistory.ImageHistory):
         
         Parameter pos: a pixel position
         Precondition: pos is an int with  0 <= pos < image length (as a 1d list)
-        """
-        assert isinstance(pos, int) 
-        assert 0 <= pos and pos < self.getCurrent().getLength()
         
+        The preconditions are not enforced here, as this is called for every pixel.
+        Instead, decode checks the message length once.
+        """
         rgb = self.getCurrent().getFlatPixel(pos)
         red   = rgb[0]
         green = rgb[1]
@@ -460,11 +796,10 @@ class Editor(imghistory.ImageHistory):
         
         Parameter msgASCII: an int that represents an ASCII code that needs to be encoded
         Precondition: msgASCII is an int between 0 and 255
-        """
-        assert isinstance(pos, int)
-        assert 0 <= pos and pos < self.getCurrent().getLength()
-        assert isinstance(msgASCII, int) and 0 <= msgASCII and msgASCII <= 255
         
+        The preconditions are not enforced here, as this is called for every pixel.
+        Instead, encode checks the text once.
+        """
         currentpixel = self.getCurrent().getFlatPixel(pos)
         red = currentpixel[0] - currentpixel[0]%10 + msgASCII//100
         green = currentpixel[1] - currentpixel[1]%10 + msgASCII%100//10
@@ -0,0 +1,315 @@
+"""
+File input and output for the imager application
+
+Images can be stored in two formats.  PNG (and the other formats that PIL can read) is
+the format for sharing images.  However, decoding and encoding PNG files is slow, and it
+dominates the time it takes to open or save a large working file.
+
+Therefore, this module also supports a native image container.  This is a 16 byte
+header followed by the raw bytes of the pixel buffer, exactly as the Pixels class stores
+them.  The header is
+
+    bytes 0..3:   the magic string b'IMGR'
+    byte  4:      the format version (currently 1)
+    byte  5:      the number of channels per pixel (1, 3 or 4; see Pixels.channels)
+    bytes 6..7:   reserved (zero)
+    bytes 8..11:  the image width  (unsigned, little endian)
+    bytes 12..15: the image height (unsigned, little endian)
+
+A native file is opened with mmap, so reading one is zero-copy and takes the same time
+regardless of the image size.  The map is copy-on-write, so editing the image never
+changes the file on disk.  Native files are also the format for passing intermediate
+results between the stages of a (headless) pipeline, and for the on-disk cache of
+decoded images (see imgcache).
+
+Very large images are loaded into pixels.MappedPixels, so that the image (and all of
+its edit history) is backed by scratch files instead of RAM.  Alternatively, images can
+be loaded into tiled storage with a bounded tile cache (see imgtiles).
+"""
+import os
+import struct
+import pixels
+import imgimage
+
+
+# The file extension for native image files
+NATIVE_EXT = '.imgr'
+
+# The file extensions that we can save to
+SAVE_EXTS = ('.png', NATIVE_EXT)
+
+# Images with at least this many pixels are loaded into memory-mapped scratch storage
+MAPPED_THRESHOLD = 32*1024*1024
+
+# Whether loaded images use tiled storage (see imgtiles) by default
+TILED_STORAGE = False
+
+# Whether decoded images are kept in the on-disk cache (see imgcache) by default
+DECODE_CACHE = True
+
+# The PIL image mode for each number of channels
+_MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+# The native header layout (see the module comment)
+_HEADER  = struct.Struct('<4sBBHII')
+_MAGIC   = b'IMGR'
+_VERSION = 1
+
+
+def is_native(file):
+    """
+    Returns: True if file is a native image file; False otherwise
+
+    This checks the magic string of the file, and not its extension.  It returns False
+    if the file cannot be read.
+
+    Parameter file: An absolute path to a file
+    Precondition: file is a string
+    """
+    try:
+        with open(file,'rb') as handle:
+            return handle.read(len(_MAGIC)) == _MAGIC
+    except OSError:
+        return False
+
+
+def read_native(file):
+    """
+    Returns: The Image stored in the given native image file
+
+    The pixel data is not read into memory.  The Pixels object is backed by a private
+    (copy-on-write) memory map of the file, so the operating system pages the data
+    in as it is used.
+
+    Parameter file: An absolute path to a native image file
+    Precondition: file is a string
+    """
+    import mmap
+
+    with open(file,'rb') as handle:
+        width, height, channels = _unpack_header(handle.read(_HEADER.size),file)
+        size = width*height*channels
+        if os.fstat(handle.fileno()).st_size < _HEADER.size+size:
+            raise ValueError(repr(file)+' is truncated')
+
+        if size == 0:
+            data = pixels.Pixels(0,channels)
+        else:
+            block = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_COPY)
+            data  = memoryview(block)[_HEADER.size:_HEADER.size+size]
+            data  = pixels.Pixels.fromBuffer(data,channels)
+
+    return imgimage.Image(data,width)
+
+
+def write_native(image, file):
+    """
+    Writes the image to the given file in the native format.
+
+    The file is written to a temporary location and then moved into place.  That way
+    a pipeline stage reading the file never sees a partially written image.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: An absolute path to the output file
+    Precondition: file is a string
+    """
+    header = _pack_header(image)
+    temp = file+'.tmp'
+    try:
+        with open(temp,'wb') as handle:
+            handle.write(header)
+            handle.write(image.getPixels().buffer)
+        os.replace(temp,file)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+
+def decode_file(file):
+    """
+    Returns: The Image stored in the given image file, decoded with PIL
+
+    Greyscale files are stored with 1 channel, and files with transparency with 4 (see
+    Pixels.channels).  Everything else is converted to RGB.
+
+    Parameter file: An absolute path to an image file (PNG, JPEG, GIF)
+    Precondition: file is a string or a binary file object
+    """
+    from array import array
+    from PIL import Image as CoreImage
+
+    with CoreImage.open(file) as image:
+        if image.mode in ('L','RGB','RGBA'):
+            mode = image.mode
+        elif image.mode == 'LA' or 'transparency' in image.info:
+            mode = 'RGBA'
+        else:
+            mode = 'RGB'
+        image  = image.convert(mode)
+        buffer = array('B')
+        buffer.frombytes(image.tobytes())
+        width = image.size[0]
+
+    channels = len(mode)
+    return imgimage.Image(pixels.Pixels.fromBuffer(buffer,channels),width)
+
+
+def encode_png(image, file):
+    """
+    Writes the image to the given file as a PNG, using PIL
+
+    The PNG has the channels of the image: greyscale, RGB or RGBA.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: An absolute path to the output file
+    Precondition: file is a string or a binary file object
+    """
+    from PIL import Image as CoreImage
+
+    size = (image.getWidth(),image.getHeight())
+    data = bytes(image.getPixels().buffer)
+    CoreImage.frombytes(_MODES[image.getChannels()],size,data).save(file,'PNG')
+
+
+def read_bytes(data):
+    """
+    Returns: The Image stored in the given bytes
+
+    The bytes are the contents of a native file or of any file that PIL can read.  The
+    pixels are always copied, so the image does not depend on data.
+
+    Parameter data: The file contents
+    Precondition: data is a bytes-like object
+    """
+    if bytes(data[:len(_MAGIC)]) == _MAGIC:
+        width, height, channels = _unpack_header(bytes(data[:_HEADER.size]),'data')
+        size = width*height*channels
+        if len(data) < _HEADER.size+size:
+            raise ValueError('data is truncated')
+        buffer = bytearray(data[_HEADER.size:_HEADER.size+size])
+        return imgimage.Image(pixels.Pixels.fromBuffer(buffer,channels),width)
+
+    import io
+    return decode_file(io.BytesIO(data))
+
+
+def write_bytes(image, native=False):
+    """
+    Returns: The contents of a file for the image, as bytes
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter native: Whether to use the native format (instead of PNG)
+    Precondition: native is a bool
+    """
+    if native:
+        return _pack_header(image)+bytes(image.getPixels().buffer)
+
+    import io
+    stream = io.BytesIO()
+    encode_png(image,stream)
+    return stream.getvalue()
+
+
+def read_image(file, mapped=None, tiled=None, cached=None):
+    """
+    Returns: The Image stored in the given file
+
+    Native files are memory mapped.  All other files are decoded with PIL.  If cached 
+    is True, the decoded image is kept in the on-disk cache (see imgcache), and a file 
+    that is already in the cache is memory mapped from there instead of decoded.  If 
+    cached is None, the value of DECODE_CACHE is used.
+
+    If mapped is True, the pixels are moved to a pixels.MappedPixels buffer after 
+    loading, so that the image and any copies of it are file backed.  If mapped is None, 
+    this happens only for images with at least MAPPED_THRESHOLD pixels.
+
+    If tiled is True, the pixels are moved to an imgtiles.TiledPixels buffer instead.
+    If tiled is None, the value of TILED_STORAGE is used.
+
+    Parameter file: An absolute path to an image file
+    Precondition: file is a string
+
+    Parameter mapped: Whether to use memory-mapped scratch storage
+    Precondition: mapped is a bool or None
+
+    Parameter tiled: Whether to use tiled storage
+    Precondition: tiled is a bool or None
+
+    Parameter cached: Whether to use the on-disk cache of decoded images
+    Precondition: cached is a bool or None
+    """
+    if is_native(file):
+        image = read_native(file)
+    elif DECODE_CACHE if cached is None else cached:
+        import imgcache
+        image = imgcache.get_cache().fetch(file)
+    else:
+        image = decode_file(file)
+
+    if TILED_STORAGE if tiled is None else tiled:
+        import imgtiles
+        data = imgtiles.TiledPixels.fromPixels(image.getPixels(),image.getWidth())
+        return imgimage.Image(data,image.getWidth())
+
+    if mapped is None:
+        mapped = image.getLength() >= MAPPED_THRESHOLD
+    if mapped and not isinstance(image.getPixels(),pixels.MappedPixels):
+        data  = pixels.MappedPixels.fromPixels(image.getPixels())
+        image = imgimage.Image(data,image.getWidth())
+    return image
+
+
+def write_image(image, file):
+    """
+    Writes the image to the given file, choosing the format from the file extension
+
+    Files ending in NATIVE_EXT are written in the native format; everything else is
+    written as a PNG.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: An absolute path to the output file
+    Precondition: file is a string
+    """
+    if file.lower().endswith(NATIVE_EXT):
+        write_native(image,file)
+    else:
+        encode_png(image,file)
+
+
+def _pack_header(image):
+    """
+    Returns: The native header for the given image
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+    """
+    return _HEADER.pack(_MAGIC,_VERSION,image.getChannels(),0,image.getWidth(),image.getHeight())
+
+
+def _unpack_header(header, name):
+    """
+    Returns: The size and channels (width, height, channels) in a native header
+
+    Parameter header: The first bytes of a native file
+    Precondition: header is a bytes object
+
+    Parameter name: The name of the file (for error messages)
+    Precondition: name is a string
+    """
+    if len(header) < _HEADER.size:
+        raise ValueError(repr(name)+' is truncated')
+    magic, version, channels, _, width, height = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise ValueError(repr(name)+' is not a native image file')
+    if version != _VERSION or not channels in pixels.CHANNELS:
+        raise ValueError(repr(name)+' uses an unsupported format version')
+    return (width,height,channels)
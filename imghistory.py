@@ -10,7 +10,9 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Author: Walker White (wmw2)
 Date:   October 20, 2017
 """
+import pixels
 import imgimage
+import imgmask
 
 class ImageHistory(object):
     """
@@ -20,17 +22,42 @@ class ImageHistory(object):
     The attribute _history stores all of the edits (up to a maximum of MAX_HISTORY edits)
     in order.  So the last element of _history is the most recent edit.
     
+    Edits limited to a region of the image do not copy the entire image.  Instead, they 
+    save a patch (a copy of just that region) and modify the most recent image in place.
+    The patches for each image are kept in _patches, so that _patches[i] is the list of
+    patches applied to _history[i] (oldest first).
+    
     IMMUTABLE ATTRIBUTES (Fixed after initialization)
         _original: The original image [Image object]
         _history:  The edit history   [non-empty list of Image objects]
-    In addition, the length of _history should never be longer than the class attribute 
-    MAX_HISTORY.
+        _patches:  The region edits   [list of lists of (row, col, Image) tuples]
+    
+    MUTABLE ATTRIBUTES
+        _peak:     The largest memory footprint so far, in bytes  [int >= 0]
+        _redo:     The undone edits, most recently undone last    [list of tuples]
+    
+    In addition, _patches has the same length as _history, and the number of edits 
+    (images plus patches) should never be more than the class attribute MAX_HISTORY.
+    
+    The original image is never modified.  So the first image of the history shares 
+    the pixels of the original (see Pixels.share) until it is first written, which makes
+    creating (and clearing) a history take constant time.  Once the history is full, 
+    each new image reuses the pixel storage of the oldest image, which is dropped.
+    
+    Undone edits are kept in _redo until the next edit, so that redo can put them back
+    without running the operation again.  An undone image is kept as ('image', image),
+    and an undone patch as ('patch', row, col, saved, edited), where saved is the patch
+    and edited is the region as it was before the undo.  Undone edits are dropped, the
+    first undone first, to keep their pixels under the class attribute REDO_BUDGET.
     """
     
     # The number of edits that we are allowed to keep track of.
     # (THIS GOES IN CLASS FOLDER)
     MAX_HISTORY = 20
     
+    # The most bytes of pixels to keep for redo
+    REDO_BUDGET = 64*1024*1024
+    
     # GETTERS
     def getOriginal(self):
         """
@@ -44,13 +71,42 @@ class ImageHistory(object):
         """
         return self._history[-1]
     
+    def getFootprint(self):
+        """
+        Returns: The bytes held by this edit history, as a dictionary
+        
+        The dictionary has the keys 'buffer', 'file' and 'marker' (see Pixels.footprint), 
+        summed over the original, every image in the history and every patch.  Storage 
+        shared by several of them is counted once.  In addition, 'total' is the sum of
+        those three values, 'peak' is the largest total since this history was created, 
+        'images' is the number of images in the history and 'patches' is the number of 
+        patches.  The undone edits kept for redo are counted in the bytes, and their
+        number is 'redo'.
+        """
+        seen   = set()
+        result = {'buffer': 0, 'file': 0, 'marker': 0}
+        images = [self._original]+self._history
+        images.extend(patch[2] for patches in self._patches for patch in patches)
+        for entry in self._redo:
+            images.extend(self._redoImages(entry))
+        for image in images:
+            for key, value in image.getPixels().footprint(seen).items():
+                result[key] += value
+        result['total']   = result['buffer']+result['file']+result['marker']
+        result['peak']    = max(self._peak,result['total'])
+        result['images']  = len(self._history)
+        result['patches'] = sum(map(len,self._patches))
+        result['redo']    = len(self._redo)
+        return result
+    
     # INITIALIZER
     def __init__(self,original):
         """
         Initializer: Creates an edit history for the given image.
         
         The edit history starts with exactly one element, which is an (unedited) copy
-        of the original image.
+        of the original image.  The copy shares the pixels of the original until it is
+        written, so the original must not be modified afterwards.
         
         Parameter original: The image to edit
         Precondition: original is an Image object
@@ -58,7 +114,11 @@ class ImageHistory(object):
         assert isinstance(original, imgimage.Image)
         
         self._original = original
-        self._history = [original.copy()]
+        self._history = [self._share(original)]
+        self._patches = [[]]
+        self._redo    = []
+        self._peak    = 0
+        self._peak    = self.getFootprint()['total']
     
     # EDIT METHODS
     def undo(self):
@@ -69,23 +129,57 @@ class ImageHistory(object):
         of the edit history.  However, the invariant of _history specifies that the
         list can never be empty.  So in that case, it does not remove anything and
         returns False instead.
+        
+        The undone edit is kept so that it can be redone (see redo).
         """
-        if(len(self._history) > 1):
-            self._history.pop()
-            return True
+        if self._patches[-1]:
+            row, col, saved = self._patches[-1].pop()
+            target = self._history[-1].getRegion(row,col,saved.getHeight(),saved.getWidth())
+            self._redo.append(('patch',row,col,saved,target.copy()))
+            target.getPixels()[0:saved.getLength()] = saved.getPixels()
+        elif(len(self._history) > 1):
+            self._redo.append(('image',self._history.pop()))
+            self._patches.pop()
         else:
             return False
+        self._trimRedo()
+        return True
+    
+    def redo(self):
+        """
+        Returns: True if an undone edit was put back, False otherwise.
+        
+        This puts back the most recently undone edit, exactly as it was before the undo.
+        It never runs an operation, so it takes (almost) no time for an image, and the
+        time to copy the region for a patch.  Edits can only be redone until the next
+        increment or clear, and only if they were not dropped to stay under REDO_BUDGET.
+        """
+        if not self._redo:
+            return False
+        entry = self._redo.pop()
+        if entry[0] == 'image':
+            self._history.append(entry[1])
+            self._patches.append([])
+        else:
+            _, row, col, saved, edited = entry
+            target = self._history[-1].getRegion(row,col,edited.getHeight(),edited.getWidth())
+            target.getPixels()[0:edited.getLength()] = edited.getPixels()
+            self._patches[-1].append((row,col,saved))
+        return True
     
     def clear(self):
         """
         Deletes the entire edit history, retoring the original image.
         
         When this method completes, the object should have the same values that it did
-        when it was first initialized.
+        when it was first initialized.  Like initialization, this takes constant time, 
+        as the pixels of the original are not copied until they are written.
         """
-        self._history = [self._original.copy()]
+        self._history = [self._share(self._original)]
+        self._patches = [[]]
+        self._redo    = []
     
-    def increment(self):
+    def increment(self, region=None):
         """
         Adds a new copy of the image to the edit history.
         
@@ -93,12 +187,82 @@ class ImageHistory(object):
         history. This provides a new image for editing, while the previous edit is
         preserved. If this method causes the history to grow to larger (greater than 
         MAX_HISTORY), this method deletes the oldest edit to ensure the invariant is 
-        satisfied.
+        satisfied.  The pixel storage of a deleted image is reused for the copy.
+        
+        If region is not None, the next edit promises to only modify that region.  In 
+        that case only the region is copied (as a patch), and the most recent image 
+        remains the one to edit.
+        
+        Parameter region: The region that the next edit will modify
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
         """
-        if(len(self._history) < self.MAX_HISTORY):
-            self._history.append(self._history[-1].copy())
+        self._redo = []
+        
+        #remove oldest edit, to make room for this one
+        spare = None
+        while (len(self._history)+sum(map(len,self._patches)) >= self.MAX_HISTORY and
+               (self._patches[0] or len(self._history) > 1)):
+            if self._patches[0]:
+                self._patches[0].pop(0)
+            else:
+                spare = self._history.pop(0)
+                self._patches.pop(0)
+        
+        if region is None:
+            self._history.append(self._recycle(self._history[-1],spare))
+            self._patches.append([])
         else:
-            #remove original copy
-            self._history.pop(0)
-            self._history.append(self._history[-1].copy())
-
+            row, col, height, width = imgmask.bounds(region)
+            saved = self._history[-1].getRegion(row,col,height,width).copy()
+            self._patches[-1].append((row,col,saved))
+        self._peak = self.getFootprint()['peak']
+    
+    # HIDDEN METHODS
+    def _share(self, image):
+        """
+        Returns: A copy of image that shares its pixels until written (see Pixels.share)
+        
+        Parameter image: The image to copy
+        Precondition: image is an Image object that is never modified
+        """
+        return imgimage.Image(image.getPixels().share(),image.getWidth())
+    
+    def _recycle(self, image, spare):
+        """
+        Returns: A copy of image, reusing the pixel storage of spare if possible
+        
+        The storage of spare is only reused if it is flat (not a view or tiles) and has
+        the same size as image.
+        
+        Parameter image: The image to copy
+        Precondition: image is an Image object
+        
+        Parameter spare: An image dropped from the history (or None)
+        Precondition: spare is an Image object that is no longer used, or None
+        """
+        if spare is not None:
+            data = spare.getPixels()
+            if type(data) in (pixels.Pixels,pixels.MappedPixels) and len(data) == image.getLength():
+                data.refill(image.getPixels())
+                return imgimage.Image(data,image.getWidth())
+        return image.copy()
+    
+    def _trimRedo(self):
+        """
+        Drops the first undone edits until the rest are under REDO_BUDGET
+        """
+        sizes = [sum(image.getLength()*image.getChannels() for image in self._redoImages(entry))
+                 for entry in self._redo]
+        total = sum(sizes)
+        while total > self.REDO_BUDGET and self._redo:
+            self._redo.pop(0)
+            total -= sizes.pop(0)
+    
+    def _redoImages(self, entry):
+        """
+        Returns: The images held by an undone edit, as a tuple
+        
+        Parameter entry: The undone edit
+        Precondition: entry is an element of _redo
+        """
+        return entry[1:2] if entry[0] == 'image' else entry[3:5]
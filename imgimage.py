@@ -27,6 +27,10 @@ class Image(object):
     If you want to treat the image like a 1D list you use the methods `getFlatPixel` and
     `setFlatPixel`.  These methods are used by the steganography methods.
     
+    The methods `getPixelUnchecked` and `setPixelUnchecked` are like `getPixel` and 
+    `setPixel`, except that they do not enforce their preconditions.  They are for the 
+    inner loops of operations that check their arguments once, before the loop.
+    
     IMMUTABLE ATTRIBUTES (Fixed after initialization)
         _pixels: The underlying list of pixels      [Pixel object]
         _length: The number of pixels in the list   [int >= 0]
@@ -53,6 +57,14 @@ class Image(object):
         """
         return int(self._length)
     
+    def getChannels(self):
+        """
+        Returns: the bytes stored per pixel: 1 (grey), 3 (RGB) or 4 (RGBA)
+        
+        The pixels are (r,g,b) tuples whatever the storage (see Pixels.channels).
+        """
+        return self._pixels.channels
+    
     # MUTABLE ATTRIBUTES
     def getWidth(self):
         """
@@ -158,19 +170,10 @@ class Image(object):
         a string.  Note there is one space between each pixel, but TWO spaces after each
         row.
         """
-
-        string = ''
-        #alternatively, for x in range(0, int(self._height), int(self._width))
-        for x in range(int(self._height)):
-            string = string + '['
-            for y in range(int(self._width)):
-                string = string + str(self.getPixel(x, y))
-                if(y < self._width - 1):
-                    string = string +', '
-            string = string + ']'
-            if(x < self._height - 1):
-                string = string +',  '            
-        return '[' + string + ']'
+        rows = []
+        for row in self.rows():
+            rows.append('['+', '.join(map(str,pixels._unpack(row,self.getChannels())))+']')
+        return '[' + ',  '.join(rows) + ']'
     
             
     # ACCESS METHODS
@@ -226,6 +229,41 @@ class Image(object):
         
         self._pixels[self._width*row+col] = pixel
     
+    def getPixelUnchecked(self, row, col):
+        """
+        Returns: The pixel value at (row, col), without checking the position
+        
+        This is the same as getPixel, but it does not enforce the preconditions, which 
+        makes it much faster.  Use it in loops whose positions were checked once (such
+        as loops over range(getHeight()) and range(getWidth())).  A column outside of
+        the image is not detected, and reads a pixel of another row.
+        
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+        
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        return self._pixels[self._width*row+col]
+    
+    def setPixelUnchecked(self, row, col, pixel):
+        """
+        Sets the pixel value at (row, col) to pixel, without checking the position
+        
+        This is the same as setPixel, but it does not enforce the preconditions on row
+        and col (see getPixelUnchecked).  The pixel list still checks the pixel.
+        
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+        
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) where each value is 0..255
+        """
+        self._pixels[self._width*row+col] = pixel
+    
     def getFlatPixel(self, n):
         """
         Returns: Pixel number n of the image (from the underlying pixel list)
@@ -263,6 +301,86 @@ class Image(object):
         """
         self._pixels[n] = pixel
     
+    def getTiles(self):
+        """
+        Returns: A list of rectangles (row, col, height, width) covering this image
+        
+        The rectangles do not overlap, and are in the order that the underlying pixel 
+        list stores them.  Operations that visit every pixel independently should go 
+        one rectangle at a time, as this keeps the working set bounded for tiled or 
+        memory mapped storage.
+        """
+        return self._pixels.tiles(self.getWidth())
+    
+    def rows(self):
+        """
+        Returns: An iterator over the rows of this image, from top to bottom
+        
+        Each row is a read-only memoryview of the width*channels bytes of that row (see 
+        Pixels.rows).
+        This is the fastest way to scan an image a row at a time.
+        """
+        return self._pixels.rows(self.getWidth())
+    
+    # VIEW METHODS
+    def getRow(self, row):
+        """
+        Returns: A view of the given row of this image
+        
+        The view is a pixel list that refers to this image, so changing it changes the
+        image.  No pixels are copied.
+        
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+        """
+        assert isinstance(row, int)
+        assert 0 <= row and row < self._height
+        
+        return pixels.PixelView(self._pixels,row*self._width,self.getWidth())
+    
+    def getColumn(self, col):
+        """
+        Returns: A view of the given column of this image
+        
+        The view is a pixel list that refers to this image, so changing it changes the
+        image.  No pixels are copied.
+        
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        assert isinstance(col, int)
+        assert 0 <= col and col < self._width
+        
+        return pixels.PixelView(self._pixels,col,self.getHeight(),self.getWidth())
+    
+    def getRegion(self, row, col, height, width):
+        """
+        Returns: A view of the given rectangle of this image, as an Image
+        
+        The result is an Image whose pixel list refers to this image, so any operation 
+        on the result modifies the rectangle of this image.  No pixels are copied. 
+        Use copy() on the result to get an independent image.
+        
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+        
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+        
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+        
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        assert isinstance(row, int) and isinstance(col, int)
+        assert 0 <= row and row < self._height and 0 <= col and col < self._width
+        assert isinstance(height, int) and height > 0 and row+height <= self._height
+        assert isinstance(width, int) and width > 0 and col+width <= self._width
+        
+        data = pixels.PixelView(self._pixels,row*self._width+col,height*width,1,width,self.getWidth())
+        return Image(data,width)
+    
     # ADDITIONAL METHODS
     def swapPixels(self, row1, col1, row2, col2):
         """
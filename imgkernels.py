@@ -0,0 +1,257 @@
+"""
+Fast versions of the Editor operations that only need the standard library
+
+The Editor methods visit an image one pixel tuple at a time, which is easy to read but
+slow in Python.  The kernels in this module compute the same pixels on whole bands of
+rows at once.  They use the byte-level tools of the standard library, which loop in C
+rather than in Python:
+
+    * extended slices (buffer[0::3]) to pull out (and put back) one channel,
+    * bytes.translate with a 256 byte table for per-channel lookup tables,
+    * map over bound methods (such as list.__getitem__) for per-pixel arithmetic, and
+    * slice assignment to write a band (or fill a block) in a single step.
+
+A kernel reads a band with a pixel list slice, and writes the result back with a slice
+assignment.  Those are bulk copies for flat and mapped pixels, for region views and for
+tiles, so every kernel works with any storage.  The result is exactly the result of the
+Editor method, for grey, RGB and RGBA pixels (alpha is never changed by the methods, so
+it is kept by the kernels too).
+
+Each kernel takes the image and the arguments of the operation, and returns True if it
+edited the image.  It returns False, without changing anything, if the arguments do not
+satisfy the preconditions of the method, so that running the method raises the error.
+KERNELS maps each operation name to its kernel (see Editor.ACCELERATE).
+"""
+import operator
+import sys
+import pixels
+
+
+# The byte of a 16 bit key that holds the red byte (see _RED_GREEN)
+_RED_BYTE = 0 if sys.byteorder == 'little' else 1
+
+# The lookup table that inverts a byte
+_INVERT = bytes(255-value for value in range(256))
+
+# The terms of the brightness 0.3 * red + 0.6 * green + 0.1 * blue (see monochromify)
+# The first two are looked up together, using the red and green bytes of a pixel as the
+# two bytes of a 16 bit key (in the byte order of this machine)
+_RED_GREEN = [0.3*(key >> 8*_RED_BYTE & 0xff)+0.6*(key >> 8-8*_RED_BYTE & 0xff) for key in range(65536)]
+_BLUE = [0.1*value for value in range(256)]
+
+
+def invert(image):
+    """
+    Returns: True after inverting the image (see Editor.invert)
+
+    Each color byte is inverted with a single bytes.translate per band.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+    """
+    def kernel(data, channels, height):
+        result = bytearray(data.translate(_INVERT))
+        if channels == 4:
+            result[3::4] = data[3::4]
+        return result, channels
+
+    _map(image,kernel)
+    return True
+
+
+def monochromify(image, sepia):
+    """
+    Returns: True after converting the image to monochrome (see Editor.monochromify)
+
+    The brightness is computed with the same floating point operations as the method
+    (so the bytes are identical), using lookup tables for the terms.  The red and green
+    channels are interleaved and cast to 16 bit keys, so that one lookup gives the sum
+    of their terms.  A greyscale image is stored with one channel afterwards, like the
+    method does.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+
+    Parameter sepia: Whether to use sepia tone instead of greyscale.
+    Precondition: sepia is a bool
+    """
+    if not isinstance(sepia, bool):
+        return False
+
+    def kernel(data, channels, height):
+        step  = min(channels,3)
+        red   = data[0::channels]
+        pairs = bytearray(2*len(red))
+        pairs[_RED_BYTE::2]   = red
+        pairs[1-_RED_BYTE::2] = data[1 % step::channels]
+        with memoryview(pairs) as view, view.cast('H') as keys:
+            brightness = list(map(operator.add,map(_RED_GREEN.__getitem__,keys),
+                                  map(_BLUE.__getitem__,data[2 % step::channels])))
+        if sepia:
+            green = bytes(map(int,map((0.6).__mul__,brightness)))
+            blue  = bytes(map(int,map((0.4).__mul__,brightness)))
+        else:
+            red = green = blue = bytes(map(int,brightness))
+
+        if channels == 1 and red == green == blue:
+            return bytearray(red), 1
+        size   = max(channels,3)
+        result = bytearray(len(red)*size)
+        result[0::size] = red
+        result[1::size] = green
+        result[2::size] = blue
+        if channels == 4:
+            result[3::4] = data[3::4]
+        return result, size
+
+    _map(image,kernel)
+    if not sepia:
+        image.getPixels().compact()
+    return True
+
+
+def reflectHori(image):
+    """
+    Returns: True after reflecting the image around the horizontal middle
+
+    Each row is reversed with one reversed extended slice per color channel.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+    """
+    width = image.getWidth()
+
+    def kernel(data, channels, height):
+        result = bytearray(data)
+        span = width*channels
+        for start in range(0,height*span,span):
+            for channel in range(min(channels,3)):
+                result[start+channel:start+span:channels] = data[start+channel:start+span:channels][::-1]
+        return result, channels
+
+    _map(image,kernel)
+    return True
+
+
+def reflectVert(image):
+    """
+    Returns: True after reflecting the image around the vertical middle
+
+    Each pair of rows is swapped with two slice assignments.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+    """
+    data   = image.getPixels()
+    width  = image.getWidth()
+    height = image.getHeight()
+    for row in range(height//2):
+        upper = slice(row*width,(row+1)*width)
+        lower = slice((height-1-row)*width,(height-row)*width)
+        first  = data[upper]
+        second = data[lower]
+        data[upper] = _keep_alpha(second,first)
+        data[lower] = _keep_alpha(first,second)
+    return True
+
+
+def pixellate(image, step):
+    """
+    Returns: True after pixellating the image (see Editor.pixellate)
+
+    The image is processed one band of step rows at a time.  The sum of each column of
+    the band is computed (per channel) by zipping the rows, so the sum of a block is
+    the sum of a slice of the column sums.  Each block is then filled by slice
+    assignment.  The averages are rounded exactly like the method (which counts the
+    corner pixel of each block twice).
+
+    If step is not a positive int, this returns False.  Like the method, it raises a 
+    ValueError if an average is more than 255 (which can happen for small blocks).
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+
+    Parameter step: The number of pixels in a pixellated block
+    Precondition: step is an int > 0
+    """
+    if not isinstance(step, int) or step <= 0:
+        return False
+
+    data   = image.getPixels()
+    width  = image.getWidth()
+    height = image.getHeight()
+    for top in range(0,height,step):
+        rows = min(step,height-top)
+        band = data[top*width:(top+rows)*width]
+        channels = band.channels
+        source = bytes(band.buffer)
+        result = bytearray(source)
+        for channel in range(min(channels,3)):
+            plane = source[channel::channels]
+            lines = [plane[row*width:(row+1)*width] for row in range(rows)]
+            sums  = list(map(sum,zip(*lines)))
+            filled = bytearray()
+            for left in range(0,width,step):
+                cols = min(step,width-left)
+                total = plane[left]+sum(sums[left:left+cols])
+                average = int(round(total/(rows*cols)))
+                if average > 255:
+                    raise ValueError(repr(average)+' is not a valid pixel value')
+                filled += bytes((average,))*cols
+            result[channel::channels] = filled*rows
+        data[top*width:(top+rows)*width] = pixels.Pixels.fromBuffer(result,channels)
+    return True
+
+
+# The kernel for each operation that has one
+KERNELS = {'invert': invert, 'monochromify': monochromify, 'reflectHori': reflectHori,
+           'reflectVert': reflectVert, 'pixellate': pixellate}
+
+
+def _map(image, kernel):
+    """
+    Replaces each band of rows of the image with the result of the kernel
+
+    The bands are the storage tiles of the image (see Image.getTiles) if those are bands
+    of whole rows, and single rows otherwise.  The kernel is called as
+
+        kernel(data, channels, height)
+
+    where data is the bytes of the band (with the given channels) and height is its
+    number of rows.  It returns a pair (result, channels) of the new bytes of the band,
+    as a bytearray, and their channels.
+
+    Parameter image: The image to edit
+    Precondition: image is an Image object
+
+    Parameter kernel: The function computing the new bands
+    Precondition: kernel is a function as described above
+    """
+    data  = image.getPixels()
+    width = image.getWidth()
+    tiles = image.getTiles()
+    if any(left != 0 or cols != width for top, left, rows, cols in tiles):
+        tiles = [(row,0,1,width) for row in range(image.getHeight())]
+    for top, left, rows, cols in tiles:
+        band = data[top*width:(top+rows)*width]
+        result, channels = kernel(bytes(band.buffer),band.channels,rows)
+        data[top*width:(top+rows)*width] = pixels.Pixels.fromBuffer(result,channels)
+
+
+def _keep_alpha(colors, alpha):
+    """
+    Returns: The pixels colors, with the alpha of the pixels alpha
+
+    This is how a kernel moves pixels with alpha, as the methods only move the colors.
+
+    Parameter colors: The pixels to move
+    Precondition: colors is a flat Pixels object
+
+    Parameter alpha: The pixels that are overwritten
+    Precondition: alpha is a flat Pixels object of the same length
+    """
+    if colors.channels != 4 or alpha.channels != 4:
+        return colors
+    result = colors.copy()
+    result.buffer[3::4] = alpha.buffer[3::4]
+    return result
@@ -0,0 +1,109 @@
+"""
+Selection masks for region-of-interest editing
+
+An Editor operation can be limited to part of the image (see Editor.perform).  That
+part is either a rectangle, given as a tuple (row, col, height, width), or a Mask.  A
+mask is a rectangle together with a flag for each pixel in it, saying whether that
+pixel is selected.  The operation is run on the rectangle, and the pixels that are not
+selected are then put back.
+"""
+
+
+class Mask(object):
+    """
+    A class representing an arbitrary selection of pixels in an image
+
+    All pixels of a new mask are selected.  Use setSelected to deselect pixels.
+
+    IMMUTABLE ATTRIBUTES
+        _row:    The top row of the bounding rectangle         [int >= 0]
+        _col:    The left column of the bounding rectangle     [int >= 0]
+        _height: The number of rows in the bounding rectangle  [int > 0]
+        _width:  The number of columns in the rectangle        [int > 0]
+
+    MUTABLE ATTRIBUTES
+        _flags:  The selection flag of each pixel in the rectangle, row-major
+                 [bytearray of length height*width]
+    """
+
+    def getBounds(self):
+        """
+        Returns: The bounding rectangle (row, col, height, width) of this mask
+        """
+        return (self._row, self._col, self._height, self._width)
+
+    def isSelected(self, row, col):
+        """
+        Returns: True if the pixel at (row, col) of the image is selected
+
+        Pixels outside of the bounding rectangle are never selected.
+
+        Parameter row: The image row
+        Precondition: row is an int
+
+        Parameter col: The image column
+        Precondition: col is an int
+        """
+        row -= self._row
+        col -= self._col
+        if 0 <= row < self._height and 0 <= col < self._width:
+            return self._flags[row*self._width+col] == 1
+        return False
+
+    def setSelected(self, row, col, flag):
+        """
+        Selects or deselects the pixel at (row, col) of the image
+
+        Parameter row: The image row
+        Precondition: row is an int inside the bounding rectangle
+
+        Parameter col: The image column
+        Precondition: col is an int inside the bounding rectangle
+
+        Parameter flag: Whether to select the pixel
+        Precondition: flag is a bool
+        """
+        assert 0 <= row-self._row < self._height, repr(row)+' is outside of the mask'
+        assert 0 <= col-self._col < self._width, repr(col)+' is outside of the mask'
+        self._flags[(row-self._row)*self._width+col-self._col] = 1 if flag else 0
+
+    def __init__(self, row, col, height, width):
+        """
+        Initializer: Creates a mask selecting the entire given rectangle
+
+        Parameter row: The top row of the bounding rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the bounding rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the bounding rectangle
+        Precondition: height is an int > 0
+
+        Parameter width: The number of columns in the bounding rectangle
+        Precondition: width is an int > 0
+        """
+        assert type(row) == int and row >= 0, repr(row)+' is not a valid row'
+        assert type(col) == int and col >= 0, repr(col)+' is not a valid column'
+        assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+
+        self._row    = row
+        self._col    = col
+        self._height = height
+        self._width  = width
+        self._flags  = bytearray(b'\x01')*(height*width)
+
+
+def bounds(region):
+    """
+    Returns: The bounding rectangle (row, col, height, width) of the given region
+
+    Parameter region: The region
+    Precondition: region is a Mask or a tuple (row, col, height, width) of ints
+    """
+    if isinstance(region, Mask):
+        return region.getBounds()
+    assert type(region) in (tuple,list) and len(region) == 4, repr(region)+' is not a rectangle'
+    assert all(type(value) == int for value in region), repr(region)+' is not a rectangle'
+    return tuple(region)
@@ -0,0 +1,220 @@
+"""
+A cache of the results of Editor operations
+
+Applying the same operation to the same image always gives the same result.  That
+happens more than you would think: an edit that is undone and then redone, or a batch
+job that is run again on the same inputs.  So an Editor with a ResultCache (see
+Editor.setMemo) looks up each operation before running it.  The key of a result is a
+hash of the pixels and width of the image, the operation name and its arguments.
+
+Hashing the pixels would cost a full pass over the image for every operation.  But a
+pixel list keeps the hash of each chunk of pixels until that chunk is written, and a
+copy starts with the hashes of the original (see Pixels.digest).  Because every edit
+starts with a copy, only the chunks changed by the last edit are hashed again.
+
+Results are kept in memory, up to a limit of bytes, and the least recently used ones are
+dropped first.  With a spill directory, dropped results are saved there instead (see
+imgcache), and are found there by later lookups, even in another process.
+"""
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+import pixels
+import imgimage
+
+
+# The default memory limit of the shared cache, in bytes (0 to not cache results)
+MEMO_LIMIT = 256*1024*1024
+
+# The default spill directory of the shared cache (None to not spill)
+MEMO_DIR = None
+
+# The default limit of the spill directory, in bytes
+SPILL_LIMIT = 1024*1024*1024
+
+
+class ResultCache(object):
+    """
+    A class representing a byte-bounded LRU cache of operation results
+
+    MUTABLE ATTRIBUTES
+        _limit:   The most bytes of results to keep in memory  [int >= 0]
+        _used:    The bytes of results in memory               [int >= 0]
+        _entries: The results by key, oldest first             [OrderedDict of str to Image]
+        _hits:    The number of lookups that found a result    [int >= 0]
+        _misses:  The number of lookups that did not           [int >= 0]
+
+    IMMUTABLE ATTRIBUTES
+        _spill:   The store for dropped results (or None)      [DecodeCache or None]
+    """
+
+    def getLimit(self):
+        """
+        Returns: The most bytes of results that this cache keeps in memory
+        """
+        return self._limit
+
+    def getUsed(self):
+        """
+        Returns: The bytes of results that this cache has in memory
+        """
+        return self._used
+
+    def getStats(self):
+        """
+        Returns: The number of hits and misses so far, as a pair (hits, misses)
+        """
+        return (self._hits,self._misses)
+
+    def __len__(self):
+        """
+        Returns: The number of results in memory
+        """
+        return len(self._entries)
+
+    def __init__(self, limit=MEMO_LIMIT, spill=None, spill_limit=SPILL_LIMIT):
+        """
+        Initializer: Creates an empty cache
+
+        Parameter limit: The most bytes of results to keep in memory
+        Precondition: limit is an int >= 0
+
+        Parameter spill: The directory to save dropped results to (None to not save them)
+        Precondition: spill is a string or None
+
+        Parameter spill_limit: The most bytes of results to keep in spill
+        Precondition: spill_limit is an int >= 0
+        """
+        assert type(limit) == int and limit >= 0, repr(limit)+' is not a valid limit'
+        self._limit   = limit
+        self._used    = 0
+        self._entries = OrderedDict()
+        self._hits    = 0
+        self._misses  = 0
+        self._lock    = threading.Lock()
+        self._spill   = None
+        if spill is not None:
+            import imgcache
+            self._spill = imgcache.DecodeCache(spill,spill_limit)
+
+    def key(self, image, name, args):
+        """
+        Returns: The key of the result of operation name on image
+
+        Parameter image: The image before the operation
+        Precondition: image is an Image object
+
+        Parameter name: The operation name
+        Precondition: name is a string
+
+        Parameter args: The operation arguments
+        Precondition: args is a tuple of values with a stable repr
+        """
+        result = hashlib.blake2b(image.getPixels().digest(),digest_size=20)
+        result.update(repr((image.getWidth(),image.getChannels(),name,args)).encode('utf-8'))
+        return result.hexdigest()
+
+    def lookup(self, key):
+        """
+        Returns: The result for key, or None if there is none
+
+        The result is shared with the cache, and must not be modified.
+
+        Parameter key: The result key
+        Precondition: key is a value returned by the method key
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return result
+        if self._spill is not None:
+            result = self._spill.get(self._spill.path(key))
+        with self._lock:
+            if result is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+        # Keep a copy in memory, as spilled results are memory mapped
+        return self._add(key,result.copy())
+
+    def store(self, key, image):
+        """
+        Saves a copy of image as the result for key
+
+        Parameter key: The result key
+        Precondition: key is a value returned by the method key
+
+        Parameter image: The result of the operation
+        Precondition: image is an Image object
+        """
+        buffer = array('B')
+        buffer.frombytes(image.getPixels().buffer)
+        data = pixels.Pixels.fromBuffer(buffer,image.getChannels())
+        self._add(key,imgimage.Image(data,image.getWidth()))
+
+    def clear(self):
+        """
+        Drops every result in memory (but not those in the spill directory)
+        """
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
+
+    def _add(self, key, image):
+        """
+        Returns: image, after adding it as the result for key
+
+        Results that do not fit are dropped (or spilled), oldest first.
+
+        Parameter key: The result key
+        Precondition: key is a value returned by the method key
+
+        Parameter image: The result, in flat storage
+        Precondition: image is an Image object
+        """
+        size = _size(image)
+        dropped = []
+        with self._lock:
+            if key in self._entries:
+                self._used -= _size(self._entries.pop(key))
+            self._entries[key] = image
+            self._used += size
+            while self._used > self._limit and self._entries:
+                old, result = self._entries.popitem(last=False)
+                self._used -= _size(result)
+                dropped.append((old,result))
+        if self._spill is not None:
+            for old, result in dropped:
+                self._spill.put(self._spill.path(old),result)
+        return image
+
+
+def _size(image):
+    """
+    Returns: The bytes of pixels in image
+
+    Parameter image: A result in the cache
+    Precondition: image is an Image object
+    """
+    return image.getLength()*image.getChannels()
+
+
+# The cache shared by every editor in this process (see get_memo)
+_shared = None
+
+
+def get_memo():
+    """
+    Returns: The result cache shared by this process (None if MEMO_LIMIT is 0)
+
+    The cache is made on first use, with MEMO_LIMIT and MEMO_DIR.
+    """
+    global _shared
+    if MEMO_LIMIT <= 0:
+        return None
+    if _shared is None:
+        _shared = ResultCache(MEMO_LIMIT,MEMO_DIR)
+    return _shared
@@ -0,0 +1,224 @@
+"""
+Background loading of the neighbors of an image file
+
+When stepping through a folder of photos, each image is usually followed by the next (or
+previous) one in the folder.  So after an image is opened, a Prefetcher loads the files
+on either side of it in a background thread.  If the next file opened is one of those,
+it is ready immediately.
+
+Prefetched images are kept in memory, up to a budget of bytes.  Images that are no longer
+neighbors of the current file are dropped first.  Files are loaded with imgfile.read_image,
+so they also go into the on-disk cache of decoded images (see imgcache).
+"""
+import os
+import threading
+from collections import OrderedDict
+
+
+# The default memory budget of a prefetcher, in bytes
+PREFETCH_BUDGET = 256*1024*1024
+
+# The file extensions that are prefetched (those of the load dialogs)
+IMAGE_EXTS = ('.png','.jpg','.jpeg','.gif','.imgr')
+
+
+def neighbors(file, count=1):
+    """
+    Returns: The image files next to file in its folder, closest first
+
+    Files are ordered by name, as in the load dialog.  The result alternates between the
+    next and the previous file, so the list for count 2 is [next, previous, next after
+    that, previous before that] (skipping those that do not exist).
+
+    Parameter file: An absolute path to an image file
+    Precondition: file is a string
+
+    Parameter count: The number of files on each side
+    Precondition: count is an int >= 0
+    """
+    folder, name = os.path.split(os.path.abspath(file))
+    try:
+        names = sorted(item for item in os.listdir(folder)
+                       if os.path.splitext(item)[1].lower() in IMAGE_EXTS)
+    except OSError:
+        return []
+    if name not in names:
+        return []
+
+    pos = names.index(name)
+    result = []
+    for step in range(1,count+1):
+        if pos+step < len(names):
+            result.append(os.path.join(folder,names[pos+step]))
+        if pos-step >= 0:
+            result.append(os.path.join(folder,names[pos-step]))
+    return result
+
+
+class Prefetcher(object):
+    """
+    A class to load the neighbors of an image file in the background
+
+    Each prefetcher has a single daemon thread, started on the first call to prefetch.
+    Images are handed out by take, which removes them from the prefetcher.
+
+    MUTABLE ATTRIBUTES
+        _budget:    The most bytes of images to keep           [int >= 0]
+        _images:    The loaded images by file, oldest first    [OrderedDict of str to Image]
+        _neighbors: The neighbors of the open file, closest first  [list of str]
+        _wanted:    The neighbors not yet loaded, closest first    [list of str]
+        _loading:   The file being loaded (or None)            [str or None]
+    """
+
+    def getBudget(self):
+        """
+        Returns: The most bytes of images that this prefetcher keeps
+        """
+        return self._budget
+
+    def setBudget(self, value):
+        """
+        Sets the most bytes of images that this prefetcher keeps
+
+        Parameter value: The new budget (0 to not prefetch)
+        Precondition: value is an int >= 0
+        """
+        assert type(value) == int and value >= 0, repr(value)+' is not a valid budget'
+        with self._lock:
+            self._budget = value
+            self._trim()
+
+    def getUsed(self):
+        """
+        Returns: The bytes of the images held by this prefetcher
+        """
+        with self._lock:
+            return sum(map(self._size,self._images.values()))
+
+    def __init__(self, budget=PREFETCH_BUDGET, count=1, reader=None):
+        """
+        Initializer: Creates a prefetcher with no images
+
+        Parameter budget: The most bytes of images to keep
+        Precondition: budget is an int >= 0
+
+        Parameter count: The number of files to load on each side of an open file
+        Precondition: count is an int >= 0
+
+        Parameter reader: The function to load a file (imgfile.read_image if None)
+        Precondition: reader is None or a callable taking a file name
+        """
+        assert type(budget) == int and budget >= 0, repr(budget)+' is not a valid budget'
+        assert type(count) == int and count >= 0, repr(count)+' is not a valid count'
+        if reader is None:
+            import imgfile
+            reader = imgfile.read_image
+        self._budget = budget
+        self._count  = count
+        self._reader = reader
+        self._images = OrderedDict()
+        self._neighbors = []
+        self._wanted  = []
+        self._loading = None
+        self._lock    = threading.Condition()
+        self._thread  = None
+
+    def take(self, file):
+        """
+        Returns: The prefetched image for file, or None if it was not prefetched
+
+        The image is removed from the prefetcher, so the caller owns it.
+
+        Parameter file: An absolute path to an image file
+        Precondition: file is a string
+        """
+        with self._lock:
+            return self._images.pop(os.path.abspath(file),None)
+
+    def prefetch(self, file):
+        """
+        Starts loading the neighbors of file, replacing any earlier request
+
+        Parameter file: An absolute path to the image file just opened
+        Precondition: file is a string
+        """
+        wanted = neighbors(file,self._count) if self._budget > 0 else []
+        with self._lock:
+            self._neighbors = wanted
+            self._wanted = [item for item in wanted if item not in self._images]
+            self._trim()
+            if self._thread is None and self._wanted:
+                self._thread = threading.Thread(target=self._run,daemon=True)
+                self._thread.start()
+            self._lock.notify()
+
+    def wait(self, timeout=None):
+        """
+        Returns: True if every requested file has been loaded (or skipped)
+
+        Parameter timeout: The most seconds to wait (forever if None)
+        Precondition: timeout is None or a number >= 0
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: not self._wanted and self._loading is None,timeout)
+
+    def clear(self):
+        """
+        Drops every image, and cancels any files not yet loaded
+        """
+        with self._lock:
+            self._images.clear()
+            self._neighbors = []
+            self._wanted = []
+
+    # HIDDEN METHODS
+    def _run(self):
+        """
+        Loads the requested files until the program ends
+
+        This is the body of the prefetch thread.
+        """
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._wanted)
+                file = self._wanted[0]
+                self._loading = file
+
+            try:
+                image = self._reader(file)
+            except:
+                image = None
+
+            with self._lock:
+                self._loading = None
+                if file in self._wanted:
+                    self._wanted.remove(file)
+                    if image is not None:
+                        self._images[file] = image
+                        self._trim()
+                self._lock.notify_all()
+
+    def _trim(self):
+        """
+        Drops images until the prefetcher is within its budget
+
+        Images that are not neighbors of the open file are dropped first, oldest first.
+        Then the neighbors are dropped, farthest first.
+        """
+        used = sum(map(self._size,self._images.values()))
+        if used <= self._budget:
+            return
+        rank = {item: pos for pos, item in enumerate(reversed(self._neighbors))}
+        for item in sorted(self._images,key=lambda item: rank.get(item,-1)):
+            if used <= self._budget:
+                break
+            used -= self._size(self._images.pop(item))
+
+    def _size(self, image):
+        """
+        Returns: The bytes of pixel data in image
+
+        Parameter image: The image to measure
+        Precondition: image is an Image object
+        """
+        return image.getLength()*image.getChannels()
@@ -0,0 +1,205 @@
+"""
+Profiling support for the imager application
+
+This module runs an operation chain (see imgbatch) under two profilers at once.  The
+first is cProfile, which counts the calls and time of every function.  It is summarized
+as the hottest functions in the image modules (pixels.py, imgimage.py and imgeditor.py).
+The second is a sampling profiler, which records the call stack of the running thread at
+regular intervals.  The samples are written in the collapsed stack format, one stack per
+line, as in
+
+    __main__.py:execute;imgbatch.py:run_chain;imgeditor.py:invert 1234
+
+which is the input format of flamegraph tools (such as flamegraph.pl or speedscope).
+
+Both profilers slow the operations down, cProfile by the most.  The sampler sees that
+overhead spread over every function, so the proportions in the flamegraph are still
+meaningful, but the absolute times are not.
+"""
+import os
+import sys
+import time
+import threading
+
+
+# The modules summarized by hot_functions
+IMAGE_MODULES = ('pixels.py','imgimage.py','imgeditor.py')
+
+
+class Sampler(object):
+    """
+    A sampling profiler for a single thread
+
+    The sampler runs in a background thread.  It wakes up every interval seconds, and
+    counts the call stack of the profiled thread at that moment.
+
+    MUTABLE ATTRIBUTES
+        _counts: The number of samples of each stack           [dict of tuple to int]
+    """
+
+    def getCounts(self):
+        """
+        Returns: A dictionary from each stack to the number of samples of it
+
+        A stack is a tuple of frame labels 'file:function', outermost first.
+        """
+        return dict(self._counts)
+
+    def __init__(self, interval=0.001):
+        """
+        Initializer: Creates a sampler that is not running
+
+        Parameter interval: The time between samples, in seconds
+        Precondition: interval is a number > 0
+        """
+        assert interval > 0, repr(interval)+' is not a valid interval'
+        self._interval = interval
+        self._counts   = {}
+        self._target   = None
+        self._thread   = None
+        self._running  = threading.Event()
+
+    def start(self):
+        """
+        Starts sampling the calling thread
+        """
+        self._target = threading.get_ident()
+        self._running.set()
+        self._thread = threading.Thread(target=self._sample,daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling, and waits for the sampling thread to finish
+        """
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def collapsed(self):
+        """
+        Returns: The samples in the collapsed stack format, as a list of lines
+
+        The lines are sorted, with the most common stacks first.
+        """
+        items = sorted(self._counts.items(),key=lambda item: -item[1])
+        return [';'.join(stack)+' '+str(count) for stack, count in items]
+
+    def write(self, file):
+        """
+        Writes the samples to the given file in the collapsed stack format
+
+        Parameter file: The output file
+        Precondition: file is a string
+        """
+        with open(file,'w') as handle:
+            for line in self.collapsed():
+                handle.write(line+'\n')
+
+    def _sample(self):
+        """
+        Samples the profiled thread until stopped
+
+        This is the body of the sampling thread.
+        """
+        while self._running.is_set():
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(os.path.basename(code.co_filename)+':'+code.co_name)
+                    frame = frame.f_back
+                stack = tuple(reversed(stack))
+                self._counts[stack] = self._counts.get(stack,0)+1
+            time.sleep(self._interval)
+
+
+def hot_functions(stats, modules=IMAGE_MODULES, top=15):
+    """
+    Returns: The functions of the given modules with the most time, hottest first
+
+    Each function is a tuple (label, calls, tottime, cumtime) where label is
+    'file:line(function)', tottime is the time in the function itself and cumtime
+    includes the functions that it calls.
+
+    Parameter stats: The profile statistics
+    Precondition: stats is a pstats.Stats object
+
+    Parameter modules: The module file names to include
+    Precondition: modules is a tuple of strings
+
+    Parameter top: The number of functions to return
+    Precondition: top is an int >= 0
+    """
+    result = []
+    for (file, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        if os.path.basename(file) in modules:
+            label = '{}:{}({})'.format(os.path.basename(file),line,name)
+            result.append((label,calls,tottime,cumtime))
+    result.sort(key=lambda item: -item[2])
+    return result[:top]
+
+
+def profile_chain(source, chain, region=None, output=None, interval=0.001):
+    """
+    Returns: The profile (pstats.Stats) and Sampler for running a chain on an image
+
+    Reading and writing the image files are not profiled.
+
+    Parameter source: The input image file
+    Precondition: source is a string
+
+    Parameter chain: The operations to apply
+    Precondition: chain is a list of (name, args) pairs, as returned by parse_chain
+
+    Parameter region: The region of interest (see Editor.perform)
+    Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+
+    Parameter output: The file to save the result to (None to not save it)
+    Precondition: output is a string or None
+
+    Parameter interval: The time between samples, in seconds
+    Precondition: interval is a number > 0
+    """
+    import cProfile
+    import pstats
+    import imgfile
+    import imgeditor
+    import imgbatch
+
+    editor   = imgeditor.Editor(imgfile.read_image(source))
+    profiler = cProfile.Profile()
+    sampler  = Sampler(interval)
+
+    sampler.start()
+    profiler.enable()
+    try:
+        imgbatch.run_chain(editor,chain,region)
+    finally:
+        profiler.disable()
+        sampler.stop()
+
+    if output:
+        imgfile.write_image(editor.getCurrent(),output)
+    return (pstats.Stats(profiler),sampler)
+
+
+def report(stats, top=15, out=None):
+    """
+    Prints the hottest functions of the image modules
+
+    Parameter stats: The profile statistics
+    Precondition: stats is a pstats.Stats object
+
+    Parameter top: The number of functions to print
+    Precondition: top is an int >= 0
+
+    Parameter out: The stream to print to (standard output if None)
+    Precondition: out is a text stream or None
+    """
+    out = sys.stdout if out is None else out
+    print('{:<44} {:>10} {:>10} {:>10}'.format('function','calls','tottime','cumtime'),file=out)
+    for label, calls, tottime, cumtime in hot_functions(stats,IMAGE_MODULES,top):
+        print('{:<44} {:>10} {:>10.3f} {:>10.3f}'.format(label,calls,tottime,cumtime),file=out)
@@ -0,0 +1,367 @@
+"""
+Proxy-resolution editing for the imager application
+
+The GUI never shows an image at more than the size of its ImagePanel.  Yet every Editor
+operation runs at full resolution before the user sees anything.  In proxy mode, the
+operations instead run on a downscaled working copy (the proxy), so the preview is
+immediate.  Each operation is also recorded, and the recorded chain is replayed on the
+full-resolution image in a background thread.  Saving waits for the replay to catch up,
+so the saved image is always the full-resolution version of what the user sees.
+
+The proxy is made by keeping every factor-th pixel of every factor-th row, so a pixel
+(row, col) of the proxy is the pixel (row*factor, col*factor) of the original.  Regions
+are scaled the same way.  Operation arguments that are measured in pixels (such as the
+block size of pixellate or the thickness of frame) are listed in ProxyEditor.SCALED_ARGS
+and are divided by the factor for the preview.  Operations that draw features of a fixed
+size in pixels (such as jail) look thicker in the preview than in the result.
+"""
+import math
+import threading
+import pixels
+import imgimage
+import imgmask
+import imgeditor
+
+
+def downscale(image, factor):
+    """
+    Returns: A new image with every factor-th pixel of every factor-th row of image
+
+    The result has ceil(height/factor) rows and ceil(width/factor) columns.
+
+    Parameter image: The image to downscale
+    Precondition: image is an Image object
+
+    Parameter factor: The downscaling factor
+    Precondition: factor is an int > 0
+    """
+    assert isinstance(image, imgimage.Image), repr(image)+' is not an image'
+    assert type(factor) == int and factor > 0, repr(factor)+' is not a valid factor'
+
+    width  = (image.getWidth()+factor-1)//factor
+    height = (image.getHeight()+factor-1)//factor
+    view = pixels.PixelView(image.getPixels(),0,width*height,factor,width,factor*image.getWidth())
+    return imgimage.Image(view.copy(),width)
+
+
+def factor_for(image, width, height):
+    """
+    Returns: The smallest downscaling factor so that the image fits in width x height
+
+    Parameter image: The image to fit
+    Precondition: image is an Image object
+
+    Parameter width: The available width
+    Precondition: width is a number > 0
+
+    Parameter height: The available height
+    Precondition: height is a number > 0
+    """
+    return max(1,math.ceil(image.getWidth()/width),math.ceil(image.getHeight()/height))
+
+
+class ProxyEditor(imgeditor.Editor):
+    """
+    An editor that works on a downscaled proxy, replaying its edits at full resolution
+
+    This class is an Editor for the proxy image, so it can be used by the GUI in place
+    of an Editor.  In addition, it owns a second Editor for the full-resolution image.
+    The full-resolution editor lags behind: the edits that it has not applied yet are in
+    the list _pending.  A background thread applies them in order.
+
+    Undo, redo and clear are applied to both editors, so the two histories always
+    describe the same chain of edits.  If an edit fails on the full image, the full image
+    no longer matches the proxy.  The error is kept, and render raises it (until the
+    edits are cleared), so that a result without the edit is never saved.
+
+    IMMUTABLE ATTRIBUTES
+        _factor:  The downscaling factor                       [int > 0]
+        _full:    The full-resolution editor                   [Editor]
+
+    MUTABLE ATTRIBUTES
+        _pending: The edits not yet applied to _full, oldest first
+                  [list of [region, name, args] lists; name is None for an edit that
+                   was started (with increment) but never performed]
+        _undone:  How each undone edit was undone in _full, most recent last
+                  [list of [region, name, args] lists (taken from _pending) or None
+                   (undone in _full); never longer than the redo list of the proxy]
+        _failure: The error of the first edit that failed on _full (since the last
+                  clear)   [Exception or None]
+        _closed:  Whether the background thread should stop   [bool]
+    """
+    # The arguments (by operation and position) measured in pixels
+    SCALED_ARGS = {'pixellate': (0,), 'blur': (0,), 'boxBlur': (0,), 'sharpen': (0,),
+                   'grid': (0,), 'frame': (0,), 'cropMarks': (0,)}
+
+    def getFactor(self):
+        """
+        Returns: The downscaling factor of the proxy
+        """
+        return self._factor
+
+    def getFull(self):
+        """
+        Returns: The full-resolution editor
+
+        Its current image may not have all of the edits yet.  Call render() first.
+        """
+        return self._full
+
+    def __init__(self, original, factor):
+        """
+        Initializer: Creates a proxy editor for the given image
+
+        Parameter original: The (full-resolution) image to edit
+        Precondition: original is an Image object
+
+        Parameter factor: The downscaling factor for the proxy
+        Precondition: factor is an int > 0
+        """
+        # The full-resolution editor comes first, as it is part of the footprint
+        self._full    = imgeditor.Editor(original)
+        super().__init__(downscale(original,factor))
+        self._factor  = factor
+        self._pending = []
+        self._undone  = []
+        self._lock    = threading.Condition()
+        self._busy    = False
+        self._failure = None
+        self._closed  = False
+        self._worker  = threading.Thread(target=self._replay,daemon=True)
+        self._worker.start()
+
+    def setMemo(self, memo):
+        """
+        Sets the cache of operation results for both the proxy and the full image
+
+        Parameter memo: The result cache (or None to always run operations)
+        Precondition: memo is an imgmemo.ResultCache object or None
+        """
+        super().setMemo(memo)
+        self._full.setMemo(memo)
+
+    # EDIT METHODS
+    def increment(self, region=None):
+        """
+        Adds a new edit to the history of the proxy, and queues it for the full image
+
+        Parameter region: The region that the next edit will modify (in the proxy)
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+        """
+        super().increment(region)
+        with self._lock:
+            self._pending.append([region,None,()])
+            self._undone = []
+
+    def perform(self, name, *args, region=None):
+        """
+        Returns: The result of the operation applied to the proxy
+
+        The operation is recorded (with its original arguments) and replayed on the full
+        image in the background.  See Editor.perform for the parameters.  For the
+        operations in RESHAPING, the region must also be square in the full image.
+        """
+        if region is not None and name in self.RESHAPING:
+            bounds = self._bounds(region)
+            assert bounds[2] == bounds[3], repr(name)+' needs a region that is square in the full image'
+        scaled = list(args)
+        for pos in self.SCALED_ARGS.get(name,()):
+            scaled[pos] = max(1,round(scaled[pos]/self._factor))
+        result = super().perform(name,*scaled,region=region)
+
+        with self._lock:
+            if self._pending and self._pending[-1][1] is None:
+                self._pending[-1][1:] = [name,args]
+            else:
+                self._pending.append([region,name,args])
+            self._lock.notify()
+        return result
+
+    def undo(self):
+        """
+        Returns: True if the latest edit can be undone, False otherwise.
+
+        The edit is removed from the queue if it has not been replayed yet.  Otherwise
+        it is undone in the full-resolution editor as well.
+        """
+        if not super().undo():
+            return False
+        with self._lock:
+            while self._busy:
+                self._lock.wait()
+            if self._pending:
+                self._undone.append(self._pending.pop())
+            else:
+                self._full.undo()
+                self._undone.append(None)
+            del self._undone[:len(self._undone)-len(self._redo)]
+        return True
+
+    def redo(self):
+        """
+        Returns: True if an undone edit was put back, False otherwise.
+
+        An edit that was removed from the queue is queued again.  Otherwise it is redone
+        in the full-resolution editor as well.
+        """
+        with self._lock:
+            while self._busy:
+                self._lock.wait()
+            if not self._undone:
+                return False
+            entry = self._undone.pop()
+            if entry is not None:
+                self._pending.append(entry)
+                self._lock.notify()
+            elif not self._full.redo():
+                # The full image dropped it to stay in budget, so the proxy must too
+                self._undone = []
+                self._redo = []
+                return False
+        return super().redo()
+
+    def clear(self):
+        """
+        Deletes the entire edit history of both the proxy and the full image.
+        """
+        super().clear()
+        with self._lock:
+            while self._busy:
+                self._lock.wait()
+            self._pending = []
+            self._undone  = []
+            self._failure = None
+            self._full.clear()
+
+    def close(self):
+        """
+        Stops the background thread that replays edits on the full image
+
+        The thread refers to this editor, so an editor that is not closed is never
+        freed.  Edits that were not replayed yet are still applied by render.
+        """
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+
+    def getFootprint(self):
+        """
+        Returns: The bytes held by both edit histories (see ImageHistory.getFootprint)
+
+        The counts of images and patches are those of the proxy.
+        """
+        result = super().getFootprint()
+        full = self._full.getFootprint()
+        for key in ('buffer','file','marker','total','peak'):
+            result[key] += full[key]
+        return result
+
+    def render(self):
+        """
+        Returns: The full-resolution image, once every edit has been applied to it
+
+        This replays any remaining edits in the calling thread (rather than waiting for
+        the background thread).  If an edit failed on the full image, this raises the
+        error of that edit instead, as the full image does not match the proxy.
+        """
+        while self._step():
+            pass
+        with self._lock:
+            while self._busy:
+                self._lock.wait()
+            if self._failure is not None:
+                raise self._failure
+            return self._full.getCurrent()
+
+    def getResult(self):
+        """
+        Returns: The full-resolution result of all of the edits
+        """
+        return self.render()
+
+    # HIDDEN METHODS
+    def _replay(self):
+        """
+        Replays the pending edits on the full image, until the editor is closed
+
+        This is the body of the background thread.
+        """
+        while True:
+            with self._lock:
+                while not self._closed and not self._ready():
+                    self._lock.wait()
+                if self._closed:
+                    return
+            self._step()
+
+    def _ready(self):
+        """
+        Returns: True if the oldest pending edit can be replayed
+
+        An edit can only be replayed once it has been performed on the proxy (or once
+        a later edit has started, which means it was never performed).
+        """
+        return (len(self._pending) > 1 or
+                (len(self._pending) == 1 and self._pending[0][1] is not None))
+
+    def _step(self):
+        """
+        Returns: True if it replayed an edit on the full image; False if none was ready
+        """
+        with self._lock:
+            if self._busy or not self._ready():
+                return False
+            region, name, args = self._pending.pop(0)
+            self._busy = True
+        try:
+            region = self._scale(region)
+            self._full.increment(region)
+            if name is not None:
+                self._full.perform(name,*args,region=region)
+        except Exception as e:
+            with self._lock:
+                if self._failure is None:
+                    self._failure = e
+        finally:
+            with self._lock:
+                self._busy = False
+                self._lock.notify_all()
+        return True
+
+    def _bounds(self, region):
+        """
+        Returns: The full-resolution rectangle (row, col, height, width) of a region
+
+        The rectangle is clipped to the full image, so a square region of the proxy is
+        not square in the full image if it reaches past the edge of it.
+
+        Parameter region: A region of the proxy
+        Precondition: region is a Mask, or a tuple (row, col, height, width)
+        """
+        row, col, height, width = imgmask.bounds(region)
+        image  = self._full.getOriginal()
+        factor = self._factor
+        return (row*factor, col*factor,
+                min(height*factor,image.getHeight()-row*factor),
+                min(width*factor,image.getWidth()-col*factor))
+
+    def _scale(self, region):
+        """
+        Returns: The full-resolution version of a region of the proxy
+
+        Parameter region: A region of the proxy
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+        """
+        if region is None:
+            return None
+        bounds = self._bounds(region)
+        if not isinstance(region, imgmask.Mask):
+            return bounds
+
+        factor = self._factor
+        mask = imgmask.Mask(*bounds)
+        for pos in range(bounds[2]*bounds[3]):
+            r = bounds[0]+pos // bounds[3]
+            c = bounds[1]+pos % bounds[3]
+            mask.setSelected(r,c,region.isSelected(r//factor,c//factor))
+        return mask
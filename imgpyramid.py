@@ -0,0 +1,180 @@
+"""
+Multi-resolution image pyramids for display
+
+An ImagePanel shows its image at no more than the size of the panel.  Uploading the
+full image to the GPU wastes bandwidth on pixels that are never seen, and a large image
+may not fit in a texture at all.  A pyramid keeps reduced copies of the image (levels)
+so that the panel can upload the smallest level that still fills the screen.
+
+Level 0 is the image itself.  Level k keeps every (2**k)-th pixel of every (2**k)-th
+row of the image.  Levels are only made when they are first asked for, and are then
+cached.  When an edit changes a region of the image, only the matching region of each
+cached level is remade (see Pyramid.update).
+"""
+import pixels
+import imgimage
+import imgmask
+
+
+# The largest texture width or height to ask for
+MAX_TEXTURE_SIZE = 4096
+
+
+class Pyramid(object):
+    """
+    A class representing the cached reductions of an image
+
+    IMMUTABLE ATTRIBUTES
+        _width:  The width of the image                        [int > 0]
+        _height: The height of the image                       [int > 0]
+
+    MUTABLE ATTRIBUTES
+        _image:  The image (level 0)                           [Image]
+        _levels: The cached levels, by level number            [dict of int to Image]
+    """
+
+    def getImage(self):
+        """
+        Returns: The image (level 0) of this pyramid
+        """
+        return self._image
+
+    def getDepth(self):
+        """
+        Returns: The number of levels in this pyramid
+
+        The last level is a single pixel wide or high.
+        """
+        return max(self._width,self._height).bit_length()
+
+    def getSize(self, level):
+        """
+        Returns: The size (width, height) of the given level
+
+        Parameter level: The pyramid level
+        Precondition: level is an int, 0 <= level < getDepth()
+        """
+        factor = 1 << level
+        return (-(-self._width//factor), -(-self._height//factor))
+
+    def __init__(self, image):
+        """
+        Initializer: Creates a pyramid for the given image
+
+        No levels are made until they are needed.
+
+        Parameter image: The image at full resolution
+        Precondition: image is an Image object
+        """
+        assert isinstance(image, imgimage.Image), repr(image)+' is not an image'
+        self._image  = image
+        self._width  = image.getWidth()
+        self._height = image.getHeight()
+        self._levels = {}
+
+    def choose(self, width, height, limit=MAX_TEXTURE_SIZE):
+        """
+        Returns: The smallest level that can be displayed at width x height pixels
+
+        This is the highest level that is at least width x height, so that no pixel
+        is magnified on screen.  The level is never larger than limit in either
+        dimension, even if that means magnifying it.
+
+        Parameter width: The display width
+        Precondition: width is a number >= 0
+
+        Parameter height: The display height
+        Precondition: height is a number >= 0
+
+        Parameter limit: The largest texture size
+        Precondition: limit is an int > 0
+        """
+        level = 0
+        while level+1 < self.getDepth():
+            size = self.getSize(level+1)
+            if size[0] < width or size[1] < height:
+                break
+            level += 1
+        while max(self.getSize(level)) > limit and level+1 < self.getDepth():
+            level += 1
+        return level
+
+    def getLevel(self, level):
+        """
+        Returns: The Image for the given level, making it if necessary
+
+        Parameter level: The pyramid level
+        Precondition: level is an int, 0 <= level < getDepth()
+        """
+        assert type(level) == int and 0 <= level < self.getDepth(), repr(level)+' is not a valid level'
+        if level == 0:
+            return self._image
+        if not level in self._levels:
+            width, height = self.getSize(level)
+            self._levels[level] = imgimage.Image(self._reduce(level,0,0,height,width),width)
+        return self._levels[level]
+
+    def update(self, image, region=None):
+        """
+        Returns: The rectangles (row, col, height, width) of each cached level that changed
+
+        The value returned is a dictionary from level to rectangle.  It includes level 0,
+        which is the given region (or the entire image).
+
+        The pyramid is switched to the given image, which must differ from the previous
+        one only in region.  If region is None, or the channels of the image changed 
+        (see Pixels.channels), every cached level is remade.
+
+        Parameter image: The new image at full resolution
+        Precondition: image is an Image object the same size as getImage()
+
+        Parameter region: The changed region of image
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width) in 
+        the image
+        """
+        assert isinstance(image, imgimage.Image), repr(image)+' is not an image'
+        assert image.getWidth() == self._width and image.getHeight() == self._height, repr(image)+' has the wrong size'
+        self._image = image
+        if region is None:
+            region = (0,0,self._height,self._width)
+        row, col, height, width = imgmask.bounds(region)
+
+        changed = {0: (row,col,height,width)}
+        for level in self._levels:
+            if self._levels[level].getChannels() != image.getChannels():
+                size = self.getSize(level)
+                self._levels[level] = imgimage.Image(self._reduce(level,0,0,size[1],size[0]),size[0])
+                changed[level] = (0,0,size[1],size[0])
+                continue
+            factor = 1 << level
+            top    = -(-row//factor)
+            left   = -(-col//factor)
+            bottom = -(-(row+height)//factor)
+            right  = -(-(col+width)//factor)
+            if bottom <= top or right <= left:
+                continue
+            target = self._levels[level]
+            data   = self._reduce(level,top,left,bottom-top,right-left)
+            stride = target.getWidth()
+            buffer = target.getPixels().buffer
+            span   = (right-left)*image.getChannels()
+            for pos in range(bottom-top):
+                start = ((top+pos)*stride+left)*image.getChannels()
+                buffer[start:start+span] = data.buffer[pos*span:(pos+1)*span]
+            changed[level] = (top,left,bottom-top,right-left)
+        return changed
+
+    def _reduce(self, level, row, col, height, width):
+        """
+        Returns: The pixels of a rectangle of the given level, taken from the image
+
+        Parameter level: The pyramid level
+        Precondition: level is an int > 0
+
+        Parameter row, col, height, width: The rectangle of the level
+        Precondition: These are ints describing a rectangle inside of the level
+        """
+        factor = 1 << level
+        offset = (row*self._width+col)*factor
+        view = pixels.PixelView(self._image.getPixels(),offset,height*width,factor,width,factor*self._width)
+        return view.copy()
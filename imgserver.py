@@ -0,0 +1,495 @@
+"""
+An image processing server for the imager application
+
+This module lets other programs apply operation chains (see imgbatch) without starting a
+Python process per image.  The server speaks a small subset of HTTP/1.1, either on a
+local TCP port or on a Unix socket.  It has two requests.
+
+    POST /apply?chain=invert,pixellate:20[&region=r,c,h,w][&format=png|imgr]
+
+applies the chain to the image in the request body, and answers with the result.  The
+body is a PNG (or anything else that PIL can read) or a native file (see imgfile).  The
+result has the format of the body, unless format says otherwise.
+
+    GET /status
+
+answers with a JSON object of the number of requests served, running and waiting.
+
+Connections are kept alive, and may pipeline requests: a client can send several
+requests before reading any answers.  The requests of a connection run at the same
+time, but are answered in order.  The operations themselves run in a pool of worker
+processes, as they are pure Python and would otherwise share one interpreter lock.
+
+The server bounds the work in flight at two levels.  At most concurrency operations run
+at once; the others wait for a slot.  And each connection has at most pipeline requests
+in flight; the server stops reading from a connection that is at its limit, so a client
+that sends too fast is slowed down by TCP (or the Unix socket) itself.  Answers are
+written in chunks, waiting for each to drain, so a slow reader does not make the server
+buffer every result in full.
+"""
+import os
+import json
+import asyncio
+import urllib.parse
+import imgbatch
+
+
+# The most bytes accepted in a request body
+MAX_PAYLOAD = 256*1024*1024
+
+# The size of the pieces an answer is written in
+CHUNK_SIZE = 64*1024
+
+# The most requests in flight on one connection
+PIPELINE_DEPTH = 8
+
+# The reason phrases of the status codes that the server uses
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+# The errors of a worker that mean the request was bad (PIL raises OSError, or at times
+# SyntaxError, for data that it cannot decode); any other error is a fault of the server
+_BAD_REQUEST = (ValueError, AssertionError, OSError, SyntaxError)
+
+# The content types of the two result formats
+_TYPES = {'png': 'image/png', 'imgr': 'application/x-imgr'}
+
+
+class HttpError(Exception):
+    """
+    An error answered with an HTTP status code
+
+    ATTRIBUTES
+        status:  The status code                       [int]
+        message: The explanation sent to the client    [str]
+    """
+
+    def __init__(self, status, message=''):
+        """
+        Initializer: Creates an error with the given status
+
+        Parameter status: The status code
+        Precondition: status is an int in _REASONS
+
+        Parameter message: The explanation sent to the client
+        Precondition: message is a string
+        """
+        super().__init__(message or _REASONS[status])
+        self.status  = status
+        self.message = message or _REASONS[status]
+
+
+def parse_address(text):
+    """
+    Returns: The address for the given text, as (host, port) or a Unix socket path
+
+    An address with a slash in it is a Unix socket path.  Otherwise it is host:port, or
+    just a port for a server on 127.0.0.1.
+
+    Parameter text: The address text
+    Precondition: text is a string
+    """
+    if '/' in text:
+        return text
+    host, _, port = text.rpartition(':')
+    return (host or '127.0.0.1',int(port))
+
+
+def apply_chain(data, chain, region=None, fmt=None):
+    """
+    Returns: The result of applying the chain to the image in data, as file contents
+
+    This is the work done by the worker processes.
+
+    Parameter data: The image file contents (see imgfile.read_bytes)
+    Precondition: data is a bytes object
+
+    Parameter chain: The operations to apply
+    Precondition: chain is a list of (name, args) pairs, as returned by parse_chain
+
+    Parameter region: The region of interest (see Editor.perform)
+    Precondition: region is None or a tuple (row, col, height, width)
+
+    Parameter fmt: The result format, 'png' or 'imgr' (the format of data if None)
+    Precondition: fmt is one of the strings above, or None
+    """
+    import imgfile
+    import imgeditor
+    if fmt is None:
+        fmt = 'imgr' if data[:4] == b'IMGR' else 'png'
+    import imgmemo
+    editor = imgeditor.Editor(imgfile.read_bytes(data))
+    editor.setMemo(imgmemo.get_memo())
+    imgbatch.run_chain(editor,chain,region)
+    return imgfile.write_bytes(editor.getCurrent(),fmt == 'imgr')
+
+
+class ImageServer(object):
+    """
+    A class representing an image processing server
+
+    MUTABLE ATTRIBUTES
+        _served:  The number of requests answered          [int >= 0]
+        _running: The number of operations running          [int >= 0]
+        _waiting: The number of operations waiting for a slot  [int >= 0]
+    """
+
+    def getStatus(self):
+        """
+        Returns: A dictionary of the numbers of requests served, running and waiting
+        """
+        return {'served': self._served, 'running': self._running, 'waiting': self._waiting}
+
+    def __init__(self, workers=None, concurrency=None, pipeline=PIPELINE_DEPTH, processes=True):
+        """
+        Initializer: Creates a server that is not yet listening
+
+        Parameter workers: The number of worker processes (the number of CPUs if None)
+        Precondition: workers is an int > 0 or None
+
+        Parameter concurrency: The most operations run at once (workers if None)
+        Precondition: concurrency is an int > 0 or None
+
+        Parameter pipeline: The most requests in flight on one connection
+        Precondition: pipeline is an int > 0
+
+        Parameter processes: Whether the workers are processes (instead of threads)
+        Precondition: processes is a bool
+        """
+        import concurrent.futures
+        workers = workers or os.cpu_count() or 1
+        assert type(workers) == int and workers > 0, repr(workers)+' is not a valid worker count'
+        assert type(pipeline) == int and pipeline > 0, repr(pipeline)+' is not a valid depth'
+        if processes:
+            self._pool = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self._concurrency = concurrency or workers
+        self._pipeline = pipeline
+        self._slots    = None
+        self._server   = None
+        self._clients  = set()
+        self._served   = 0
+        self._running  = 0
+        self._waiting  = 0
+
+    async def start(self, address):
+        """
+        Starts listening at the given address
+
+        Parameter address: A (host, port) pair or a Unix socket path
+        Precondition: address is a value returned by parse_address
+        """
+        self._slots = asyncio.Semaphore(self._concurrency)
+        if type(address) == str:
+            if os.path.exists(address):
+                os.remove(address)
+            self._server = await asyncio.start_unix_server(self._connect,address)
+        else:
+            self._server = await asyncio.start_server(self._connect,*address)
+
+    def getPort(self):
+        """
+        Returns: The TCP port the server listens on (None for a Unix socket)
+
+        This is how to find the port of a server started on port 0.
+        """
+        name = self._server.sockets[0].getsockname()
+        return name[1] if type(name) == tuple else None
+
+    async def close(self):
+        """
+        Stops listening, drops any open connections, and shuts down the worker pool
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        clients = list(self._clients)
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients,return_exceptions=True)
+        self._pool.shutdown(wait=False)
+
+    # HIDDEN METHODS
+    async def _connect(self, reader, writer):
+        """
+        Serves the requests of a connection until the client closes it
+
+        Parameter reader: The connection input
+        Precondition: reader is an asyncio.StreamReader
+
+        Parameter writer: The connection output
+        Precondition: writer is an asyncio.StreamWriter
+        """
+        # The answers in request order; a full queue stops the reading
+        answers = asyncio.Queue(self._pipeline)
+        sender = asyncio.ensure_future(self._send(answers,writer))
+        client = asyncio.current_task()
+        self._clients.add(client)
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except HttpError as e:
+                    await answers.put(_answered(_error(e)))
+                    break
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if request is None:
+                    break
+                await answers.put(asyncio.ensure_future(self._handle(*request)))
+                if request[3].get('connection','').lower() == 'close':
+                    break
+            await answers.put(None)
+            await sender
+        except asyncio.CancelledError:
+            # Dropped by close; ending the handler normally closes the connection
+            pass
+        finally:
+            sender.cancel()
+            self._clients.discard(client)
+            writer.close()
+
+    async def _send(self, answers, writer):
+        """
+        Writes the answers of a connection in order, as they are ready
+
+        Parameter answers: The answers (futures of (status, type, body)), then None
+        Precondition: answers is an asyncio.Queue
+
+        Parameter writer: The connection output
+        Precondition: writer is an asyncio.StreamWriter
+        """
+        failed = False
+        while True:
+            answer = await answers.get()
+            if answer is None:
+                return
+            status, kind, body = await answer
+            self._served += 1
+            if failed:
+                continue
+            try:
+                head = 'HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n'
+                writer.write(head.format(status,_REASONS[status],kind,len(body)).encode('latin-1'))
+                view = memoryview(body)
+                for pos in range(0,len(body),CHUNK_SIZE):
+                    writer.write(view[pos:pos+CHUNK_SIZE])
+                    await writer.drain()
+                await writer.drain()
+            except ConnectionError:
+                # Keep taking answers, so the reader is never stuck on a full queue
+                failed = True
+
+    async def _handle(self, method, path, query, headers, body):
+        """
+        Returns: The answer (status, type, body) to a request
+
+        Parameter method: The request method
+        Precondition: method is a string
+
+        Parameter path: The request path
+        Precondition: path is a string
+
+        Parameter query: The query parameters
+        Precondition: query is a dictionary of strings to strings
+
+        Parameter headers: The request headers, with lower case names
+        Precondition: headers is a dictionary of strings to strings
+
+        Parameter body: The request body
+        Precondition: body is a bytes object
+        """
+        try:
+            if path == '/status':
+                if method != 'GET':
+                    raise HttpError(405)
+                return (200,'application/json',json.dumps(self.getStatus()).encode('utf-8'))
+            if path != '/apply':
+                raise HttpError(404)
+            if method != 'POST':
+                raise HttpError(405)
+
+            try:
+                chain  = imgbatch.parse_chain(query.get('chain',''))
+                region = imgbatch.parse_region(query['region']) if 'region' in query else None
+            except ValueError as e:
+                raise HttpError(400,str(e))
+            fmt = query.get('format')
+            if fmt is not None and fmt not in _TYPES:
+                raise HttpError(400,repr(fmt)+' is not a result format')
+            if fmt is None:
+                fmt = 'imgr' if body[:4] == b'IMGR' else 'png'
+
+            self._waiting += 1
+            async with self._slots:
+                self._waiting -= 1
+                self._running += 1
+                try:
+                    loop = asyncio.get_event_loop()
+                    result = await loop.run_in_executor(self._pool,apply_chain,body,chain,region,fmt)
+                except _BAD_REQUEST as e:
+                    raise HttpError(400,'could not process the image: '+str(e))
+                except Exception as e:
+                    raise HttpError(500,'the server failed: '+type(e).__name__+': '+str(e))
+                finally:
+                    self._running -= 1
+            return (200,_TYPES[fmt],result)
+        except HttpError as e:
+            return _error(e)
+
+
+def _error(error):
+    """
+    Returns: The answer (status, type, body) for an error
+
+    Parameter error: The error
+    Precondition: error is an HttpError
+    """
+    return (error.status,'text/plain',(error.message+'\n').encode('utf-8'))
+
+
+def _answered(answer):
+    """
+    Returns: A future that already has the given answer
+
+    Parameter answer: The answer (status, type, body)
+    Precondition: answer is a tuple
+    """
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(answer)
+    return future
+
+
+async def _read_line(reader):
+    """
+    Returns: The next line of a request, with its line ending (or b'' at the end)
+
+    Parameter reader: The connection input
+    Precondition: reader is an asyncio.StreamReader
+    """
+    try:
+        return await reader.readline()
+    except ValueError:
+        raise HttpError(400,'line too long')
+
+
+async def _read_request(reader):
+    """
+    Returns: The next request (method, path, query, headers, body), or None at the end
+
+    Parameter reader: The connection input
+    Precondition: reader is an asyncio.StreamReader
+    """
+    line = await _read_line(reader)
+    while line in (b'\r\n',b'\n'):
+        line = await _read_line(reader)
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400,'malformed request line')
+
+    headers = {}
+    while True:
+        line = await _read_line(reader)
+        if line in (b'\r\n',b'\n',b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'transfer-encoding' in headers:
+        raise HttpError(411)
+    try:
+        length = int(headers.get('content-length',0))
+    except ValueError:
+        raise HttpError(400,'malformed content length')
+    if length < 0:
+        raise HttpError(400,'malformed content length')
+    if length > MAX_PAYLOAD:
+        raise HttpError(413)
+    body = await reader.readexactly(length) if length else b''
+
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    return (method.upper(),url.path,query,headers,body)
+
+
+async def request(address, jobs):
+    """
+    Returns: The answers to a list of jobs, sent pipelined on one connection
+
+    Each job is a tuple (data, chain) or (data, chain, params), where data is an image
+    file contents, chain is an operation chain string, and params is a dictionary of
+    other query parameters (region or format).  Each answer is a pair (status, body).
+    This is a client for tests and load tests.
+
+    Parameter address: The server address
+    Precondition: address is a value returned by parse_address
+
+    Parameter jobs: The jobs to send
+    Precondition: jobs is a list of tuples as above
+    """
+    if type(address) == str:
+        reader, writer = await asyncio.open_unix_connection(address)
+    else:
+        reader, writer = await asyncio.open_connection(*address)
+
+    async def send():
+        for job in jobs:
+            params = dict(job[2]) if len(job) > 2 else {}
+            params['chain'] = job[1]
+            head = 'POST /apply?{} HTTP/1.1\r\nHost: imager\r\nContent-Length: {}\r\n\r\n'
+            writer.write(head.format(urllib.parse.urlencode(params),len(job[0])).encode('latin-1'))
+            writer.write(job[0])
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    answers = []
+    try:
+        for _ in jobs:
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n',b'\n',b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            answers.append((status,await reader.readexactly(length)))
+        await sender
+    finally:
+        writer.close()
+    return answers
+
+
+def serve(address, workers=None, concurrency=None):
+    """
+    Runs a server at the given address until interrupted
+
+    Parameter address: The address text (see parse_address)
+    Precondition: address is a string
+
+    Parameter workers: The number of worker processes (the number of CPUs if None)
+    Precondition: workers is an int > 0 or None
+
+    Parameter concurrency: The most operations run at once (workers if None)
+    Precondition: concurrency is an int > 0 or None
+    """
+    address = parse_address(address)
+    server = ImageServer(workers,concurrency)
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(server.start(address))
+        where = address if type(address) == str else 'http://{}:{}'.format(address[0],server.getPort())
+        print('Serving on '+where)
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+        loop.close()
+        if type(address) == str and os.path.exists(address):
+            os.remove(address)
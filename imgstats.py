@@ -0,0 +1,320 @@
+"""
+Instrumentation for Editor operations
+
+An Editor with a Recorder (see Editor.setRecorder) measures every operation that it
+runs through perform.  Each measurement is a record, which is a dictionary with the keys
+
+    name:      The operation name
+    args:      The operation arguments (as a list)
+    region:    The region (row, col, height, width) of the operation, or None
+    wall:      The elapsed time of the operation, in seconds
+    cpu:       The CPU time of the operation (in the thread that ran it), in seconds
+    written:   The number of pixels that the operation changed
+    reads:     The number of pixel reads through the Image accessors (or None)
+    writes:    The number of pixel writes through the Image accessors (or None)
+    allocated: The peak bytes allocated during the operation (or None)
+    copy:      The time spent saving the edit history for the operation, in seconds
+    upload:    The time spent uploading the result to the GPU, in seconds (or None)
+
+Counting reads and writes and tracing allocations both slow down the operation being
+measured, so they are off unless asked for.  Reads and writes are only counted through
+the pixel accessors of Image (getPixel, setFlatPixel and the like, checked or not), and
+not through bulk access (such as rows or getRegion).  So an operation run by a kernel
+(see imgkernels) counts none.
+
+Records can be queried with getRecords and summary, and saved as JSON lines (one record
+per line).
+
+This module also formats the memory footprint of an edit history (see
+ImageHistory.getFootprint) for the GUI and the headless tools.
+"""
+import json
+import time
+import threading
+import contextlib
+
+
+class Recorder(object):
+    """
+    A class to collect the measurements of Editor operations
+
+    MUTABLE ATTRIBUTES
+        _records: The measurements so far, oldest first        [list of dict]
+        _copy:    The history time not yet given to a record   [float >= 0]
+    """
+
+    # The Image accessors that are counted
+    READERS = ('getPixel','getPixelUnchecked','getFlatPixel')
+    WRITERS = ('setPixel','setPixelUnchecked','setFlatPixel')
+
+    def getRecords(self):
+        """
+        Returns: A copy of the list of records, oldest first
+        """
+        with self._lock:
+            return list(self._records)
+
+    def getLast(self):
+        """
+        Returns: The most recent record, or None if there are none
+        """
+        with self._lock:
+            return self._records[-1] if self._records else None
+
+    def __init__(self, count_pixels=False, trace_memory=False, file=None):
+        """
+        Initializer: Creates a recorder with no records
+
+        Parameter count_pixels: Whether to count reads and writes through the Image
+        accessors
+        Precondition: count_pixels is a bool
+
+        Parameter trace_memory: Whether to trace allocations (with tracemalloc)
+        Precondition: trace_memory is a bool
+
+        Parameter file: A file to append each record to (as a JSON line), or None
+        Precondition: file is a string or None
+        """
+        self._count   = count_pixels
+        self._trace   = trace_memory
+        self._file    = file
+        self._records = []
+        self._copy    = 0.0
+        self._lock    = threading.Lock()
+
+    def clear(self):
+        """
+        Deletes all of the records
+        """
+        with self._lock:
+            self._records = []
+            self._copy = 0.0
+
+    # MEASUREMENT
+    def begin(self, name, args, region, image):
+        """
+        Returns: A new record for an operation that is about to run on image
+
+        This starts the clocks (and counters) for the record.  Call end when the
+        operation is done, in the same thread.
+
+        Parameter name: The operation name
+        Precondition: name is a string
+
+        Parameter args: The operation arguments
+        Precondition: args is a tuple
+
+        Parameter region: The region of the operation
+        Precondition: region is None, a Mask, or a tuple (row, col, height, width)
+
+        Parameter image: The image the operation will modify
+        Precondition: image is an Image object
+        """
+        import imgmask
+        record = {'name': name, 'args': list(args),
+                  'region': None if region is None else list(imgmask.bounds(region)),
+                  'wall': 0.0, 'cpu': 0.0, 'written': 0, 'reads': None, 'writes': None,
+                  'allocated': None, 'copy': 0.0, 'upload': None}
+        with self._lock:
+            record['copy'] = self._copy
+            self._copy = 0.0
+
+        pixels = image.getPixels()
+        record['written'] = -round(pixels.progress()*len(pixels)) if len(pixels) else 0
+        if self._count:
+            record['reads'] = record['writes'] = 0
+            self._attach(image,record)
+        if self._trace:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                record['_stop'] = True
+            tracemalloc.reset_peak()
+            record['_base'] = tracemalloc.get_traced_memory()[0]
+        record['_wall'] = time.perf_counter()
+        record['_cpu']  = time.thread_time()
+        return record
+
+    def end(self, record, image):
+        """
+        Stops the clocks for a record made by begin, and adds it to the records
+
+        Parameter record: The record of the operation
+        Precondition: record was returned by begin for image
+
+        Parameter image: The image the operation modified
+        Precondition: image is an Image object
+        """
+        record['cpu']  = time.thread_time()-record.pop('_cpu')
+        record['wall'] = time.perf_counter()-record.pop('_wall')
+        if '_base' in record:
+            import tracemalloc
+            record['allocated'] = max(0,tracemalloc.get_traced_memory()[1]-record.pop('_base'))
+            if record.pop('_stop',False):
+                tracemalloc.stop()
+        if self._count:
+            self._detach(image)
+        pixels = image.getPixels()
+        if len(pixels):
+            record['written'] += round(pixels.progress()*len(pixels))
+
+        with self._lock:
+            self._records.append(record)
+        if self._file is not None:
+            with open(self._file,'a') as file:
+                file.write(json.dumps(record)+'\n')
+
+    @contextlib.contextmanager
+    def copying(self):
+        """
+        Returns: A context manager that times a history increment
+
+        The time is added to the record of the next operation.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._copy += time.perf_counter()-start
+
+    def addUpload(self, seconds):
+        """
+        Adds a texture upload time to the most recent record
+
+        Parameter seconds: The upload time
+        Precondition: seconds is a number >= 0
+        """
+        with self._lock:
+            if self._records:
+                record = self._records[-1]
+                record['upload'] = (record['upload'] or 0.0)+seconds
+
+    # REPORTS
+    def summary(self):
+        """
+        Returns: The totals of the records for each operation name
+
+        The value returned is a dictionary from operation name to a dictionary with the
+        number of records ('count'), and the totals of wall, cpu, written and copy.
+        """
+        result = {}
+        for record in self.getRecords():
+            total = result.setdefault(record['name'],{'count':0,'wall':0.0,'cpu':0.0,'written':0,'copy':0.0})
+            total['count'] += 1
+            for key in ('wall','cpu','written','copy'):
+                total[key] += record[key]
+        return result
+
+    def status(self):
+        """
+        Returns: A one line description of the most recent record (or '' if none)
+        """
+        record = self.getLast()
+        if record is None:
+            return ''
+        text = '{}: {:.1f} ms (cpu {:.1f} ms), {} px changed, history {:.1f} ms'.format(
+            record['name'],record['wall']*1000,record['cpu']*1000,record['written'],record['copy']*1000)
+        if record['reads'] is not None:
+            text += ', {} reads, {} writes'.format(record['reads'],record['writes'])
+        if record['allocated'] is not None:
+            text += ', {:.1f} MB allocated'.format(record['allocated']/(1024*1024))
+        if record['upload'] is not None:
+            text += ', upload {:.1f} ms'.format(record['upload']*1000)
+        return text
+
+    def export(self, file):
+        """
+        Writes all of the records to the given file, as JSON lines
+
+        Parameter file: The output file
+        Precondition: file is a string
+        """
+        with open(file,'w') as handle:
+            for record in self.getRecords():
+                handle.write(json.dumps(record)+'\n')
+
+    # HIDDEN METHODS
+    def _attach(self, image, record):
+        """
+        Replaces the accessors of image (and only image) with counting versions
+
+        Parameter image: The image to count accesses to
+        Precondition: image is an Image object
+
+        Parameter record: The record for the counts
+        Precondition: record is a record made by begin
+        """
+        def counted(method, key):
+            def wrapper(*args):
+                record[key] += 1
+                return method(*args)
+            return wrapper
+
+        for name in self.READERS:
+            setattr(image,name,counted(getattr(image,name),'reads'))
+        for name in self.WRITERS:
+            setattr(image,name,counted(getattr(image,name),'writes'))
+
+    def _detach(self, image):
+        """
+        Restores the accessors of image replaced by _attach
+
+        Parameter image: The image to restore
+        Precondition: image is an Image object passed to _attach
+        """
+        for name in self.READERS+self.WRITERS:
+            image.__dict__.pop(name,None)
+
+
+def format_bytes(nbytes):
+    """
+    Returns: A short human readable string for a number of bytes, like '12.3 MB'
+
+    Parameter nbytes: The number of bytes
+    Precondition: nbytes is an int >= 0
+    """
+    for unit in ('B','KB','MB','GB'):
+        if nbytes < 1024 or unit == 'GB':
+            return ('{:.0f} {}' if unit == 'B' else '{:.1f} {}').format(nbytes,unit)
+        nbytes /= 1024
+
+
+def memory_summary(footprint):
+    """
+    Returns: A one line description of the footprint of an edit history
+
+    Parameter footprint: The footprint
+    Precondition: footprint is a dictionary returned by ImageHistory.getFootprint
+    """
+    return 'history {} (peak {}), {} images + {} patches'.format(
+        format_bytes(footprint['total']),format_bytes(footprint['peak']),
+        footprint['images'],footprint['patches'])
+
+
+def memory_report(footprint):
+    """
+    Returns: A multi-line report of the footprint of an edit history
+
+    The report also has the peak resident memory of this process, if the operating
+    system provides it.
+
+    Parameter footprint: The footprint
+    Precondition: footprint is a dictionary returned by ImageHistory.getFootprint
+    """
+    lines = ['images:          {}'.format(footprint['images']),
+             'patches:         {}'.format(footprint['patches']),
+             'pixel buffers:   {}'.format(format_bytes(footprint['buffer'])),
+             'file backed:     {}'.format(format_bytes(footprint['file'])),
+             'change markers:  {}'.format(format_bytes(footprint['marker'])),
+             'history total:   {}'.format(format_bytes(footprint['total'])),
+             'history peak:    {}'.format(format_bytes(footprint['peak']))]
+    try:
+        import sys
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS reports bytes
+        lines.append('process peak:    {}'.format(format_bytes(peak if sys.platform == 'darwin' else peak*1024)))
+    except ImportError:
+        pass
+    return '\n'.join(lines)
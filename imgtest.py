@@ -245,6 +245,227 @@ def test_image_other():
         exit()
 
 
+def test_image_views():
+    """
+    Tests the view methods getRow, getColumn and getRegion in class Image
+    """
+    print('Testing image views')
+    import a6image
+    p =  pixels.Pixels(6)
+    
+    p[0] = (255,  64,   0)
+    p[1] = (  0, 255,  64)
+    p[2] = ( 64,   0, 255)
+    p[3] = ( 64, 255, 128)
+    p[4] = (128,  64, 255)
+    p[5] = (255, 128,  64)
+    q = p[:]  # Need to copy this
+    
+    image = a6image.Image(p,2)
+    row = image.getRow(1)
+    cornell.assert_equals(2,len(row))
+    cornell.assert_equals(q[2],row[0])
+    cornell.assert_equals(q[3],row[1])
+    
+    col = image.getColumn(1)
+    cornell.assert_equals(3,len(col))
+    cornell.assert_equals(q[1],col[0])
+    cornell.assert_equals(q[5],col[2])
+    
+    region = image.getRegion(1,1,2,1)
+    cornell.assert_equals(1,region.getWidth())
+    cornell.assert_equals(2,region.getHeight())
+    cornell.assert_equals(q[3],region.getPixel(0,0))
+    cornell.assert_equals(q[5],region.getPixel(1,0))
+    
+    # Views write through, but copies do not
+    col[2] = (1,2,3)
+    cornell.assert_equals((1,2,3),image.getPixel(2,1))
+    cornell.assert_equals((1,2,3),region.getPixel(1,0))
+    copy = region.copy()
+    copy.setPixel(1,0,(4,5,6))
+    cornell.assert_equals((1,2,3),image.getPixel(2,1))
+    
+    # Test enforcement
+    good = test_assert(image.getRow, [3], 'You are not enforcing the precondition on row value')
+    good = good and test_assert(image.getColumn, [2], 'You are not enforcing the precondition on column value')
+    good = good and test_assert(image.getRegion, [1, 1, 3, 1], 'You are not enforcing the precondition on height')
+    if not good:
+        exit()
+
+
+def test_image_channels():
+    """
+    Tests grey (1 channel) and RGBA (4 channel) pixel storage in class Image
+    """
+    print('Testing image channels')
+    import a6image
+    import imgfile
+    import imgeditor
+    p =  pixels.Pixels(6)
+    for pos in range(6):
+        p[pos] = (pos*40,pos*40,pos*40)
+    
+    image = a6image.Image(p,2)
+    cornell.assert_equals(3,image.getChannels())
+    cornell.assert_true(p.compact())
+    cornell.assert_equals(1,image.getChannels())
+    cornell.assert_equals(6,len(p.buffer))
+    cornell.assert_equals((80,80,80),image.getPixel(1,0))
+    cornell.assert_equals('[[(0, 0, 0), (40, 40, 40)],  [(80, 80, 80), (120, 120, 120)],  '+
+                          '[(160, 160, 160), (200, 200, 200)]]',str(image))
+    
+    # Views and native files keep the channels
+    region = image.getRegion(1,0,2,2)
+    cornell.assert_equals(1,region.getChannels())
+    cornell.assert_equals((200,200,200),region.getPixel(1,1))
+    data = imgfile.write_bytes(image,True)
+    cornell.assert_equals(1,imgfile.read_bytes(data).getChannels())
+    
+    # Writing a color converts back to 3 channels, even through a view
+    region.setPixel(0,0,(1,2,3))
+    cornell.assert_equals(3,image.getChannels())
+    cornell.assert_equals((1,2,3),image.getPixel(1,0))
+    cornell.assert_equals((120,120,120),region.getPixel(0,1))
+    cornell.assert_true(not p.compact())
+    
+    # Greyscale leaves an edit with 1 channel
+    editor = imgeditor.Editor(image)
+    editor.increment()
+    editor.monochromify(False)
+    cornell.assert_equals(1,editor.getCurrent().getChannels())
+    cornell.assert_equals(3,editor.getOriginal().getChannels())
+    editor.undo()
+    cornell.assert_equals((1,2,3),editor.getCurrent().getPixel(1,0))
+    
+    # Pixels with alpha keep it when RGB pixels are written
+    q = pixels.Pixels(2,4)
+    cornell.assert_equals(bytes([0,0,0,255]*2),bytes(q.buffer))
+    q[0] = (1,2,3,4)
+    q[1] = (5,6,7)
+    cornell.assert_equals((1,2,3),q[0])
+    cornell.assert_equals(bytes([1,2,3,4,5,6,7,255]),bytes(q.buffer))
+    cornell.assert_equals(bytes([1,2,3,5,6,7]),bytes(q.convert(3).buffer))
+
+
+def test_image_unchecked():
+    """
+    Tests the unchecked pixel accessors, and the operations that use them
+    """
+    print('Testing unchecked pixel access')
+    import a6image
+    import imgeditor
+    p = pixels.Pixels(6)
+    for pos in range(6):
+        p[pos] = (pos,2*pos,3*pos)
+    
+    image = a6image.Image(p,2)
+    for n in range(6):
+        cornell.assert_equals(image.getPixel(n // 2, n % 2),image.getPixelUnchecked(n // 2, n % 2))
+    image.setPixelUnchecked(2,1,(9,9,9))
+    cornell.assert_equals((9,9,9),image.getPixel(2,1))
+    
+    # The position is not checked, but the pixel is
+    cornell.assert_equals(image.getPixel(1,0),image.getPixelUnchecked(0,2))
+    try:
+        image.setPixelUnchecked(0,0,(256,0,0))
+        cornell.assert_true(False)
+    except ValueError:
+        pass
+    
+    # Operations check their arguments once, and still give the same results
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(16),4))
+    editor.increment()
+    cornell.assert_true(test_assert(editor.encode,['\u2603'],'encode does not assert'))
+    cornell.assert_true(editor.encode('ok'))
+    cornell.assert_equals('ok',editor.decode())
+    editor.getCurrent().setFlatPixel(10,(0,5,7))
+    cornell.assert_equals(None,editor.decode())
+    cornell.assert_equals(None,imgeditor.Editor(a6image.Image(pixels.Pixels(4),2)).decode())
+
+
+def test_image_iteration():
+    """
+    Tests the bulk iteration of pixel lists, views and tiled pixels
+    """
+    print('Testing pixel iteration')
+    import a6image
+    import imgtiles
+    p = pixels.Pixels(6*5)
+    for pos in range(len(p)):
+        p[pos] = (pos,2*pos,255-pos)
+    flat = [p[pos] for pos in range(len(p))]
+    cornell.assert_equals(flat,list(p))
+    
+    # Chunks have the given size, except (possibly) the last one
+    chunks = list(p.chunks(8))
+    cornell.assert_equals([8,8,8,6],[len(chunk) for chunk in chunks])
+    cornell.assert_equals(flat,[pixel for chunk in chunks for pixel in chunk])
+    cornell.assert_equals([30],[len(chunk) for chunk in p.chunks(30)])
+    cornell.assert_true(test_assert(lambda size: next(p.chunks(size)),[0],'chunks does not assert'))
+    
+    # Rows of views are the same, whether or not they are contiguous in the parent
+    image = a6image.Image(p,6)
+    region = image.getRegion(1,2,3,2)
+    rows = [bytes(row) for row in region.rows()]
+    cornell.assert_equals(3,len(rows))
+    cornell.assert_equals(bytes([8,16,247,9,18,246]),rows[0])
+    cornell.assert_equals([region.getPixel(2,1)],list(pixels._unpack(rows[2][3:],3)))
+    column = image.getColumn(4)
+    rows = [bytes(row) for row in column.rows(1)]
+    cornell.assert_equals([bytes(p[4+6*row]) for row in range(5)],rows)
+    cornell.assert_equals([p[4+6*row] for row in range(5)],list(column))
+    
+    # Tiled pixels iterate like flat ones, at the layout width or any other
+    tp = imgtiles.TiledPixels.fromPixels(p,6,tile=4)
+    cornell.assert_equals(flat,list(tp))
+    cornell.assert_equals([bytes(row) for row in p.rows(6)],[bytes(row) for row in tp.rows(6)])
+    cornell.assert_equals([bytes(row) for row in p.rows(10)],[bytes(row) for row in tp.rows(10)])
+    cornell.assert_equals([len(chunk) for chunk in chunks],[len(chunk) for chunk in tp.chunks(8)])
+
+
+def test_image_tiled():
+    """
+    Tests the tiled pixel storage
+    """
+    print('Testing tiled pixels')
+    import imgtiles
+    p = pixels.Pixels(30*30)
+    for pos in range(len(p)):
+        p[pos] = (7,7,7)
+    tp = imgtiles.TiledPixels.fromPixels(p,30,tile=8,cache=imgtiles.TileCache(8*8*3*2))
+    
+    # Integer positions are checked (and normalized) like Pixels
+    cornell.assert_equals(p[-1],tp[-1])
+    tp[-1] = (1,2,3)
+    cornell.assert_equals((1,2,3),tp[len(tp)-1])
+    for index in (len(tp),len(tp)+5,-len(tp)-1):
+        try:
+            tp[index]
+            cornell.assert_true(False)
+        except IndexError:
+            pass
+        try:
+            tp[index] = (0,0,0)
+            cornell.assert_true(False)
+        except IndexError:
+            pass
+    
+    # Spilled tiles reuse their space in the scratch file
+    import os
+    cache = imgtiles.TileCache(8*8*3*2,spill=True)
+    tp = imgtiles.TiledPixels.fromPixels(p,30,tile=8,cache=cache)
+    for step in range(20):
+        for pos in range(0,len(tp),7):
+            tp[pos] = (step,pos % 256,step*3)
+        cache.flush(tp)
+    live = sum(slot[1] for slot in tp._cold.values())
+    cornell.assert_true(os.fstat(tp._disk.fileno()).st_size <= 2*live+8*8*3)
+    cornell.assert_equals((19,0,57),tp[0])
+    cornell.assert_equals((19,7,57),tp[7])
+    cornell.assert_equals((7,7,7),tp[1])
+
+
 def test_hist_init():
     """
     Tests the __init__ method and getters in ImageHistory
@@ -345,6 +566,775 @@ def test_hist_edit():
     cornell.assert_not_equals(id(bottom), id(hist._history[0]))
 
 
+def test_hist_region():
+    """
+    Tests region edits (increment with a region, then undo) in ImageHistory
+    """
+    print('Testing history region edits')
+    import a6image
+    import a6history
+    p =  pixels.Pixels(6)
+    
+    p[0] = (255,0,0)
+    p[1] = (0,255,0)
+    p[2] = (0,0,255)
+    p[3] = (0,255,255)
+    p[4] = (255,0,255)
+    p[5] = (255,255,0)
+    
+    image = a6image.Image(p,2)
+    hist  = a6history.ImageHistory(image)
+    bottom = hist.getCurrent()
+    
+    hist.increment((1,0,2,1))
+    cornell.assert_equals(id(bottom),id(hist.getCurrent()))
+    cornell.assert_equals(1,len(hist._history))
+    bottom.setPixel(1,0,(64,128,192))
+    bottom.setPixel(2,0,(64,128,192))
+    
+    cornell.assert_true(hist.undo())
+    cornell.assert_equals(id(bottom),id(hist.getCurrent()))
+    for pos in range(bottom.getLength()):
+        cornell.assert_equals(p[pos],bottom.getFlatPixel(pos))
+    cornell.assert_true(not hist.undo())
+    
+    for step in range(hist.MAX_HISTORY+1):
+        hist.increment((0,0,1,1))
+    cornell.assert_equals(hist.MAX_HISTORY-1,len(hist._patches[0]))
+
+
+def test_hist_memory():
+    """
+    Tests the memory accounting of class ImageHistory
+    """
+    print('Testing history memory accounting')
+    import a6image
+    import a6history
+    p = pixels.Pixels(6)
+    image = a6image.Image(p,3)
+    
+    history = a6history.ImageHistory(image)
+    footprint = history.getFootprint()
+    # The original and one copy sharing its 3 bytes per pixel, plus two 1 byte markers
+    cornell.assert_equals(18,footprint['buffer'])
+    cornell.assert_equals(12,footprint['marker'])
+    cornell.assert_equals(30,footprint['total'])
+    
+    history.increment()
+    history.increment((0,0,1,2))
+    footprint = history.getFootprint()
+    cornell.assert_equals(2,footprint['images'])
+    cornell.assert_equals(1,footprint['patches'])
+    cornell.assert_equals(30+24+8,footprint['total'])
+    
+    history.clear()
+    footprint = history.getFootprint()
+    cornell.assert_equals(30,footprint['total'])
+    cornell.assert_equals(62,footprint['peak'])
+    
+    # The first write gives the copy its own pixels
+    history.getCurrent().setPixel(0,0,(1,2,3))
+    cornell.assert_equals((0,0,0),image.getPixel(0,0))
+    cornell.assert_equals(48,history.getFootprint()['total'])
+    
+    # Rows are read-only, so they cannot write through shared pixels
+    row = next(a6history.ImageHistory(image).getCurrent().rows())
+    cornell.assert_true(row.readonly)
+    try:
+        row[0] = 7
+    except TypeError:
+        pass
+    cornell.assert_equals((0,0,0),image.getPixel(0,0))
+
+    # A full history reuses the pixels of the image that it drops
+    for step in range(history.MAX_HISTORY-1):
+        history.increment()
+    data = history._history[0].getPixels()
+    history.increment()
+    cornell.assert_equals(id(data),id(history.getCurrent().getPixels()))
+    cornell.assert_equals((1,2,3),history.getCurrent().getPixel(0,0))
+    cornell.assert_equals(0.0,data.progress())
+
+
+def test_hist_redo():
+    """
+    Tests redo (after undo, of images and patches) in ImageHistory
+    """
+    print('Testing history redo')
+    import a6image
+    import a6history
+    p =  pixels.Pixels(6)
+    
+    p[0] = (255,0,0)
+    p[1] = (0,255,0)
+    p[2] = (0,0,255)
+    p[3] = (0,255,255)
+    p[4] = (255,0,255)
+    p[5] = (255,255,0)
+    
+    image = a6image.Image(p,2)
+    hist  = a6history.ImageHistory(image)
+    cornell.assert_true(not hist.redo())
+    
+    hist.increment()
+    edited = hist.getCurrent()
+    edited.setPixel(0,0,(1,2,3))
+    hist.increment((2,1,1,1))
+    edited.setPixel(2,1,(4,5,6))
+    
+    cornell.assert_true(hist.undo())
+    cornell.assert_equals((255,255,0),edited.getPixel(2,1))
+    cornell.assert_true(hist.undo())
+    cornell.assert_equals((255,0,0),hist.getCurrent().getPixel(0,0))
+    cornell.assert_equals(2,hist.getFootprint()['redo'])
+    
+    # Redo puts back the same image, and then the patch
+    cornell.assert_true(hist.redo())
+    cornell.assert_equals(id(edited),id(hist.getCurrent()))
+    cornell.assert_equals((255,255,0),edited.getPixel(2,1))
+    cornell.assert_true(hist.redo())
+    cornell.assert_equals((4,5,6),edited.getPixel(2,1))
+    cornell.assert_true(not hist.redo())
+    cornell.assert_true(hist.undo())
+    cornell.assert_equals((255,255,0),edited.getPixel(2,1))
+    
+    # A new edit drops the undone edits
+    hist.increment()
+    cornell.assert_true(not hist.redo())
+    
+    # Undone edits over the budget are dropped first undone first
+    hist.REDO_BUDGET = 18
+    hist.increment()
+    cornell.assert_true(hist.undo())
+    cornell.assert_true(hist.undo())
+    cornell.assert_equals(1,hist.getFootprint()['redo'])
+    cornell.assert_true(hist.redo())
+    cornell.assert_true(not hist.redo())
+    
+    import imgproxy
+    hist = imgproxy.ProxyEditor(image,2)
+    hist.increment()
+    hist.perform('invert')
+    cornell.assert_true(hist.undo())
+    cornell.assert_true(hist.redo())
+    full = hist.render()
+    cornell.assert_equals((0,255,255),full.getPixel(0,0))
+    cornell.assert_true(hist.undo())
+    cornell.assert_true(hist.redo())
+    cornell.assert_equals((0,255,255),hist.render().getPixel(0,0))
+    
+    # An edit that fails at full resolution is reported, not dropped
+    def fail(*args, region=None):
+        raise ValueError('failed at full resolution')
+    hist.getFull().perform = fail
+    hist.increment()
+    hist.perform('invert')
+    try:
+        hist.render()
+        cornell.assert_true(False)
+    except ValueError:
+        pass
+    hist.clear()
+    cornell.assert_equals(image.getPixel(0,0),hist.render().getPixel(0,0))
+    
+    # Closing stops the replay thread, but render still applies the edits
+    del hist.getFull().perform
+    hist.increment()
+    hist.perform('invert')
+    hist.close()
+    hist._worker.join(5)
+    cornell.assert_true(not hist._worker.is_alive())
+    cornell.assert_equals((0,255,255),hist.render().getPixel(0,0))
+
+
+def test_proxy():
+    """
+    Tests the proxy editor and its scaling of images, regions and arguments
+    """
+    print('Testing proxy editor')
+    import a6image
+    import imgmask
+    import imgproxy
+    p = pixels.Pixels(10*12)
+    for pos in range(len(p)):
+        p[pos] = (pos % 12,pos // 12,0)
+    image = a6image.Image(p,12)
+    
+    # The proxy keeps every factor-th pixel of every factor-th row
+    small = imgproxy.downscale(image,3)
+    cornell.assert_equals(4,small.getWidth())
+    cornell.assert_equals(4,small.getHeight())
+    cornell.assert_equals((9,6,0),small.getPixel(2,3))
+    cornell.assert_equals(3,imgproxy.factor_for(image,4,5))
+    
+    # Regions are scaled up, and clipped to the full image
+    hist = imgproxy.ProxyEditor(image,3)
+    cornell.assert_equals((3,6,6,6),hist._scale((1,2,2,2)))
+    cornell.assert_equals((9,9,1,3),hist._scale((3,3,1,1)))
+    mask = imgmask.Mask(0,0,2,2)
+    mask.setSelected(0,0,False)
+    scaled = hist._scale(mask)
+    cornell.assert_true(scaled.isSelected(2,5) and not scaled.isSelected(2,2))
+    
+    # A reshaping operation needs a region that is square in the full image
+    hist.increment((3,3,1,1))
+    cornell.assert_true(test_assert(lambda: hist.perform('transpose',region=(3,3,1,1)),[],
+                                    'transpose does not assert'))
+    hist.undo()
+    
+    # Arguments in pixels are scaled for the preview, but not for the full image
+    hist.increment()
+    hist.perform('pixellate',6)
+    full = imgproxy.imgeditor.Editor(image)
+    full.pixellate(6)
+    cornell.assert_equals(list(full.getCurrent().getPixels()),list(hist.render().getPixels()))
+    small = imgproxy.imgeditor.Editor(imgproxy.downscale(image,3))
+    small.pixellate(2)
+    cornell.assert_equals(list(small.getCurrent().getPixels()),list(hist.getCurrent().getPixels()))
+    
+    # The overlays are scaled the same way
+    hist.increment()
+    hist.perform('frame',3)
+    small.frame(1)
+    cornell.assert_equals(list(small.getCurrent().getPixels()),list(hist.getCurrent().getPixels()))
+    hist.close()
+
+
+def test_native_file():
+    """
+    Tests saving and loading an image in the native file format
+    """
+    print('Testing native file format')
+    import os
+    import tempfile
+    import a6image
+    import imgfile
+    p =  pixels.Pixels(6)
+    
+    p[0] = (255,0,0)
+    p[1] = (0,255,0)
+    p[2] = (0,0,255)
+    p[3] = (0,255,255)
+    p[4] = (255,0,255)
+    p[5] = (255,255,0)
+    
+    image  = a6image.Image(p,2)
+    handle, file = tempfile.mkstemp(suffix=imgfile.NATIVE_EXT)
+    os.close(handle)
+    try:
+        imgfile.write_image(image,file)
+        cornell.assert_true(imgfile.is_native(file))
+        
+        loaded = imgfile.read_image(file)
+        cornell.assert_equals(image.getWidth(),loaded.getWidth())
+        cornell.assert_equals(image.getHeight(),loaded.getHeight())
+        for pos in range(image.getLength()):
+            cornell.assert_equals(image.getFlatPixel(pos),loaded.getFlatPixel(pos))
+        
+        # Edits must not write through to the file
+        loaded.setPixel(0,0,(64,128,192))
+        cornell.assert_equals((255,0,0),imgfile.read_image(file).getPixel(0,0))
+        
+        # Copies must not share the mapped buffer
+        copy = loaded.copy()
+        copy.setPixel(0,1,(64,128,192))
+        cornell.assert_equals((0,255,0),loaded.getPixel(0,1))
+    finally:
+        os.remove(file)
+
+
+def test_decode_cache():
+    """
+    Tests the on-disk cache of decoded images
+    """
+    print('Testing decoded image cache')
+    import os
+    import shutil
+    import tempfile
+    import a6image
+    import imgfile
+    import imgcache
+    p = pixels.Pixels(6)
+    p[0] = (255,0,0)
+    p[5] = (0,0,255)
+    image = a6image.Image(p,3)
+    
+    folder = tempfile.mkdtemp()
+    try:
+        cache = imgcache.DecodeCache(os.path.join(folder,'cache'),1024)
+        file = os.path.join(folder,'first.png')
+        imgfile.encode_png(image,file)
+        cornell.assert_equals(None,cache.lookup(file))
+        
+        loaded = cache.fetch(file)
+        cornell.assert_equals((255,0,0),loaded.getPixel(0,0))
+        cached = cache.lookup(file)
+        cornell.assert_equals(3,cached.getWidth())
+        cornell.assert_equals((0,0,255),cached.getPixel(1,2))
+        cornell.assert_equals(16+18,cache.getUsed())
+        
+        # A changed file has a new entry
+        image.setPixel(0,0,(0,255,0))
+        imgfile.encode_png(image,file)
+        os.utime(file,ns=(1,1))
+        cornell.assert_equals(None,cache.lookup(file))
+        cornell.assert_equals((0,255,0),cache.fetch(file).getPixel(0,0))
+        
+        # The least recently used entries are removed first
+        cache.setLimit(2*34)
+        other = os.path.join(folder,'second.png')
+        imgfile.encode_png(image,other)
+        cache.fetch(other)
+        cornell.assert_equals(2*34,cache.getUsed())
+        cache.setLimit(34)
+        cornell.assert_equals(None,cache.lookup(file))
+        cornell.assert_true(cache.lookup(other) is not None)
+        
+        cache.clear()
+        cornell.assert_equals(0,cache.getUsed())
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_prefetcher():
+    """
+    Tests the background loading of neighboring files
+    """
+    print('Testing neighbor prefetching')
+    import os
+    import shutil
+    import tempfile
+    import a6image
+    import imgprefetch
+    
+    loaded = []
+    def reader(file):
+        loaded.append(os.path.basename(file))
+        return a6image.Image(pixels.Pixels(4),2)
+    
+    folder = tempfile.mkdtemp()
+    try:
+        names = ['a.png','b.jpg','c.png','d.txt','e.png']
+        for name in names:
+            open(os.path.join(folder,name),'w').close()
+        files = [os.path.join(folder,name) for name in names]
+        cornell.assert_equals([files[2],files[0]],imgprefetch.neighbors(files[1]))
+        cornell.assert_equals([files[4],files[1],files[0]],imgprefetch.neighbors(files[2],2))
+        cornell.assert_equals([],imgprefetch.neighbors(files[3]))
+        
+        prefetcher = imgprefetch.Prefetcher(24,1,reader)
+        prefetcher.prefetch(files[1])
+        cornell.assert_true(prefetcher.wait(5))
+        cornell.assert_equals(['c.png','a.png'],loaded)
+        cornell.assert_equals(24,prefetcher.getUsed())
+        
+        image = prefetcher.take(files[2])
+        cornell.assert_equals(2,image.getWidth())
+        cornell.assert_equals(None,prefetcher.take(files[2]))
+        
+        # Stepping forward keeps the loaded neighbor and drops the rest
+        prefetcher.setBudget(12)
+        prefetcher.prefetch(files[2])
+        cornell.assert_true(prefetcher.wait(5))
+        cornell.assert_equals(['c.png','a.png','e.png','b.jpg'],loaded)
+        cornell.assert_equals(12,prefetcher.getUsed())
+        cornell.assert_true(prefetcher.take(files[4]) is not None)
+        cornell.assert_equals(None,prefetcher.take(files[0]))
+    finally:
+        shutil.rmtree(folder)
+
+
+def test_server():
+    """
+    Tests the image processing server
+    """
+    print('Testing image server')
+    import asyncio
+    import a6image
+    import imgfile
+    import imgserver
+    cornell.assert_equals(('127.0.0.1',8000),imgserver.parse_address('8000'))
+    cornell.assert_equals(('localhost',80),imgserver.parse_address('localhost:80'))
+    cornell.assert_equals('/tmp/imager.sock',imgserver.parse_address('/tmp/imager.sock'))
+    
+    p = pixels.Pixels(6)
+    p[0] = (255,0,0)
+    p[5] = (0,0,255)
+    data = imgfile.write_bytes(a6image.Image(p,3),True)
+    
+    async def run(jobs):
+        server = imgserver.ImageServer(2,pipeline=2,processes=False)
+        await server.start(('127.0.0.1',0))
+        try:
+            answers = await imgserver.request(('127.0.0.1',server.getPort()),jobs)
+            return (answers,server.getStatus())
+        finally:
+            await server.close()
+    
+    jobs = [(data,'invert'),(data,'nothing'),(data,'transpose'),
+            (data,'invert',{'region':'0,0,1,1','format':'png'}),(b'not an image','invert')]
+    answers, status = asyncio.run(run(jobs))
+    cornell.assert_equals([200,400,200,200,400],[answer[0] for answer in answers])
+    result = imgfile.read_bytes(answers[0][1])
+    cornell.assert_equals((0,255,255),result.getPixel(0,0))
+    cornell.assert_equals((255,255,0),result.getPixel(1,2))
+    cornell.assert_equals(2,imgfile.read_bytes(answers[2][1]).getWidth())
+    cornell.assert_equals(b'\x89PNG',answers[3][1][:4])
+    result = imgfile.read_bytes(answers[3][1])
+    cornell.assert_equals((0,255,255),result.getPixel(0,0))
+    cornell.assert_equals((0,0,255),result.getPixel(1,2))
+    cornell.assert_equals(5,status['served'])
+    
+    # Faults of the server are not blamed on the request
+    def broken(*args):
+        raise RuntimeError('the worker pool is broken')
+    apply_chain = imgserver.apply_chain
+    imgserver.apply_chain = broken
+    try:
+        answers, status = asyncio.run(run([(data,'invert')]))
+    finally:
+        imgserver.apply_chain = apply_chain
+    cornell.assert_equals(500,answers[0][0])
+    
+    # Bad lengths and over-long lines are malformed requests
+    async def parse(data, limit):
+        reader = asyncio.StreamReader(limit)
+        reader.feed_data(data)
+        reader.feed_eof()
+        try:
+            await imgserver._read_request(reader)
+        except imgserver.HttpError as e:
+            return e.status
+    
+    cornell.assert_equals(400,asyncio.run(parse(b'POST / HTTP/1.1\r\nContent-Length: -5\r\n\r\n',1024)))
+    cornell.assert_equals(400,asyncio.run(parse(b'POST / HTTP/1.1\r\nHost: '+b'x'*64+b'\r\n\r\n',32)))
+
+
+def test_memo():
+    """
+    Tests content hashing and the cache of operation results
+    """
+    print('Testing operation result cache')
+    import a6image
+    import imgeditor
+    import imgmemo
+    import imgtiles
+    p = pixels.Pixels(pixels.CHUNK_SIZE+2)
+    p[0] = (255,0,0)
+    digest = p.digest()
+    copy = p.copy()
+    cornell.assert_equals(digest,copy.digest())
+    
+    # Writes are seen, in any chunk and through views and slices
+    copy[pixels.CHUNK_SIZE+1] = (0,0,1)
+    cornell.assert_true(digest != copy.digest())
+    copy[pixels.CHUNK_SIZE+1] = (0,0,0)
+    cornell.assert_equals(digest,copy.digest())
+    copy.view(slice(1,3))[0] = (9,9,9)
+    cornell.assert_true(digest != copy.digest())
+    copy[0:len(p)] = p
+    cornell.assert_equals(digest,copy.digest())
+    cornell.assert_equals(digest,copy.view(slice(0,len(p))).digest())
+    
+    memo = imgmemo.ResultCache(1024)
+    p = pixels.Pixels(6)
+    p[0] = (255,0,0)
+    p[5] = (0,0,255)
+    editor = imgeditor.Editor(a6image.Image(p,3))
+    editor.setMemo(memo)
+    for step in range(2):
+        editor.increment()
+        editor.perform('transpose')
+        editor.increment()
+        editor.perform('invert')
+        cornell.assert_equals(2,editor.getCurrent().getWidth())
+        cornell.assert_equals((0,255,255),editor.getCurrent().getPixel(0,0))
+        cornell.assert_equals((255,255,0),editor.getCurrent().getPixel(2,1))
+        editor.undo()
+        editor.undo()
+    cornell.assert_equals((2,2),memo.getStats())
+    cornell.assert_equals(2,len(memo))
+    
+    # Region edits are keyed on the region
+    editor.increment((0,0,1,1))
+    editor.perform('invert',region=(0,0,1,1))
+    cornell.assert_equals((0,255,255),editor.getCurrent().getPixel(0,0))
+    cornell.assert_equals((0,0,255),editor.getCurrent().getPixel(1,2))
+    
+    # Rows cannot change pixels behind the chunk hashes
+    editor.undo()
+    editor.undo()
+    editor.increment()
+    editor.getCurrent().getPixels().digest()
+    try:
+        next(editor.getCurrent().rows())[0] = 7
+    except TypeError:
+        pass
+    editor.perform('invert')
+    cornell.assert_equals((0,255,255),editor.getCurrent().getPixel(0,0))
+    
+    # Tiled images are not cached
+    hits = memo.getStats()
+    tp = imgtiles.TiledPixels.fromPixels(p,3,tile=2)
+    editor = imgeditor.Editor(a6image.Image(tp,3))
+    editor.setMemo(memo)
+    editor.increment()
+    editor.perform('invert')
+    cornell.assert_equals((0,255,255),editor.getCurrent().getPixel(0,0))
+    cornell.assert_equals(hits,memo.getStats())
+    
+    # Results are dropped oldest first
+    memo = imgmemo.ResultCache(20)
+    memo.store('a',a6image.Image(pixels.Pixels(3),3))
+    memo.store('b',a6image.Image(pixels.Pixels(3),3))
+    memo.store('c',a6image.Image(pixels.Pixels(3),3))
+    cornell.assert_equals(None,memo.lookup('a'))
+    cornell.assert_equals(18,memo.getUsed())
+
+
+def test_kernels():
+    """
+    Tests that the fast kernels give the same pixels as the Editor methods
+    """
+    print('Testing operation kernels')
+    import a6image
+    import imgeditor
+    import imgtiles
+    operations = [('invert',()),('monochromify',(False,)),('monochromify',(True,)),
+                  ('reflectHori',()),('reflectVert',()),('pixellate',(4,))]
+    for channels in pixels.CHANNELS:
+        p = pixels.Pixels(60*9,channels)
+        for pos in range(len(p)):
+            p[pos] = (pos % 6*30,pos % 6*30,pos % 6*30) if channels == 1 else (pos % 151,pos % 97,pos % 13)
+        sources = [a6image.Image(p,60)]
+        if channels == 3:
+            sources.append(a6image.Image(imgtiles.TiledPixels.fromPixels(p,60,tile=16),60))
+        for source in sources:
+            for name, args in operations:
+                for region in (None,(2,1,5,58)):
+                    results = []
+                    for accelerate in (False,True):
+                        editor = imgeditor.Editor(a6image.Image(source.getPixels().copy(),60))
+                        editor.ACCELERATE = accelerate
+                        editor.increment(region)
+                        editor.perform(name,*args,region=region)
+                        current = editor.getCurrent()
+                        results.append((current.getChannels(),bytes(current.getPixels().buffer)))
+                    cornell.assert_equals(results[0],results[1])
+    
+    # Alpha is kept, and kernels fall back to the method (and its errors) on bad arguments
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(4,4),2))
+    editor.increment()
+    editor.perform('invert')
+    cornell.assert_equals(bytes([255,255,255,255]*4),bytes(editor.getCurrent().getPixels().buffer))
+    cornell.assert_true(test_assert(editor.perform,['pixellate',0],'pixellate does not assert'))
+
+
+def test_draw():
+    """
+    Tests the drawing primitives and the overlays of the Editor
+    """
+    print('Testing drawing primitives')
+    import a6image
+    import imgdraw
+    import imgeditor
+    white = (255,255,255)
+    image = a6image.Image(pixels.Pixels(8*6),8)
+    imgdraw.fill_rect(image,1,2,2,3,white)
+    cornell.assert_equals(white,image.getPixel(2,4))
+    cornell.assert_equals((0,0,0),image.getPixel(2,5))
+    cornell.assert_equals(6,sum(1 for pixel in image.getPixels() if pixel == white))
+    
+    # Shapes are clipped, and lines include both ends
+    imgdraw.fill_rect(image,-5,-5,6,100,(1,2,3))
+    cornell.assert_equals((1,2,3),image.getPixel(0,7))
+    cornell.assert_equals(white,image.getPixel(1,2))
+    image = a6image.Image(pixels.Pixels(8*6),8)
+    imgdraw.line(image,5,0,0,7,white)
+    cornell.assert_equals(white,image.getPixel(5,0))
+    cornell.assert_equals(white,image.getPixel(0,7))
+    cornell.assert_equals(8,sum(1 for pixel in image.getPixels() if pixel == white))
+    
+    # A filled circle is symmetric, and polygons that share an edge do not overlap
+    image = a6image.Image(pixels.Pixels(9*9),9)
+    imgdraw.circle(image,4,4,3,white,True)
+    cornell.assert_equals(image.getPixel(1,3),image.getPixel(3,7))
+    cornell.assert_equals((0,0,0),image.getPixel(0,4))
+    image = a6image.Image(pixels.Pixels(9*9),9)
+    imgdraw.polygon(image,[(0,0),(0,8),(8,0)],(1,0,0))
+    imgdraw.polygon(image,[(0,8),(8,8),(8,0)],(0,1,0))
+    cornell.assert_equals(36,sum(1 for pixel in image.getPixels() if pixel == (1,0,0)))
+    cornell.assert_equals(28,sum(1 for pixel in image.getPixels() if pixel == (0,1,0)))
+    
+    # Drawing keeps alpha, and works through region views
+    image = a6image.Image(pixels.Pixels(4*4,4),4)
+    image.setPixel(0,0,(9,9,9,7))
+    imgdraw.border(image.getRegion(0,0,3,3),1,white)
+    cornell.assert_equals(bytes([255,255,255,7]),bytes(image.getPixels().buffer[0:4]))
+    cornell.assert_equals((0,0,0),image.getPixel(1,1))
+    cornell.assert_equals(white,image.getPixel(2,1))
+    cornell.assert_equals((0,0,0),image.getPixel(3,3))
+    
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(10*10),10))
+    editor.increment()
+    editor.perform('grid',5)
+    cornell.assert_equals(white,editor.getCurrent().getPixel(7,5))
+    cornell.assert_equals((0,0,0),editor.getCurrent().getPixel(0,0))
+    editor.increment()
+    editor.perform('cropMarks',2)
+    cornell.assert_equals(white,editor.getCurrent().getPixel(9,8))
+    cornell.assert_equals((0,0,0),editor.getCurrent().getPixel(9,7))
+    cornell.assert_true(test_assert(editor.perform,['frame',0],'frame does not assert'))
+    
+    # Jail has bars at the edges, and (width-8)//50 evenly spaced bars inside
+    red = (255,0,0)
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(110*8),110))
+    editor.increment()
+    editor.perform('jail')
+    current = editor.getCurrent()
+    for row in (0,2,5,7):
+        cornell.assert_equals(red,current.getPixel(row,50))
+    for col in (0,3,37,40,74,77,106,109):
+        cornell.assert_equals(red,current.getPixel(4,col))
+    for col in (4,36,41,73,78,105):
+        cornell.assert_equals((0,0,0),current.getPixel(4,col))
+    cornell.assert_equals((0,0,0),current.getPixel(3,50))
+    cornell.assert_equals(6*110+2*4*4,sum(1 for pixel in current.getPixels() if pixel == red))
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(4),2))
+    editor.increment()
+    cornell.assert_true(test_assert(editor.perform,['jail'],'jail does not assert'))
+    
+    # A frame thicker than half the image covers all of it
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(10*6),10))
+    editor.increment()
+    editor.perform('frame',4)
+    cornell.assert_true(all(pixel == white for pixel in editor.getCurrent().getPixels()))
+
+
+def test_convolve():
+    """
+    Tests the convolution filters and their Editor operations
+    """
+    print('Testing convolution filters')
+    import a6image
+    import imgconvolve
+    import imgeditor
+    p = pixels.Pixels(5*4)
+    for pos in range(20):
+        p[pos] = (pos*12,100,(pos % 5)*50)
+
+    # A box blur is the average of the square around each pixel (with copied edges)
+    image = a6image.Image(p.copy(),5)
+    imgconvolve.box_blur(image,1)
+    cornell.assert_equals((72,100,50),image.getPixel(1,1))
+    cornell.assert_equals((24,100,17),image.getPixel(0,0))
+
+    # Flat images stay flat, and the bands of worker processes give the same pixels
+    image = a6image.Image(p.copy(),5)
+    imgconvolve.gaussian_blur(image,2)
+    cornell.assert_equals(100,image.getPixel(3,4)[1])
+    other = a6image.Image(p.copy(),5)
+    imgconvolve.gaussian_blur(other,2,workers=2)
+    cornell.assert_equals(list(image.getPixels()),list(other.getPixels()))
+
+    # The worker processes are shared, and never started from a worker thread
+    pool = imgconvolve._pool
+    imgconvolve.gaussian_blur(a6image.Image(p.copy(),5),2,workers=2)
+    cornell.assert_equals(id(pool),id(imgconvolve._pool))
+    cornell.assert_true(imgconvolve._may_fork())
+    import threading
+    forks = []
+    thread = threading.Thread(target=lambda: forks.append(imgconvolve._may_fork()))
+    thread.start()
+    thread.join()
+    cornell.assert_equals([False],forks)
+
+    # Edges are strong where the image changes, and emboss is grey where it does not
+    image = a6image.Image(p.copy(),5)
+    imgconvolve.sobel_edges(image)
+    cornell.assert_equals((255,0,255),image.getPixel(1,1))
+    image = a6image.Image(p.copy(),5)
+    imgconvolve.emboss(image)
+    cornell.assert_equals(128,image.getPixel(2,2)[1])
+
+    # The operations keep alpha, and grey images stay grey
+    image = a6image.Image(pixels.Pixels(9,4),3)
+    image.setPixel(1,1,(90,90,90,7))
+    editor = imgeditor.Editor(image)
+    editor.increment()
+    editor.perform('boxBlur',1)
+    cornell.assert_equals(bytes([10,10,10,7]),bytes(editor.getCurrent().getPixels().buffer[16:20]))
+    editor = imgeditor.Editor(a6image.Image(pixels.Pixels(9,1),3))
+    editor.increment()
+    editor.perform('sharpen',1,100)
+    cornell.assert_equals(1,editor.getCurrent().getPixels().channels)
+    cornell.assert_true(test_assert(editor.perform,['blur',0],'blur does not assert'))
+
+
+def test_pyramid():
+    """
+    Tests the display pyramid of an image
+    """
+    print('Testing display pyramid')
+    import a6image
+    import imgpyramid
+    p = pixels.Pixels(15)
+    for pos in range(15):
+        p[pos] = (pos,2*pos,3*pos)
+    
+    image   = a6image.Image(p,5)
+    pyramid = imgpyramid.Pyramid(image)
+    cornell.assert_equals(3,pyramid.getDepth())
+    cornell.assert_equals((3,2),pyramid.getSize(1))
+    cornell.assert_equals(1,pyramid.choose(3,2))
+    cornell.assert_equals(0,pyramid.choose(4,2))
+    
+    level = pyramid.getLevel(1)
+    cornell.assert_equals(3,level.getWidth())
+    cornell.assert_equals(image.getPixel(2,4),level.getPixel(1,2))
+    
+    # Only the changed region is remade
+    copy = image.copy()
+    copy.setPixel(2,2,(255,255,255))
+    changed = pyramid.update(copy,(2,2,1,1))
+    cornell.assert_equals((1,1,1,1),changed[1])
+    cornell.assert_equals((255,255,255),pyramid.getLevel(1).getPixel(1,1))
+    cornell.assert_equals(image.getPixel(0,0),pyramid.getLevel(1).getPixel(0,0))
+
+
+def test_recorder():
+    """
+    Tests the operation measurements of an editor
+    """
+    print('Testing operation recorder')
+    import a6image
+    import imgeditor
+    import imgstats
+    p = pixels.Pixels(6)
+    for pos in range(6):
+        p[pos] = (pos,pos,pos)
+    
+    # Only the methods use the accessors, so do not run the kernel (see imgkernels)
+    editor   = imgeditor.Editor(a6image.Image(p,3))
+    editor.ACCELERATE = False
+    recorder = imgstats.Recorder(count_pixels=True)
+    editor.setRecorder(recorder)
+    editor.increment((0,1,2,2))
+    editor.perform('invert',region=(0,1,2,2))
+    
+    record = recorder.getLast()
+    cornell.assert_equals('invert',record['name'])
+    cornell.assert_equals([0,1,2,2],record['region'])
+    cornell.assert_equals(4,record['written'])
+    cornell.assert_equals(4,record['reads'])
+    cornell.assert_equals(4,record['writes'])
+    cornell.assert_true(record['wall'] >= 0)
+    cornell.assert_equals(1,recorder.summary()['invert']['count'])
+    
+    # The counting accessors are removed afterwards
+    cornell.assert_true(not 'getFlatPixel' in vars(editor.getCurrent()))
+
+
 def test_all():
     """
     Execute all of the test cases.
@@ -356,8 +1346,33 @@ def test_all():
     test_image_access()
     test_image_str()
     test_image_other()
+    test_image_views()
+    test_image_channels()
+    test_image_unchecked()
+    test_image_iteration()
+    test_image_tiled()
     print('Class Image appears to be working correctly')
     print()
     test_hist_init()
     test_hist_edit()
+    test_hist_region()
+    test_hist_memory()
+    test_hist_redo()
+    test_proxy()
+    test_memo()
+    test_kernels()
+    test_draw()
+    test_convolve()
     print('Class ImageHistory appears to be working correctly')
+    print()
+    test_native_file()
+    test_decode_cache()
+    test_prefetcher()
+    test_server()
+    print('The native file format appears to be working correctly')
+    print()
+    test_pyramid()
+    print('The display pyramid appears to be working correctly')
+    print()
+    test_recorder()
+    print('The operation recorder appears to be working correctly')
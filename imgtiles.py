@@ -0,0 +1,691 @@
+"""
+Tiled pixel storage for very large images
+
+The Pixels class stores an image as one flat, row-major byte buffer.  For giant images
+that buffer (and the copies made by the edit history) may not fit in memory.  This
+module provides an alternative layout, in which the pixels live in fixed-size square
+tiles (256x256 by default).
+
+Only the recently used tiles are kept decompressed.  They live in a TileCache, which
+is a least-recently-used cache bounded by the number of bytes it holds.  When a tile
+is evicted, it is compressed with zlib (which is very effective on the flat regions
+that are common in edited images).  The compressed tiles stay in memory, or are spilled
+to a scratch file if the cache was created with spill enabled.
+
+The class TiledPixels is a subclass of Pixels, so it can be used by Image, Editor and
+ImageHistory without any changes.  Flat pixel positions are mapped to tiles using the
+width the pixels were tiled with.  Image.getTiles() reports the tile rectangles, so
+that Editor operations can visit the image one tile at a time and keep the working set
+bounded.
+
+Not every operation can do that.  Invert, monochromify and vignette visit the storage
+tiles.  With the kernels of imgkernels (the default), reflectHori, reflectVert and
+pixellate visit bands of whole rows instead, and jail only touches its bars.  But
+transpose, rotateLeft and rotateRight copy the whole image and read it one column at a
+time, which cycles through every tile in the cache for each column.  They also change
+the width, so the tiles no longer line up with the rows of the image and getTiles falls
+back to bands.  Finally, the buffer property (used to display the image) assembles a
+flat copy of the entire image.
+"""
+import zlib
+import itertools
+import threading
+import collections
+from array import array
+import pixels
+
+
+# The default tile size (tiles are square)
+TILE_SIZE = 256
+
+# The default number of bytes of decompressed tiles to keep
+CACHE_BYTES = 64*1024*1024
+
+# The zlib level for cold tiles (speed matters more than size)
+_LEVEL = 1
+
+# Unique ids for tile owners (so that they can share a cache)
+_ids = itertools.count()
+
+
+class TileCache(object):
+    """
+    A least-recently-used cache of decompressed tiles, bounded by size in bytes
+
+    A single cache can be shared by any number of TiledPixels objects (by default they
+    all share the cache returned by getDefault).  This bounds the memory used by all of
+    the images in an edit history together.
+
+    Each entry is a list [owner id, tile index, data, dirty].  The data is a bytearray
+    that the owner modifies in place, setting dirty when it does.
+
+    IMMUTABLE ATTRIBUTES
+        _capacity: The maximum number of bytes of tile data   [int > 0]
+        _spill:    Whether evicted tiles go to scratch files  [bool]
+
+    MUTABLE ATTRIBUTES
+        _used:    The number of bytes currently held          [int >= 0]
+        _entries: The cached tiles, oldest first              [OrderedDict]
+        _owners:  The pixel lists owning cached tiles         [WeakValueDictionary]
+    """
+    # The shared default cache
+    _default = None
+
+    @classmethod
+    def getDefault(cls):
+        """
+        Returns: The cache shared by all TiledPixels objects that do not specify one
+        """
+        if cls._default is None:
+            cls._default = cls(CACHE_BYTES)
+        return cls._default
+
+    def getCapacity(self):
+        """
+        Returns: The maximum number of bytes of tile data held by this cache
+        """
+        return self._capacity
+
+    def getUsed(self):
+        """
+        Returns: The number of bytes of tile data currently held by this cache
+        """
+        return self._used
+
+    def isSpilling(self):
+        """
+        Returns: True if evicted tiles are written to scratch files
+        """
+        return self._spill
+
+    def __init__(self, capacity, spill=False):
+        """
+        Initializer: Creates an empty tile cache
+
+        Parameter capacity: The maximum number of bytes of tile data to hold
+        Precondition: capacity is an int > 0
+
+        Parameter spill: Whether evicted tiles are written to scratch files
+        Precondition: spill is a bool
+        """
+        import weakref
+        assert type(capacity) == int and capacity > 0, repr(capacity)+' is not a valid capacity'
+        assert type(spill) == bool, repr(spill)+' is not a bool'
+
+        self._capacity = capacity
+        self._spill    = spill
+        self._used     = 0
+        self._entries  = collections.OrderedDict()
+        self._owners   = weakref.WeakValueDictionary()
+        self._lock     = threading.RLock()
+
+    def fetch(self, owner, index):
+        """
+        Returns: The cache entry for tile index of owner, loading it if necessary
+
+        Loading a tile may evict the least recently used tiles.
+
+        Parameter owner: The pixel list owning the tile
+        Precondition: owner is a TiledPixels object
+
+        Parameter index: The tile index
+        Precondition: index is a valid tile index for owner
+        """
+        key = (owner._id, index)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [owner._id, index, owner._load(index), False]
+                self._entries[key] = entry
+                self._owners[owner._id] = owner
+                self._used += len(entry[2])
+                self._evict(key)
+            else:
+                self._entries.move_to_end(key)
+            return entry
+
+    def flush(self, owner):
+        """
+        Compresses all dirty tiles of owner, leaving them in the cache
+
+        After this call, the cold storage of owner has the latest version of every tile.
+
+        Parameter owner: The pixel list to flush
+        Precondition: owner is a TiledPixels object
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                if entry[0] == owner._id and entry[3]:
+                    owner._unload(entry[1],entry[2])
+                    entry[3] = False
+
+    def release(self, ident):
+        """
+        Drops all tiles of the owner with the given id, without saving them
+
+        Parameter ident: The owner id
+        Precondition: ident is an int
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == ident]:
+                self._used -= len(self._entries.pop(key)[2])
+
+    def _evict(self, keep):
+        """
+        Evicts least recently used tiles until the cache is within capacity
+
+        Dirty tiles are handed back to their owner to be compressed.
+
+        Parameter keep: The key of a tile that must not be evicted
+        Precondition: keep is a key in this cache
+        """
+        while self._used > self._capacity and len(self._entries) > 1:
+            key, entry = self._entries.popitem(last=False)
+            if key == keep:
+                self._entries[key] = entry
+                continue
+            self._used -= len(entry[2])
+            owner = self._owners.get(entry[0])
+            if not owner is None:
+                owner._forget(entry)
+                if entry[3]:
+                    owner._unload(entry[1],entry[2])
+
+
+class TiledPixels(pixels.Pixels):
+    """
+    A pixel list that stores its pixels in square tiles
+
+    This class behaves exactly like Pixels.  Flat position n is the pixel at row
+    n // width and column n % width, where width is the layout width given to the
+    initializer.  The buffer property assembles (and returns) a flat copy of the
+    pixels, as that is what the GUI needs to display the image.
+
+    Do not access the tiles directly.  Use getTile to get the decompressed data of a
+    tile, which is kept in the tile cache.  Tiles always store 3 channels (RGB).
+    """
+
+    @property
+    def buffer(self):
+        """
+        A flat, row-major copy of the pixel data
+
+        This is expensive for large images, as the tiles are assembled into a new buffer
+        each time.
+        """
+        return self._assemble(0,self._height)
+
+    def getLayoutWidth(self):
+        """
+        Returns: The width (in pixels) used to lay out the tiles
+        """
+        return self._width
+
+    def getTileSize(self):
+        """
+        Returns: The width (and height) of a tile in pixels
+        """
+        return self._tile
+
+    def getCache(self):
+        """
+        Returns: The tile cache for this pixel list
+        """
+        return self._cache
+
+    def __init__(self, size, width, tile=TILE_SIZE, cache=None):
+        """
+        Initializer: Creates a new (all black) tiled pixel list
+
+        Tiles are only created when they are first used.
+
+        Parameter size: the number of pixels to store
+        Precondition: size is an int >= 0
+
+        Parameter width: the layout width (the image width)
+        Precondition: width is an int > 0 that evenly divides size
+
+        Parameter tile: the tile width and height
+        Precondition: tile is an int > 0
+
+        Parameter cache: the tile cache (None for the shared default)
+        Precondition: cache is a TileCache or None
+        """
+        assert type(size) == int and size >= 0, repr(size)+' is not a valid size'
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        assert size % width == 0, repr(width)+' does not evenly divide '+repr(size)
+        assert type(tile) == int and tile > 0, repr(tile)+' is not a valid tile size'
+
+        self._size   = size
+        self._buffer = None
+        self._width  = width
+        self._height = size//width
+        self._tile   = tile
+        self._across = (width+tile-1)//tile
+        self._cache  = TileCache.getDefault() if cache is None else cache
+        self._id     = next(_ids)
+        self._cold   = {}
+        self._disk   = None
+        self._dead   = 0
+        self._last   = None
+        self.unmark()
+
+    @classmethod
+    def fromPixels(cls, data, width, tile=TILE_SIZE, cache=None):
+        """
+        Returns: A tiled copy of the given pixel list
+
+        Grey pixels and pixels with alpha are converted to RGB.
+
+        Parameter data: The pixels to copy
+        Precondition: data is a Pixels object
+
+        Parameter width: the layout width (the image width)
+        Precondition: width is an int > 0 that evenly divides len(data)
+
+        Parameter tile: the tile width and height
+        Precondition: tile is an int > 0
+
+        Parameter cache: the tile cache (None for the shared default)
+        Precondition: cache is a TileCache or None
+        """
+        result = cls(len(data),width,tile,cache)
+        if data.channels != 3:
+            data = data.convert(3)
+        source = memoryview(data.buffer)
+        for index in range(result._countTiles()):
+            row, col, height, width = result._rect(index)
+            tile = bytearray()
+            for pos in range(row,row+height):
+                start = (pos*result._width+col)*3
+                tile += source[start:start+width*3]
+            result._unload(index,tile)
+        return result
+
+    def __del__(self):
+        """
+        Releases the cached tiles and scratch file of this pixel list
+        """
+        try:
+            self._cache.release(self._id)
+            if self._disk:
+                self._disk.close()
+        except:
+            pass
+
+    # LIST METHODS
+    def __getitem__(self, index):
+        """
+        Returns: The element or sublist indentified by index.
+
+        Parameter index: The pixel list index
+        Precondition: index is either an int or a slice
+        """
+        if type(index) == int:
+            data, offset = self._locate(self._position(index))
+            return (data[offset],data[offset+1],data[offset+2])
+        elif type(index) == slice:
+            start, stop, step = index.indices(self._size)
+            if step == 1:
+                return self._copy(start,stop)
+            result = pixels.Pixels(len(range(start,stop,step)))
+            for opos, npos in enumerate(range(start,stop,step)):
+                result[opos] = self[npos]
+            result.unmark()
+            return result
+        raise TypeError('pixel indices must be integers or slices, not '+repr(type(index)))
+
+    def __setitem__(self, index, value):
+        """
+        Sets the element or sublist indentified by index to be the new value
+
+        Unlike Pixels, assigning to a slice can never change the length.
+
+        Parameter index: The pixel list index
+        Precondition: index is either an int or a slice
+
+        Parameter value: The new value for the position or slice
+        Precondition: index must be a tuple or a Pixels object
+        """
+        if type(index) == int:
+            index = self._position(index)
+            try:
+                value = bytes((value[0],value[1],value[2]))
+            except:
+                raise ValueError(repr(value)+' is not a valid pixel')
+            with self._cache._lock: # So the tile cannot be evicted mid-write
+                data, offset = self._locate(index)
+                data[offset:offset+3] = value
+                self._last[1][3] = True
+            if not self._marker[index]:
+                self._marker[index] = 1
+                self._change += 1
+        elif type(index) == slice:
+            if not isinstance(value, pixels.Pixels):
+                raise ValueError('attempt to assign a non-pixel sequence to a slice')
+            positions = range(*index.indices(self._size))
+            if len(positions) != len(value):
+                raise ValueError('attempt to assign sequence of size '+str(len(value))+
+                                 ' to a tiled slice of size '+str(len(positions)))
+            if positions.step == 1:
+                self._assign(positions.start,positions.stop,value)
+                return
+            for npos, opos in enumerate(positions):
+                self[opos] = value[npos]
+        else:
+            raise TypeError('pixel indices must be integers or slices, not '+repr(type(index)))
+
+    def __iter__(self):
+        """
+        Returns: An iterator for the pixel list
+
+        The pixels are unpacked in bulk, one band of tile rows at a time.
+        """
+        for row in self.rows(self._width):
+            yield from pixels._PIXEL.iter_unpack(row)
+
+    def rows(self, width):
+        """
+        Returns: An iterator over the rows of an image using this pixel list
+
+        Each row is a read-only memoryview of the width*3 bytes of that row.  The rows 
+        are copies, assembled from the tiles one band of tiles at a time.
+
+        Parameter width: The width of the image using these pixels
+        Precondition: width is an int > 0 that evenly divides the length
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        if width != self._width:
+            for start in range(0,self._size,width):
+                yield memoryview(self._copy(start,start+width).buffer).toreadonly()
+            return
+
+        for first in range(0,self._height,self._tile):
+            last = min(first+self._tile,self._height)
+            band = memoryview(self._assemble(first,last)).toreadonly()
+            for start in range(0,len(band),width*3):
+                yield band[start:start+width*3]
+
+    def tiles(self, width):
+        """
+        Returns: A list of rectangles (row, col, height, width) covering an image
+
+        If width is the layout width, these are the storage tiles, in storage order.
+        Otherwise, this falls back to the row bands of Pixels.
+
+        Parameter width: The width of the image using these pixels
+        Precondition: width is an int > 0 that evenly divides the length
+        """
+        if width != self._width:
+            return super().tiles(width)
+        return [self._rect(index) for index in range(self._countTiles())]
+
+    def footprint(self, seen=None):
+        """
+        Returns: The bytes used by this pixel list, as a dictionary (see Pixels.footprint)
+
+        The pixel storage is the compressed tiles, which are in memory (buffer) or in the
+        spill file (file).  Full copies share compressed tiles, and seen makes sure that
+        each one is only counted once.  Decompressed tiles belong to the tile cache, and
+        are not counted here (see TileCache.getUsed).
+
+        Parameter seen: The ids of storage already counted
+        Precondition: seen is a set or None
+        """
+        result = {'buffer': 0, 'file': 0, 'marker': len(self._marker)}
+        for blob in self._cold.values():
+            if type(blob) == tuple:
+                result['file'] += blob[1]
+            elif seen is None or not id(blob) in seen:
+                if seen is not None:
+                    seen.add(id(blob))
+                result['buffer'] += len(blob)
+        return result
+
+    def digest(self):
+        """
+        Returns: A 16 byte hash of the pixels in this list (see Pixels.digest)
+
+        Tiled storage keeps no chunk hashes, so the tiles are assembled and hashed every
+        time.  The hash is the same as that of a flat list of the same pixels.
+        """
+        return pixels.Pixels.fromBuffer(self.buffer).digest()
+
+    def share(self):
+        """
+        Returns: A copy of this pixel list (see Pixels.share)
+
+        Tiles cannot be shared, so this is the same as copy.
+        """
+        return self.copy()
+
+    def getTile(self, index):
+        """
+        Returns: The decompressed data for the tile with the given index
+
+        The data is a bytearray of height*width*3 bytes in row-major order, where height
+        and width are the dimensions of the tile (tiles on the right and bottom edges may
+        be smaller).  It is only valid until the next access of this pixel list.  Use the
+        pixel accessors if you want to modify the tile.
+
+        Parameter index: The tile index (in the order of tiles())
+        Precondition: index is an int, 0 <= index < len(self.tiles(width))
+        """
+        return self._cache.fetch(self,index)[2]
+
+    # HIDDEN METHODS
+    def _countTiles(self):
+        """
+        Returns: The number of tiles in this pixel list
+        """
+        return self._across*((self._height+self._tile-1)//self._tile)
+
+    def _rect(self, index):
+        """
+        Returns: The rectangle (row, col, height, width) for the given tile index
+
+        Parameter index: The tile index
+        Precondition: index is an int, 0 <= index < the number of tiles
+        """
+        row = (index // self._across)*self._tile
+        col = (index %  self._across)*self._tile
+        return (row, col, min(self._tile,self._height-row), min(self._tile,self._width-col))
+
+    def _position(self, index):
+        """
+        Returns: The flat position for the given index
+
+        Like a list (and Pixels), negative indices count from the end.
+
+        Parameter index: The pixel list index
+        Precondition: index is an int
+        """
+        pos = index+self._size if index < 0 else index
+        if pos < 0 or pos >= self._size:
+            raise IndexError(repr(index)+' is not a valid pixel index')
+        return pos
+
+    def _locate(self, index):
+        """
+        Returns: The pair (tile data, byte offset) for the given flat position
+
+        The most recently used tile is remembered, so that runs of accesses within one
+        tile do not go through the cache.
+
+        Parameter index: The flat pixel position
+        Precondition: index is an int, 0 <= index < len(self)
+        """
+        row, col = divmod(index,self._width)
+        tile = (row // self._tile)*self._across + col // self._tile
+        last = self._last
+        if last is None or last[0] != tile:
+            last = (tile, self._cache.fetch(self,tile))
+            self._last = last
+        width = min(self._tile,self._width-(col-col % self._tile))
+        return (last[1][2], ((row % self._tile)*width + col % self._tile)*3)
+
+    def _assign(self, start, stop, value):
+        """
+        Writes the pixels of value to the flat positions start..stop-1
+
+        The positions are written one run at a time, where a run is the part of an image
+        row inside one tile.  Each run is a single slice assignment to the tile data.
+
+        Parameter start: The first pixel to write
+        Precondition: start is an int, 0 <= start <= stop
+
+        Parameter stop: The pixel after the last one to write
+        Precondition: stop is an int, start <= stop <= len(self)
+
+        Parameter value: The pixels to write
+        Precondition: value is a Pixels object of length stop-start
+        """
+        source = value.convert(3).buffer
+        pos = start
+        with self._cache._lock: # So the tiles cannot be evicted mid-write
+            while pos < stop:
+                row, col = divmod(pos,self._width)
+                end = min(stop,row*self._width+min(self._width,(col//self._tile+1)*self._tile))
+                data, offset = self._locate(pos)
+                data[offset:offset+(end-pos)*3] = bytes(source[(pos-start)*3:(end-start)*3])
+                self._last[1][3] = True
+                pos = end
+        prev = self._marker[start:stop].count(1)
+        self._marker[start:stop] = b'\x01'*(stop-start)
+        self._change += stop-start-prev
+
+    def _forget(self, entry):
+        """
+        Forgets the remembered tile if it is the given cache entry (as it was evicted)
+
+        Parameter entry: An evicted cache entry
+        Precondition: entry is a cache entry for this pixel list
+        """
+        last = self._last
+        if not last is None and last[1] is entry:
+            self._last = None
+
+    def _load(self, index):
+        """
+        Returns: The decompressed data of the given tile, as a new bytearray
+
+        Tiles that have never been stored are all black.
+
+        Parameter index: The tile index
+        Precondition: index is an int, 0 <= index < the number of tiles
+        """
+        blob = self._cold.get(index)
+        if blob is None:
+            row, col, height, width = self._rect(index)
+            return bytearray(height*width*3)
+        if type(blob) == tuple:
+            self._disk.seek(blob[0])
+            blob = self._disk.read(blob[1])
+        return bytearray(zlib.decompress(blob))
+
+    def _unload(self, index, data):
+        """
+        Stores the given tile data in cold (compressed) storage
+
+        Parameter index: The tile index
+        Precondition: index is an int, 0 <= index < the number of tiles
+
+        Parameter data: The decompressed tile data
+        Precondition: data is a byte buffer of the right size for the tile
+        """
+        blob = zlib.compress(data,_LEVEL)
+        if not self._cache.isSpilling():
+            self._cold[index] = blob
+            return
+
+        import tempfile
+        if self._disk is None:
+            self._disk = tempfile.TemporaryFile()
+        slot = self._cold.get(index)
+        if type(slot) == tuple and len(blob) <= slot[1]:
+            # Reuse the old slot; the rest of it is dead
+            offset = slot[0]
+            self._dead += slot[1]-len(blob)
+        else:
+            offset = self._disk.seek(0,2)
+            if type(slot) == tuple:
+                self._dead += slot[1]
+        self._disk.seek(offset)
+        self._disk.write(blob)
+        self._cold[index] = (offset,len(blob))
+        if self._dead > self._disk.seek(0,2)-self._dead:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrites the scratch file with only the live tiles, dropping the dead bytes
+
+        The dead bytes are the old versions of tiles that were spilled again.  This is
+        called when they are more than the live bytes, so the scratch file is never much
+        more than twice the size of the spilled tiles.
+        """
+        import tempfile
+        disk = tempfile.TemporaryFile()
+        for index, slot in self._cold.items():
+            if type(slot) == tuple:
+                self._disk.seek(slot[0])
+                self._cold[index] = (disk.tell(),slot[1])
+                disk.write(self._disk.read(slot[1]))
+        self._disk.close()
+        self._disk = disk
+        self._dead = 0
+
+    def _copy(self, start, stop):
+        """
+        Returns: A new pixel list with a copy of the pixels in the range start..stop-1
+
+        Copying the entire list produces another TiledPixels object (sharing the
+        compressed tiles, as they are immutable).  Anything else produces a flat Pixels
+        object.
+
+        Parameter start: The first pixel to copy
+        Precondition: start is an int, 0 <= start <= stop
+
+        Parameter stop: The pixel after the last one to copy
+        Precondition: stop is an int, start <= stop <= len(self)
+        """
+        if start == 0 and stop == self._size:
+            self._cache.flush(self)
+            result = TiledPixels(self._size,self._width,self._tile,self._cache)
+            for index, blob in self._cold.items():
+                if type(blob) == tuple:
+                    result._unload(index,self._load(index))
+                else:
+                    result._cold[index] = blob
+            return result
+
+        first = start // self._width
+        last  = (stop+self._width-1) // self._width
+        flat  = self._assemble(first,last)
+        if start != first*self._width or stop != last*self._width:
+            offset = first*self._width
+            flat = flat[(start-offset)*3:(stop-offset)*3]
+        return pixels.Pixels.fromBuffer(flat)
+
+    def _assemble(self, first, last):
+        """
+        Returns: A flat, row-major array('B') of the rows first..last-1
+
+        Parameter first: The first row to assemble
+        Precondition: first is an int, 0 <= first <= last
+
+        Parameter last: The row after the last one to assemble
+        Precondition: last is an int, first <= last <= height
+        """
+        flat = array('B',bytes((last-first)*self._width*3))
+        for index in range(self._countTiles()):
+            row, col, height, width = self._rect(index)
+            if row+height <= first or row >= last:
+                continue
+            with self._cache._lock:
+                data = self.getTile(index)
+                for pos in range(max(row,first),min(row+height,last)):
+                    source = (pos-row)*width*3
+                    target = ((pos-first)*self._width+col)*3
+                    flat[target:target+width*3] = array('B',data[source:source+width*3])
+        return flat
@@ -0,0 +1,301 @@
+"""
+Zoom and pan support for the image panels
+
+When an ImagePanel is zoomed in, it no longer shows the image as a single texture.
+Instead, it shows a grid of tile textures, taken from the pyramid level (see imgpyramid)
+that best matches the zoom.  Only the tiles that are visible are uploaded, and uploaded
+tiles are kept in an LRU cache, so panning back over a part of the image is free.
+
+This module has the parts of that which do not depend on Kivy.  A Viewport maps between
+the image and the screen, and a TextureCache holds the uploaded tiles.  Screen positions
+are relative to the bottom left corner of the panel interior, with y going up, as in
+Kivy.  Image positions are (row, col), with row 0 at the top.
+"""
+import math
+import threading
+from collections import OrderedDict
+
+
+# The width and height of a tile texture
+TILE_SIZE = 256
+
+# The most that the zoom can magnify the image (screen pixels per image pixel)
+MAX_SCALE = 16
+
+
+class Viewport(object):
+    """
+    A class representing the part of an image shown on screen
+
+    The viewport shows the image at a scale (screen pixels per image pixel), centered
+    on a point of the image.  At the smallest scale the entire image fits on screen.
+
+    IMMUTABLE ATTRIBUTES
+        _width:   The image width                              [int > 0]
+        _height:  The image height                             [int > 0]
+        _screen:  The screen size (width, height)              [pair of numbers > 0]
+        _fit:     The scale at which the image fits the screen [float > 0]
+
+    MUTABLE ATTRIBUTES
+        _scale:   The current scale                            [float >= _fit]
+        _center:  The image point (row, col) at the center     [pair of floats]
+    """
+
+    def getScale(self):
+        """
+        Returns: The number of screen pixels per image pixel
+        """
+        return self._scale
+
+    def getCenter(self):
+        """
+        Returns: The image position (row, col) shown at the center of the screen
+        """
+        return self._center
+
+    def isZoomed(self):
+        """
+        Returns: True if the image is magnified beyond fitting the screen
+        """
+        return self._scale > self._fit
+
+    def __init__(self, width, height, screen):
+        """
+        Initializer: Creates a viewport showing the entire image
+
+        Parameter width: The image width
+        Precondition: width is an int > 0
+
+        Parameter height: The image height
+        Precondition: height is an int > 0
+
+        Parameter screen: The screen size (width, height)
+        Precondition: screen is a pair of numbers > 0
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+        assert len(screen) == 2 and min(screen) > 0, repr(screen)+' is not a valid size'
+        self._width  = width
+        self._height = height
+        self._screen = tuple(screen)
+        self._fit    = min(screen[0]/width,screen[1]/height)
+        self.reset()
+
+    def reset(self):
+        """
+        Zooms out so that the entire image is on screen
+        """
+        self._scale  = self._fit
+        self._center = (self._height/2,self._width/2)
+
+    def zoomBy(self, factor, anchor=None):
+        """
+        Multiplies the scale by factor, keeping anchor at the same place on screen
+
+        The scale is limited to the range from fitting the screen to MAX_SCALE.
+
+        Parameter factor: The change in scale
+        Precondition: factor is a number > 0
+
+        Parameter anchor: The screen position that stays fixed (the center if None)
+        Precondition: anchor is None or a pair of numbers
+        """
+        if anchor is None:
+            anchor = (self._screen[0]/2,self._screen[1]/2)
+        point = self.toImage(anchor)
+        self._scale = min(max(self._scale*factor,self._fit),max(MAX_SCALE,self._fit))
+        # Move the center so that point is under anchor again
+        self._center = (point[0]+(anchor[1]-self._screen[1]/2)/self._scale,
+                        point[1]-(anchor[0]-self._screen[0]/2)/self._scale)
+        self._clamp()
+
+    def panBy(self, dx, dy):
+        """
+        Moves the image by (dx, dy) screen pixels
+
+        Parameter dx: The horizontal distance
+        Precondition: dx is a number
+
+        Parameter dy: The vertical distance (up is positive)
+        Precondition: dy is a number
+        """
+        self._center = (self._center[0]+dy/self._scale,self._center[1]-dx/self._scale)
+        self._clamp()
+
+    def toImage(self, pos):
+        """
+        Returns: The image position (row, col) under a screen position, as floats
+
+        Parameter pos: The screen position
+        Precondition: pos is a pair of numbers
+        """
+        return (self._center[0]-(pos[1]-self._screen[1]/2)/self._scale,
+                self._center[1]+(pos[0]-self._screen[0]/2)/self._scale)
+
+    def toScreen(self, row, col):
+        """
+        Returns: The screen position (x, y) of the top left corner of a pixel
+
+        Parameter row: The image row
+        Precondition: row is a number
+
+        Parameter col: The image column
+        Precondition: col is a number
+        """
+        return (self._screen[0]/2+(col-self._center[1])*self._scale,
+                self._screen[1]/2-(row-self._center[0])*self._scale)
+
+    def getLevel(self, depth):
+        """
+        Returns: The pyramid level to draw at the current scale
+
+        This is the highest level with at least one level pixel per screen pixel.
+
+        Parameter depth: The number of pyramid levels
+        Precondition: depth is an int > 0
+        """
+        level = 0
+        while level+1 < depth and (1 << (level+1))*self._scale <= 1:
+            level += 1
+        return level
+
+    def getTiles(self, level):
+        """
+        Returns: The visible tiles of the given pyramid level
+
+        Each tile is a tuple (row, col, height, width), in level pixels.  Tiles are
+        TILE_SIZE square, except at the right and bottom edges of the level.
+
+        Parameter level: The pyramid level
+        Precondition: level is an int >= 0
+        """
+        factor = 1 << level
+        width  = -(-self._width//factor)
+        height = -(-self._height//factor)
+        top, left     = self.toImage((0,self._screen[1]))
+        bottom, right = self.toImage((self._screen[0],0))
+
+        rows = range(max(0,math.floor(top/factor))//TILE_SIZE,
+                     max(0,min(height-1,math.floor(bottom/factor)))//TILE_SIZE+1)
+        cols = range(max(0,math.floor(left/factor))//TILE_SIZE,
+                     max(0,min(width-1,math.floor(right/factor)))//TILE_SIZE+1)
+        result = []
+        for row in rows:
+            for col in cols:
+                result.append((row*TILE_SIZE,col*TILE_SIZE,
+                               min(TILE_SIZE,height-row*TILE_SIZE),
+                               min(TILE_SIZE,width-col*TILE_SIZE)))
+        return result
+
+    def _clamp(self):
+        """
+        Keeps the center so that the image covers as much of the screen as it can
+        """
+        span = (self._screen[1]/self._scale/2,self._screen[0]/self._scale/2)
+        limits = (self._height,self._width)
+        center = []
+        for axis in range(2):
+            if 2*span[axis] >= limits[axis]:
+                center.append(limits[axis]/2)
+            else:
+                center.append(min(max(self._center[axis],span[axis]),limits[axis]-span[axis]))
+        self._center = tuple(center)
+
+
+class TextureCache(object):
+    """
+    A class representing a byte-bounded LRU cache of tile textures
+
+    Entries are keyed by (level, row, col) of their tile.  The cache does not know how
+    to make a texture; fetch is given a function to make one on a miss.
+
+    MUTABLE ATTRIBUTES
+        _capacity: The most bytes of texture to keep           [int > 0]
+        _used:     The bytes of texture in the cache           [int >= 0]
+        _entries:  The textures and their sizes, oldest first  [OrderedDict]
+    """
+
+    def getCapacity(self):
+        """
+        Returns: The most bytes of texture that this cache keeps
+        """
+        return self._capacity
+
+    def getUsed(self):
+        """
+        Returns: The bytes of texture in this cache
+        """
+        return self._used
+
+    def __len__(self):
+        """
+        Returns: The number of textures in this cache
+        """
+        return len(self._entries)
+
+    def __init__(self, capacity=64*1024*1024):
+        """
+        Initializer: Creates an empty cache
+
+        Parameter capacity: The most bytes of texture to keep
+        Precondition: capacity is an int > 0
+        """
+        assert type(capacity) == int and capacity > 0, repr(capacity)+' is not a valid capacity'
+        self._capacity = capacity
+        self._used     = 0
+        self._entries  = OrderedDict()
+        self._lock     = threading.Lock()
+
+    def fetch(self, key, create, nbytes):
+        """
+        Returns: The texture for key, calling create() to make it on a miss
+
+        The least recently used textures are dropped to keep the cache under capacity.
+        The texture just fetched is never dropped.
+
+        Parameter key: The tile key (level, row, col)
+        Precondition: key is a tuple
+
+        Parameter create: The function to make the texture
+        Precondition: create is a callable with no arguments
+
+        Parameter nbytes: The size of the texture in bytes
+        Precondition: nbytes is an int >= 0
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+        texture = create()
+        with self._lock:
+            self._entries[key] = (texture,nbytes)
+            self._used += nbytes
+            while self._used > self._capacity and len(self._entries) > 1:
+                _, (_, size) = self._entries.popitem(last=False)
+                self._used -= size
+        return texture
+
+    def discard(self, level, rect):
+        """
+        Drops the textures of a level that overlap a rectangle
+
+        Parameter level: The pyramid level
+        Precondition: level is an int >= 0
+
+        Parameter rect: The rectangle (row, col, height, width), in level pixels
+        Precondition: rect is a tuple of four ints
+        """
+        row, col, height, width = rect
+        with self._lock:
+            for key in list(self._entries):
+                if (key[0] == level and key[1] < row+height and row < key[1]+TILE_SIZE and
+                    key[2] < col+width and col < key[2]+TILE_SIZE):
+                    self._used -= self._entries.pop(key)[1]
+
+    def clear(self):
+        """
+        Drops every texture in the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self._used = 0
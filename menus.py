@@ -110,8 +110,12 @@ class EditDropDown(MenuDropDown):
     # These fields are 'hooks' to connect to the imager.kv file
     # Undo one edit step
     undochoice  = ObjectProperty(None)
+    # Redo one undone edit step
+    redochoice  = ObjectProperty(None)
     # Undo all edits
     clearchoice = ObjectProperty(None)
+    # Clear the selected region
+    deselectchoice = ObjectProperty(None)
 
 
 class AxisDropDown(MenuDropDown):
@@ -170,4 +174,23 @@ class BlockDropDown(MenuDropDown):
     # 100 pixel block
     choice100 = ObjectProperty(None)
     # 200 pixel block
-    choice200 = ObjectProperty(None)
\ No newline at end of file
+    choice200 = ObjectProperty(None)
+
+class ConvolveDropDown(MenuDropDown):
+    """
+    A controller for a Filter drop-down, providing a choice of convolution filters
+    
+    The View for this controller is defined in imager.kv.  This class simply contains
+    the hooks for the view properties
+    """
+    # These fields are 'hooks' to connect to the imager.kv file
+    # Gaussian blur
+    blurchoice = ObjectProperty(None)
+    # Box blur
+    boxchoice = ObjectProperty(None)
+    # Unsharp mask
+    sharpchoice = ObjectProperty(None)
+    # Sobel edges
+    edgechoice = ObjectProperty(None)
+    # Emboss
+    embosschoice = ObjectProperty(None)
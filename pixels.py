@@ -13,6 +13,21 @@ Date:   October 20, 2017
 """
 from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
+import itertools                    # Chunked iteration
+import struct                       # Bulk unpacking of pixels
+
+
+# The default number of pixels in a chunk of a chunked iteration
+CHUNK_SIZE = 65536
+
+# The number of channels (bytes per pixel) that a pixel list can store
+CHANNELS = (1, 3, 4)
+
+# The layout of a single pixel for struct.iter_unpack
+_PIXEL = struct.Struct('3B')
+
+# The layout of a single pixel with alpha for struct.iter_unpack
+_RGBA  = struct.Struct('4B')
 
 
 class Pixels(object):
@@ -33,33 +48,100 @@ class Pixels(object):
     The methods progress() and unmark() are used to track changes to this pixel list.
     These methods are used by the progress bar to display how much of the image has
     been modified.
+    
+    The method digest() returns a hash of the pixels, for caching the results of
+    operations.  The hash of each chunk of CHUNK_SIZE pixels is kept until a pixel in
+    that chunk is written, so hashing an image again after a small edit is cheap.
+    
+    The method share() makes a copy in constant time, which uses the storage of this
+    pixel list until the copy is first written.
+    
+    A pixel list stores 3 bytes (channels) per pixel by default.  A list of grey pixels
+    can store just 1 byte per pixel (see compact), and a list of pixels with alpha 
+    stores 4.  The pixels are always (r,g,b) tuples, whatever the storage.  Writing a 
+    pixel that is not grey to a grey list converts it back to 3 channels, and writing
+    a pixel to a list with alpha keeps the alpha of that position.
     """
     
+    # The number of bytes per pixel (see the channels property)
+    _channels = 3
+    
+    # The hash of each chunk of pixels, or None for a chunk not hashed since a write
+    _digests = None
+    
+    # The pixel list whose storage this one uses until it is written (see share)
+    _base = None
+    
     @property
     def buffer(self):
         """
         The underlying byte buffer
+        
+        While this pixel list shares the storage of another (see share), this is a 
+        read-only view of that storage.
         """
+        if self._base is not None:
+            return memoryview(self._buffer).toreadonly()
         return self._buffer
     
+    @property
+    def channels(self):
+        """
+        The number of bytes per pixel: 1 (grey), 3 (RGB) or 4 (RGBA)
+        """
+        return self._channels
+    
     # INITIALIZER
-    def __init__(self,size):
+    def __init__(self,size,channels=3):
         """
         Initializer: Creates a new pixel list
         
-        The initializer creates an empty pixel list.  To fill the pixel list you must
-        assign the positions directly.
+        The initializer creates an empty (black) pixel list.  To fill the pixel list you
+        must assign the positions directly.  The pixels of a list with alpha are opaque.
         
         Parameter size: the number of pixels to store
         Precondition: size is an int >= 0
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
         """
         assert type(size) == int, repr(size)+' is not an int'
         assert size >= 0, repr(size)+' is negative'
+        assert channels in CHANNELS, repr(channels)+' is not a valid number of channels'
         
-        self._size   = size
-        self._buffer = array('B',[0]*size*3)
+        self._size     = size
+        self._channels = channels
+        self._buffer   = array('B',bytes(size*channels))
+        if channels == 4:
+            self._buffer[3::4] = array('B',b'\xff'*size)
         self.unmark()
     
+    @classmethod
+    def fromBuffer(cls,buffer,channels=3):
+        """
+        Returns: A pixel list that uses buffer as its storage (without copying it)
+        
+        This is how image loaders hand decoded data to a pixel list.  The buffer can be
+        an array('B'), a bytearray or a writable memoryview (such as one over a memory
+        mapped file).  Changes to the pixel list write through to the buffer.
+        
+        Parameter buffer: The byte buffer with the packed grey, RGB or RGBA data
+        Precondition: buffer is a writable byte buffer whose length is a multiple of 
+        channels
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        assert channels in CHANNELS, repr(channels)+' is not a valid number of channels'
+        assert len(buffer) % channels == 0, 'buffer length '+repr(len(buffer))+' is not a multiple of '+repr(channels)
+        
+        result = cls(0)
+        result._size     = len(buffer)//channels
+        result._channels = channels
+        result._buffer   = buffer
+        result.unmark()
+        return result
+    
     # DISPLAY METHODS
     def __str__(self):
         """
@@ -110,24 +192,34 @@ class Pixels(object):
         Precondition: index is either an int or a slice
         """
         if type(index) == int:
-            r = self._buffer[index*3  ]
-            g = self._buffer[index*3+1]
-            b = self._buffer[index*3+2]
-            return (r,g,b)
+            if self._channels == 3:
+                r = self._buffer[index*3  ]
+                g = self._buffer[index*3+1]
+                b = self._buffer[index*3+2]
+                return (r,g,b)
+            elif self._channels == 1:
+                grey = self._buffer[index]
+                return (grey,grey,grey)
+            return (self._buffer[index*4],self._buffer[index*4+1],self._buffer[index*4+2])
         elif type(index) == slice:
             start = 0 if index.start is None else index.start
             stop  = self._size if index.stop is None else index.stop
+            c = self._channels
             # Time to make a copy
             if index.step is None:
-                result = Pixels(stop-start)
-                result._buffer = self._buffer[start*3:stop*3]
+                result = self._copy(start,stop)
+            elif type(self._buffer) == array and index.step > 0:
+                # Extended slices copy a channel at a time, without a Python loop
+                result = Pixels(len(range(start,stop,index.step)),c)
+                if len(result):
+                    for channel in range(c):
+                        result._buffer[channel::c] = self._buffer[start*c+channel:stop*c:index.step*c]
             else:
-                result = Pixels(len(range(start,stop,index.step)))
+                result = Pixels(len(range(start,stop,index.step)),c)
                 opos = 0
                 for npos in range(start,stop,index.step):
-                    result._buffer[opos*3  ] = self._buffer[npos*3  ]
-                    result._buffer[opos*3+1] = self._buffer[npos*3+1]
-                    result._buffer[opos*3+2] = self._buffer[npos*3+2]
+                    for channel in range(c):
+                        result._buffer[opos*c+channel] = self._buffer[npos*c+channel]
                     opos += 1
             return result
         else:
@@ -148,14 +240,33 @@ class Pixels(object):
         Parameter value: The new value for the position or slice
         Precondition: index must be a tuple or a list of tuples
         """
+        if self._base is not None:
+            self._own()
         if type(index) == int:
             try:
-                self._buffer[index*3  ] = value[0]
-                self._buffer[index*3+1] = value[1]
-                self._buffer[index*3+2] = value[2]
+                if self._channels == 3:
+                    self._buffer[index*3  ] = value[0]
+                    self._buffer[index*3+1] = value[1]
+                    self._buffer[index*3+2] = value[2]
+                elif self._channels == 4:
+                    self._buffer[index*4  ] = value[0]
+                    self._buffer[index*4+1] = value[1]
+                    self._buffer[index*4+2] = value[2]
+                    if len(value) > 3:
+                        self._buffer[index*4+3] = value[3]
+                elif value[0] == value[1] == value[2]:
+                    self._buffer[index] = value[0]
+                else:
+                    # Color written to a grey list
+                    self[index]  # Check the index before converting
+                    self._reshape(3)
+                    self[index] = value
+                    return
                 if not self._marker[index]:
                     self._marker[index] = 1
                     self._change += 1
+                if self._digests is not None:
+                    self._digests[index//CHUNK_SIZE] = None
             except IndexError:
                 raise IndexError(repr(index)+' is not a valid pixel index')
             except:
@@ -163,27 +274,49 @@ class Pixels(object):
         elif type(index) == slice:
             if not type(value) == Pixels:
                 raise ValueError('attempt to assign a non-pixel sequence to a slice')
-            size = len(range(index.start,index.stop,index.step))
-            if len(value) == size:
+            start, stop, step = index.indices(self._size)
+            size = len(range(start,stop,step))
+            if value._channels != self._channels:
+                if value._channels > self._channels or (len(value) == size == self._size and step == 1):
+                    # Every pixel is replaced, or value has more channels
+                    self._reshape(value._channels)
+                else:
+                    value = value.convert(self._channels)
+            c = self._channels
+            if len(value) == size and step == 1:
+                with memoryview(self._buffer) as dst, memoryview(value._buffer) as src:
+                    dst[start*c:stop*c] = src[:size*c]
+                prev = self._marker[start:stop].count(1)
+                self._marker[start:stop] = b'\x01'*size
+                self._change += size-prev
+                self._forget(start,stop)
+            elif len(value) == size and type(self._buffer) == array and step > 0:
+                # Extended slices copy a channel at a time, without a Python loop
+                source = _asarray(value._buffer[:size*c])
+                for channel in range(c):
+                    self._buffer[start*c+channel:stop*c:step*c] = source[channel::c]
+                prev = self._marker[start:stop:step].count(1)
+                self._marker[start:stop:step] = b'\x01'*size
+                self._change += size-prev
+                self._forget(start,stop)
+            elif len(value) == size:
                 npos = 0
-                for opos in range(index.start,index.stop,index.step):
-                    self._buffer[opos*3  ] = value._buffer[npos*3  ]
-                    self._buffer[opos*3+1] = value._buffer[npos*3+1]
-                    self._buffer[opos*3+2] = value._buffer[npos*3+2]
+                for opos in range(start,stop,step):
+                    for channel in range(c):
+                        self._buffer[opos*c+channel] = value._buffer[npos*c+channel]
                     npos += 1
                     if not self._marker[opos]:
                         self._marker[opos] = 1
                         self._change += 1
+                self._forget(0,self._size)
             elif index.step is None:
-                self._buffer[index.start*3:index.stop*3] = value._buffer
-                self._size = len(self._buffer)//3
+                self._buffer[start*c:stop*c] = value._buffer
+                self._size = len(self._buffer)//c
                 
-                prev = 0
-                for pos in range(index.start,index.stop):
-                    if self._marker[pos]:
-                        prev += 1
-                self._marker[index.start:index.stop] = [1]*len(value)
+                prev = self._marker[start:stop].count(1)
+                self._marker[start:stop] = b'\x01'*len(value)
                 self._change += len(value)-prev
+                self._digests = None
             else:
                 raise ValueError('attempt to assign sequence of size '+str(len(value))+' to extended slice of size '+str(size))
         else:
@@ -193,9 +326,169 @@ class Pixels(object):
         """
         Returns: An iterator for the pixel list
         
-        This allows the pixel list to be used in for-loops
+        This allows the pixel list to be used in for-loops.  The pixels are unpacked in 
+        bulk, a chunk at a time, so a loop over the pixels is not slowed down by the 
+        indexing code in __getitem__.
+        """
+        view = memoryview(self._buffer)
+        step = CHUNK_SIZE*self._channels
+        for start in range(0,len(view),step):
+            yield from _unpack(view[start:start+step],self._channels)
+    
+    def chunks(self,size=CHUNK_SIZE):
+        """
+        Returns: An iterator over consecutive chunks of this pixel list
+        
+        Each chunk is a list of (at most) size pixel tuples.  Chunks are a good way to
+        process very large images, as only one chunk of tuples exists at a time.
+        
+        Parameter size: The number of pixels in each chunk
+        Precondition: size is an int > 0
         """
-        return _PixelIterator(self)
+        assert type(size) == int and size > 0, repr(size)+' is not a valid chunk size'
+        iterator = iter(self)
+        chunk = list(itertools.islice(iterator,size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(iterator,size))
+    
+    def rows(self,width):
+        """
+        Returns: An iterator over the rows of an image using this pixel list
+        
+        Each row is a read-only memoryview of the width*channels bytes of that row.  For
+        a flat pixel list these refer to the buffer itself, so no pixels are copied.  To 
+        change pixels, use a view (see the method view) instead.
+        
+        Parameter width: The width of the image using these pixels
+        Precondition: width is an int > 0 that evenly divides the length
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        view = memoryview(self._buffer).toreadonly()
+        c = self._channels
+        for start in range(0,self._size*c,width*c):
+            yield view[start:start+width*c]
+    
+    def view(self,index):
+        """
+        Returns: A view of the pixels in the given slice, without copying them.
+        
+        Slicing a pixel list (p[1:3]) always makes a copy.  A view instead refers to
+        the pixels of this list, so changes to the view change this list (and the
+        other way around).  Use the view method copy() to get an independent copy.
+        
+        Parameter index: The pixels to view
+        Precondition: index is a slice
+        """
+        if type(index) != slice:
+            raise TypeError('pixel views must be slices, not '+repr(type(index)))
+        start, stop, step = index.indices(self._size)
+        return PixelView(self,start,len(range(start,stop,step)),step)
+    
+    def copy(self):
+        """
+        Returns: A copy of this pixel list (which is never a view)
+        """
+        return self._copy(0,self._size)
+    
+    def share(self):
+        """
+        Returns: A copy of this pixel list that uses the storage of this one until written
+        
+        This takes constant time.  The first write to the copy (or view of the copy) 
+        makes its own storage, so changes to the copy never change this list.  But this
+        list must not be changed while a copy shares it, as the copy would change too.
+        So only share pixel lists that are never changed, such as the original image of 
+        an edit history.
+        """
+        result = Pixels(0,self._channels)
+        result._buffer = self._buffer
+        result._size   = self._size
+        result._base   = self
+        result.unmark()
+        if self._digests is not None:
+            result._digests = list(self._digests)
+        return result
+    
+    def refill(self,source):
+        """
+        Overwrites this pixel list with the pixels of source, reusing its storage
+        
+        Afterwards this list is just like source.copy(), with no changes marked.  But
+        unless this list shares storage (see share), no storage is allocated.  This is 
+        how an edit history recycles the storage of the edits that it drops.
+        
+        Parameter source: The pixels to copy
+        Precondition: source is a Pixels object with the same length as this one
+        """
+        assert isinstance(source, Pixels), repr(source)+' is not a pixel list'
+        assert len(source) == self._size, repr(source)+' does not have '+repr(self._size)+' pixels'
+        if type(source) not in (Pixels,MappedPixels):
+            source = source.copy()
+        if self._base is not None or self._channels != source._channels:
+            self._buffer   = source._copy(0,self._size)._buffer
+            self._channels = source._channels
+            self._base     = None
+        else:
+            _transfer(self._buffer,source._buffer,0,self._size*self._channels)
+        self.unmark()
+        self._digests = None if source._digests is None else list(source._digests)
+    
+    def convert(self,channels):
+        """
+        Returns: A (flat) copy of this pixel list with the given number of channels
+        
+        Converting grey pixels to 3 or 4 channels copies the grey to every color, and 
+        the alpha of pixels converted to 4 channels is opaque.  Converting to 3 channels
+        drops the alpha.  Converting to 1 channel keeps the red of each pixel, so it is 
+        only correct if every pixel is grey.
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        assert channels in CHANNELS, repr(channels)+' is not a valid number of channels'
+        source = self if type(self) in (Pixels,MappedPixels) else self.copy()
+        if source._channels == channels:
+            return source._copy(0,self._size)
+        result = source._new(self._size,channels)
+        _convert(result._buffer,source._buffer,source._channels,channels,self._size)
+        return result
+    
+    def compact(self):
+        """
+        Returns: True if this pixel list stores one byte per pixel, False otherwise
+        
+        If this pixel list stores 3 channels and every pixel is grey, it is converted to
+        1 channel, which takes a third of the memory.  Otherwise it is not changed.
+        """
+        if self._channels == 1:
+            return True
+        if self._channels != 3 or type(self) not in (Pixels,MappedPixels):
+            return False
+        step = CHUNK_SIZE*3
+        for start in range(0,self._size*3,step):
+            chunk = _asarray(self._buffer[start:start+step])
+            if not chunk[0::3] == chunk[1::3] == chunk[2::3]:
+                return False
+        self._reshape(1)
+        return True
+    
+    def tiles(self,width):
+        """
+        Returns: A list of rectangles (row, col, height, width) covering an image
+        
+        The rectangles are the units in which this storage prefers to be visited, in 
+        storage order.  Image processing code can visit the pixels one rectangle at a 
+        time to keep its working set small.  For a flat pixel list, these are bands of 
+        consecutive rows (of roughly 64K pixels each).
+        
+        Parameter width: The width of the image using these pixels
+        Precondition: width is an int > 0 that evenly divides the length
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        height = self._size//width
+        band   = max(1,65536//width)
+        return [(row,0,min(band,height-row),width) for row in range(0,height,band)]
     
     # PROGRESS MONITOR
     def progress(self):
@@ -213,37 +506,642 @@ class Pixels(object):
         
         This clears all change tracking.
         """
-        self._marker = [0]*self._size
+        self._marker = bytearray(self._size)
         self._change = 0
+    
+    # CONTENT HASHING
+    def digest(self):
+        """
+        Returns: A 16 byte hash of the pixels in this list
+        
+        Two pixel lists with the same pixels (in the same order) have the same hash.
+        Only the chunks of CHUNK_SIZE pixels written since the last call are hashed
+        again.  A full copy starts with the chunk hashes of the list it copies.
+        """
+        import hashlib
+        step  = CHUNK_SIZE*self._channels
+        count = -(-self._size//CHUNK_SIZE)
+        if self._digests is None or len(self._digests) != count:
+            self._digests = [None]*count
+        result = hashlib.blake2b(digest_size=16)
+        with memoryview(self._buffer) as view:
+            for chunk in range(count):
+                if self._digests[chunk] is None:
+                    data = view[chunk*step:(chunk+1)*step]
+                    self._digests[chunk] = hashlib.blake2b(data,digest_size=16).digest()
+                result.update(self._digests[chunk])
+        return result.digest()
+    
+    # MEMORY ACCOUNTING
+    def footprint(self,seen=None):
+        """
+        Returns: The bytes used by this pixel list, as a dictionary
+        
+        The dictionary has three keys.  The value for 'buffer' is the bytes of pixel 
+        storage in process memory, and the value for 'file' is the bytes of pixel 
+        storage backed by a file (a memory map or a scratch file).  The value for 
+        'marker' is the bytes of the change marker.  These are the sizes of the data 
+        itself, not including the (small, fixed) overhead of the Python objects.
+        
+        Storage that is shared between pixel lists should only be counted once.  If seen
+        is not None, storage whose id is in seen is not counted, and the ids of the 
+        storage counted are added to it.
+        
+        Parameter seen: The ids of storage already counted
+        Precondition: seen is a set or None
+        """
+        result = {'buffer': 0, 'file': 0, 'marker': len(self._marker)}
+        if seen is None or not id(self._buffer) in seen:
+            if seen is not None:
+                seen.add(id(self._buffer))
+            nbytes = len(self._buffer)*getattr(self._buffer,'itemsize',1)
+            result['file' if _is_mapped(self._buffer) else 'buffer'] = nbytes
+        return result
+    
+    # HIDDEN METHODS
+    def _new(self,size,channels):
+        """
+        Returns: A new (black) pixel list in the same kind of storage as this one
+        
+        Parameter size: the number of pixels to store
+        Precondition: size is an int >= 0
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        return Pixels(size,channels)
+    
+    def _reshape(self,channels):
+        """
+        Converts the storage of this pixel list to the given number of channels
+        
+        See convert for how the pixels are converted.
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        self._buffer   = self.convert(channels)._buffer
+        self._channels = channels
+        self._base     = None
+        self._digests  = None
+    
+    def _own(self):
+        """
+        Gives this pixel list its own storage, if it shares it with another (see share)
+        """
+        if self._base is not None:
+            self._buffer = self._base._copy(0,self._size)._buffer
+            self._base   = None
+    
+    def _forget(self,start,stop):
+        """
+        Drops the chunk hashes (see digest) of the pixels in the range start..stop-1
+        
+        Parameter start: The first pixel written
+        Precondition: start is an int, 0 <= start <= stop
+        
+        Parameter stop: The pixel after the last one written
+        Precondition: stop is an int, start <= stop <= len(self)
+        """
+        if self._digests is not None:
+            for chunk in range(start//CHUNK_SIZE,-(-stop//CHUNK_SIZE)):
+                if chunk < len(self._digests):
+                    self._digests[chunk] = None
+    
+    def _copy(self,start,stop):
+        """
+        Returns: A new pixel list with a copy of the pixels in the range start..stop-1
+        
+        Subclasses override this to keep the copy in the same kind of storage.
+        
+        Parameter start: The first pixel to copy
+        Precondition: start is an int, 0 <= start <= stop
+        
+        Parameter stop: The pixel after the last one to copy
+        Precondition: stop is an int, start <= stop <= len(self)
+        """
+        c = self._channels
+        result = Pixels(0,c)
+        if type(self._buffer) == array:
+            result._buffer = self._buffer[start*c:stop*c]
+        else:
+            # Slices of memoryviews and maps do not copy (or are not arrays)
+            result._buffer.frombytes(self._buffer[start*c:stop*c])
+        result._size = len(result._buffer)//c
+        result.unmark()
+        if start == 0 and stop == self._size and self._digests is not None:
+            result._digests = list(self._digests)
+        return result
 
 
-class _PixelIterator(object):
+class PixelView(Pixels):
     """
-    A (hidden) class for iterating through pixel lists
+    A view of some of the pixels of another pixel list
     
-    This class allows a Pixels object to be used in a for-loop.
+    A view is a pixel list that does not store any pixels.  Position n of the view is 
+    position
+        
+        offset + (n // columns)*pitch + (n % columns)*step
+    
+    of the parent.  So a one-dimensional view (a slice) has a single row of columns 
+    pixels, while a two-dimensional view (such as a column or a rectangle of an image) 
+    has several rows that are pitch pixels apart in the parent.
+    
+    Reading from or writing to a view reads from or writes to the parent, and changes
+    are tracked by the progress monitor of both.  Slicing a view makes a copy, like any
+    other pixel list.  The buffer property is a (flat) copy as well, as the pixels of a 
+    view are not contiguous in general.  A view has the channels of its parent.
     """
     
-    def __init__(self,pixels):
+    @property
+    def buffer(self):
+        """
+        A flat copy of the pixels of this view
+        """
+        return self.copy().buffer
+    
+    @property
+    def _buffer(self):
+        """
+        The buffer of a flat parent (None for any other parent)
+        
+        This is looked up on every use, as the parent replaces its buffer when it stops
+        sharing storage or changes its channels.
+        """
+        return self._parent._buffer if self._flat else None
+    
+    @property
+    def _channels(self):
+        """
+        The number of bytes per pixel of the parent
+        """
+        return self._parent._channels
+    
+    def getParent(self):
+        """
+        Returns: The pixel list that this view refers to
+        """
+        return self._parent
+    
+    def footprint(self,seen=None):
+        """
+        Returns: The bytes used by this view, as a dictionary (see Pixels.footprint)
+        
+        A view has no pixel storage of its own, so only its marker is counted.
+        
+        Parameter seen: The ids of storage already counted
+        Precondition: seen is a set or None
+        """
+        return {'buffer': 0, 'file': 0, 'marker': len(self._marker)}
+    
+    def digest(self):
+        """
+        Returns: A 16 byte hash of the pixels in this view (see Pixels.digest)
+        
+        A view keeps no chunk hashes, so the pixels are hashed every time.
+        """
+        return self.copy().digest()
+    
+    def compact(self):
+        """
+        Returns: False, as a view cannot change the storage of its parent
+        """
+        return False
+    
+    def share(self):
+        """
+        Returns: A copy of this view (see Pixels.share)
+        
+        A view is not contiguous storage that can be shared, so this is the same as copy.
+        """
+        return self.copy()
+    
+    def __init__(self,parent,offset,size,step=1,columns=None,pitch=0):
         """
-        Initializer: Creates an iterator for the given pixel list
+        Initializer: Creates a view of the given pixel list.
         
-        Paramater pixels: A pixel list
-        Precondition: pixels is a Pixels object
+        Views of one-dimensional views refer directly to the original pixel list.
+        
+        Parameter parent: The pixel list to view
+        Precondition: parent is a Pixels object
+        
+        Parameter offset: The parent position of the first pixel in the view
+        Precondition: offset is an int >= 0
+        
+        Parameter size: The number of pixels in the view
+        Precondition: size is an int >= 0
+        
+        Parameter step: The distance in the parent between pixels in the same row
+        Precondition: step is a nonzero int
+        
+        Parameter columns: The number of pixels in a row (None for a single row)
+        Precondition: columns is an int > 0 that divides size, or None
+        
+        Parameter pitch: The distance in the parent between the starts of two rows
+        Precondition: pitch is an int
         """
-        self._pixels = pixels
-        self._pos = 0
-        self._len = len(pixels)
+        assert isinstance(parent, Pixels), repr(parent)+' is not a pixel list'
+        assert type(offset) == int and offset >= 0, repr(offset)+' is not a valid offset'
+        assert type(size) == int and size >= 0, repr(size)+' is not a valid size'
+        assert type(step) == int and step != 0, repr(step)+' is not a valid step'
+        if columns is None:
+            columns = max(size,1)
+        assert type(columns) == int and columns > 0 and size % columns == 0, repr(columns)+' is not a valid row length'
+        assert type(pitch) == int, repr(pitch)+' is not a valid pitch'
+        
+        if isinstance(parent, PixelView) and parent._columns >= parent._size:
+            offset = parent._offset+offset*parent._step
+            pitch  = pitch*parent._step
+            step   = step*parent._step
+            parent = parent._parent
+        
+        self._parent  = parent
+        self._flat    = type(parent) in (Pixels,MappedPixels)
+        self._offset  = offset
+        self._size    = size
+        self._step    = step
+        self._columns = columns
+        self._pitch   = pitch
+        if size:
+            for pos in (0,size-1,columns-1,size-columns):
+                self._position(pos)
+        self.unmark()
     
-    def __next__(self):
+    def __getitem__(self, index):
         """
-        Returns: The next element in the iteration
+        Returns: The element or sublist indentified by index.
+        
+        Slices are copies, not views.
         
-        This method raises StopIteration when it reaches the end of the
-        iteration.  This will cause the for-loop to stop.
+        Parameter index: The pixel list index
+        Precondition: index is either an int or a slice
         """
-        if self._pos >= self._len:
-            raise StopIteration
+        if type(index) == int:
+            pos = self._position(index)
+            buffer = self._buffer
+            if buffer is None or self._parent._channels != 3:
+                return self._parent[pos]
+            return (buffer[pos*3],buffer[pos*3+1],buffer[pos*3+2])
+        elif type(index) == slice:
+            start, stop, step = index.indices(self._size)
+            if step == 1:
+                return self._copy(start,stop)
+            result = Pixels(len(range(start,stop,step)))
+            for opos, npos in enumerate(range(start,stop,step)):
+                result[opos] = self[npos]
+            result.unmark()
+            return result
+        raise TypeError('pixel indices must be integers or slices, not '+repr(type(index)))
+    
+    def __setitem__(self, index, value):
+        """
+        Sets the element or sublist indentified by index to be the new value
+        
+        Assigning to a slice of a view can never change its length.
+        
+        Parameter index: The pixel list index
+        Precondition: index is either an int or a slice
+        
+        Parameter value: The new value for the position or slice
+        Precondition: index must be a tuple or a Pixels object
+        """
+        if type(index) == int:
+            self._parent[self._position(index)] = value
+            if not self._marker[index]:
+                self._marker[index] = 1
+                self._change += 1
+        elif type(index) == slice:
+            if not isinstance(value, Pixels):
+                raise ValueError('attempt to assign a non-pixel sequence to a slice')
+            positions = range(*index.indices(self._size))
+            if len(positions) != len(value):
+                raise ValueError('attempt to assign sequence of size '+str(len(value))+
+                                 ' to a view slice of size '+str(len(positions)))
+            if positions.step == 1 and self._step == 1:
+                self._assign(positions.start,positions.stop,value)
+                return
+            for npos, opos in enumerate(positions):
+                self[opos] = value[npos]
         else:
-            self._pos += 1
-            return self._pixels[self._pos-1]
+            raise TypeError('pixel indices must be integers or slices, not '+repr(type(index)))
+    
+    def __iter__(self):
+        """
+        Returns: An iterator for the pixels of this view
+        
+        The pixels are unpacked in bulk, one row of the view at a time.
+        """
+        for row in self.rows(self._columns):
+            yield from _unpack(row,self._channels)
+    
+    def rows(self,width):
+        """
+        Returns: An iterator over the rows of an image using this view
+        
+        Each row is a read-only memoryview of the width*channels bytes of that row.  If 
+        the rows of the view are contiguous in a flat parent, these refer to the parent 
+        buffer.  Otherwise each row is a copy.
+        
+        Parameter width: The width of the image using these pixels
+        Precondition: width is an int > 0 that evenly divides the length
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        if self._buffer is None or self._step != 1 or self._columns % width:
+            for start in range(0,self._size,width):
+                yield memoryview(self._copy(start,start+width)._buffer).toreadonly()
+        else:
+            view = memoryview(self._buffer).toreadonly()
+            c = self._channels
+            for start in range(0,self._size,width):
+                base = self._position(start)
+                yield view[base*c:(base+width)*c]
+    
+    def _position(self,index):
+        """
+        Returns: The parent position of the given view position
+        
+        Parameter index: The view position
+        Precondition: index is an int
+        """
+        if index < 0 or index >= self._size:
+            raise IndexError(repr(index)+' is not a valid pixel index')
+        row, col = divmod(index,self._columns)
+        pos = self._offset+row*self._pitch+col*self._step
+        if pos < 0 or pos >= len(self._parent):
+            raise IndexError(repr(index)+' is outside of the parent pixel list')
+        return pos
+    
+    def _assign(self,start,stop,value):
+        """
+        Writes the pixels of value to the positions start..stop-1 of this view
+    
+        The view must have a step of 1.  Each row of the view is then contiguous in the
+        parent, so it is written with a single slice assignment to the parent.
+        
+        Parameter start: The first pixel to write
+        Precondition: start is an int, 0 <= start <= stop
+        
+        Parameter stop: The pixel after the last one to write
+        Precondition: stop is an int, start <= stop <= len(self)
+        
+        Parameter value: The pixels to write
+        Precondition: value is a Pixels object of length stop-start
+        """
+        if type(value) not in (Pixels,MappedPixels):
+            value = value.copy()
+        c = value._channels
+        with memoryview(value._buffer) as src:
+            pos = start
+            while pos < stop:
+                end  = min(stop,(pos//self._columns+1)*self._columns)
+                base = self._position(pos)
+                self._parent[base:base+end-pos] = Pixels.fromBuffer(src[(pos-start)*c:(end-start)*c],c)
+                pos = end
+        prev = self._marker[start:stop].count(1)
+        self._marker[start:stop] = b'\x01'*(stop-start)
+        self._change += stop-start-prev
+    
+    def _copy(self,start,stop):
+        """
+        Returns: A new (flat) pixel list with a copy of the pixels in start..stop-1
+    
+        Rows of contiguous pixels are copied as a single slice.  Rows with a (positive)
+        step are copied with one extended slice per channel.
+        
+        Parameter start: The first pixel to copy
+        Precondition: start is an int, 0 <= start <= stop
+        
+        Parameter stop: The pixel after the last one to copy
+        Precondition: stop is an int, start <= stop <= len(self)
+        """
+        buffer = self._buffer
+        if buffer is None or self._step < 1:
+            result = Pixels(stop-start)
+            for pos in range(start,stop):
+                result[pos-start] = self[pos]
+        else:
+            c = self._channels
+            result = Pixels(stop-start,c)
+            pos = start
+            while pos < stop:
+                end  = min(stop,(pos//self._columns+1)*self._columns)
+                base = self._position(pos)
+                if self._step == 1:
+                    chunk = _asarray(buffer[base*c:(base+end-pos)*c])
+                    result._buffer[(pos-start)*c:(end-start)*c] = chunk
+                else:
+                    last = base+(end-pos-1)*self._step
+                    for channel in range(c):
+                        chunk = _asarray(buffer[base*c+channel:last*c+channel+1:self._step*c])
+                        result._buffer[(pos-start)*c+channel:(end-start)*c:c] = chunk
+                pos = end
+        result.unmark()
+        return result
+
+
+class MappedPixels(Pixels):
+    """
+    A pixel list whose buffer is a memory map of a scratch file
+    
+    This class behaves exactly like Pixels.  The difference is that the pixel data 
+    lives in a (deleted) temporary file rather than in process memory, so the operating 
+    system page cache decides how much of it is resident.  This allows us to work on
+    images (and edit histories) that are larger than the available RAM.
+    
+    Copies and slices of a mapped pixel list are mapped as well.  So once the original
+    image of an ImageHistory uses this class, all of the history snapshots are file 
+    backed too.
+    
+    The class attribute SCRATCH_DIR is the directory for the scratch files.  If it is
+    None, the system temporary directory is used.
+    """
+    
+    # The directory for scratch files (None for the system default)
+    SCRATCH_DIR = None
+    
+    def __init__(self,size,channels=3):
+        """
+        Initializer: Creates a new mapped pixel list
+        
+        The initializer creates a pixel list of all black (opaque) pixels.  The scratch 
+        file is deleted immediately, so it goes away when the pixel list does.
+        
+        Parameter size: the number of pixels to store
+        Precondition: size is an int >= 0
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        assert type(size) == int, repr(size)+' is not an int'
+        assert size >= 0, repr(size)+' is negative'
+        assert channels in CHANNELS, repr(channels)+' is not a valid number of channels'
+        
+        self._size     = size
+        self._channels = channels
+        self._buffer   = _scratch(size*channels,self.SCRATCH_DIR)
+        if channels == 4 and size:
+            self._buffer[3::4] = b'\xff'*size
+        self.unmark()
+    
+    @classmethod
+    def fromPixels(cls,data):
+        """
+        Returns: A mapped copy of the given pixel list
+        
+        Parameter data: The pixels to copy
+        Precondition: data is a Pixels object
+        """
+        assert isinstance(data, Pixels), repr(data)+' is not a pixel list'
+        
+        if type(data) not in (Pixels,MappedPixels):
+            data = data.copy()
+        result = cls(len(data),data._channels)
+        _transfer(result._buffer,data._buffer,0,len(data)*data._channels)
+        return result
+    
+    def _new(self,size,channels):
+        """
+        Returns: A new (black) mapped pixel list
+        
+        Parameter size: the number of pixels to store
+        Precondition: size is an int >= 0
+        
+        Parameter channels: the number of bytes per pixel
+        Precondition: channels is 1, 3 or 4
+        """
+        return MappedPixels(size,channels)
+    
+    def _copy(self,start,stop):
+        """
+        Returns: A new mapped pixel list with a copy of the pixels in start..stop-1
+        
+        Parameter start: The first pixel to copy
+        Precondition: start is an int, 0 <= start <= stop
+        
+        Parameter stop: The pixel after the last one to copy
+        Precondition: stop is an int, start <= stop <= len(self)
+        """
+        result = MappedPixels(stop-start,self._channels)
+        _transfer(result._buffer,self._buffer,start*self._channels,stop*self._channels)
+        if start == 0 and stop == self._size and self._digests is not None:
+            result._digests = list(self._digests)
+        return result
+
+
+def _unpack(data,channels):
+    """
+    Returns: An iterator over the (r,g,b) tuples of the pixels in data
+    
+    Parameter data: Consecutive pixels of a buffer
+    Precondition: data is a memoryview of whole pixels with the given channels
+    """
+    if channels == 3:
+        return _PIXEL.iter_unpack(data)
+    elif channels == 1:
+        return ((grey,grey,grey) for grey in data)
+    return (pixel[:3] for pixel in _RGBA.iter_unpack(data))
+
+
+def _convert(target,source,old,new,size):
+    """
+    Copies the pixels of source into target, converting the number of channels
+    
+    See Pixels.convert for how the pixels are converted.  The pixels are converted one
+    chunk at a time, with extended slices.
+    
+    Parameter target: The buffer to copy into
+    Precondition: target is a writable byte buffer of size*new bytes
+    
+    Parameter source: The buffer to copy from
+    Precondition: source is a byte buffer of size*old bytes
+    
+    Parameter old: The channels of source
+    Precondition: old is 1, 3 or 4
+    
+    Parameter new: The channels of target
+    Precondition: new is 1, 3 or 4
+    
+    Parameter size: The number of pixels
+    Precondition: size is an int >= 0
+    """
+    with memoryview(target) as dst:
+        for start in range(0,size,CHUNK_SIZE):
+            stop  = min(size,start+CHUNK_SIZE)
+            chunk = _asarray(source[start*old:stop*old])
+            out   = array('B',bytes((stop-start)*new))
+            for channel in range(min(new,3)):
+                out[channel::new] = chunk[min(channel,old-1)::old]
+            if new == 4:
+                out[3::4] = chunk[3::4] if old == 4 else array('B',b'\xff'*(stop-start))
+            dst[start*new:stop*new] = out
+
+
+def _asarray(chunk):
+    """
+    Returns: The given slice of a byte buffer as an array('B')
+    
+    Slices of arrays are already arrays, and are returned as is.
+    
+    Parameter chunk: A slice of a byte buffer
+    Precondition: chunk is an array('B'), bytes or a memoryview
+    """
+    if type(chunk) == array:
+        return chunk
+    return array('B',bytes(chunk))
+
+
+def _is_mapped(buffer):
+    """
+    Returns: True if the given pixel buffer is backed by a file
+    
+    Parameter buffer: A pixel buffer
+    Precondition: buffer is an array('B'), a bytearray, an mmap or a memoryview
+    """
+    import mmap
+    if type(buffer) == memoryview:
+        buffer = buffer.obj
+    return isinstance(buffer, mmap.mmap)
+
+
+def _scratch(nbytes,directory):
+    """
+    Returns: A zero-filled, writable memory map of a new scratch file
+    
+    Parameter nbytes: The size of the map in bytes
+    Precondition: nbytes is an int >= 0
+    
+    Parameter directory: The directory for the scratch file
+    Precondition: directory is a string or None
+    """
+    import mmap
+    import tempfile
+    
+    if nbytes == 0:
+        return bytearray()  # mmap does not allow empty maps
+    
+    with tempfile.TemporaryFile(dir=directory) as handle:
+        handle.truncate(nbytes)
+        return mmap.mmap(handle.fileno(),nbytes)
+
+
+def _transfer(target,source,start,stop):
+    """
+    Copies the bytes start..stop-1 of source into the beginning of target
+    
+    The copy goes through memoryviews so that we never hold a full intermediate bytes
+    object in memory (which would defeat the point of a mapped buffer).
+    
+    Parameter target: The buffer to copy into
+    Precondition: target is a writable byte buffer of length >= stop-start
+    
+    Parameter source: The buffer to copy from
+    Precondition: source is a byte buffer of length >= stop
+    
+    Parameter start: The first byte to copy
+    Precondition: start is an int, 0 <= start <= stop
+    
+    Parameter stop: The byte after the last one to copy
+    Precondition: stop is an int >= start
+    """
+    with memoryview(target) as dst, memoryview(source) as src:
+        dst[:stop-start] = src[start:stop]
@@ -0,0 +1,122 @@
+"""
+Texture management for the imager application
+
+Because of the complexity of this application, we have spread the GUI code across several
+modules.  This makes the code easier to read and comprehend.
+
+This module contains the support for showing edits without stalling the GUI.  Creating
+a texture and copying a large image into an upload buffer are both slow.  So an image
+panel never creates a texture for every edit.  It takes textures from a TexturePool,
+which keeps the textures that are no longer shown, sorted by size.  And the upload
+buffer is made by the worker thread that performed the edit, as a Frame.  All that is
+left for the GUI thread is to copy the frame to a texture and show it.
+"""
+from collections import OrderedDict
+from kivy.graphics.texture import Texture
+
+
+# The texture color format for each number of channels (see Pixels.channels)
+COLORFMTS = {1: 'luminance', 3: 'rgb', 4: 'rgba'}
+
+
+class TexturePool(object):
+    """
+    A pool of textures, reused by size and color format
+
+    Textures from the pool are already flipped vertically, to match the row order of
+    an Image.  The pool keeps at most limit textures, dropping the oldest ones first.
+    """
+
+    def __init__(self, limit=4):
+        """
+        Initializer: Creates an empty pool
+
+        Parameter limit: The most textures to keep
+        Precondition: limit is an int >= 0
+        """
+        self._limit = limit
+        self._free  = OrderedDict()
+        self._count = 0
+
+    def acquire(self, width, height, colorfmt='rgb'):
+        """
+        Returns: A texture of the given size and color format, from the pool if possible
+
+        The contents of a texture from the pool are whatever was last copied to it.
+
+        Parameter width: The texture width
+        Precondition: width is an int > 0
+
+        Parameter height: The texture height
+        Precondition: height is an int > 0
+
+        Parameter colorfmt: The texture color format
+        Precondition: colorfmt is a value of COLORFMTS
+        """
+        key  = (width,height,colorfmt)
+        free = self._free.get(key)
+        if free:
+            self._count -= 1
+            texture = free.pop()
+            if not free:
+                del self._free[key]
+            return texture
+        texture = Texture.create(size=(width,height), colorfmt=colorfmt, bufferfmt='ubyte')
+        texture.flip_vertical()
+        return texture
+
+    def release(self, texture):
+        """
+        Returns a texture that is no longer shown to the pool
+
+        Parameter texture: The texture to return (or None to do nothing)
+        Precondition: texture is a Texture made by acquire, or None
+        """
+        if texture is None:
+            return
+        key = (texture.width,texture.height,texture.colorfmt)
+        self._free.setdefault(key,[]).append(texture)
+        self._free.move_to_end(key)
+        self._count += 1
+        while self._count > self._limit:
+            oldest = next(iter(self._free))
+            self._free[oldest].pop(0)
+            if not self._free[oldest]:
+                del self._free[oldest]
+            self._count -= 1
+
+
+class Frame(object):
+    """
+    An upload buffer for an image panel, made off of the GUI thread
+
+    A frame is made by ImagePanel.prepare and shown by ImagePanel.present.  A frame for
+    a new image has a new pyramid (see imgpyramid), and always covers the entire
+    display level.  A frame for an edit of the current image may cover just a rectangle
+    of the display level.
+
+    ATTRIBUTES (all are read-only)
+        picture: The image to show                              [Image]
+        pyramid: The pyramid of picture                         [Pyramid]
+        level:   The pyramid level to show                      [int >= 0]
+        changed: The changed rectangle of each cached level     [dict, see Pyramid.update]
+        rect:    The rectangle (row, col, height, width) of the level in data
+        data:    The pixels of rect, ready to upload            [bytes]
+        colorfmt: The texture color format of data              [a value of COLORFMTS]
+        serial:  The number of frames shown before this one was made  [int >= 0]
+    """
+
+    def __init__(self, picture, pyramid, level, changed, rect, data, colorfmt, serial):
+        """
+        Initializer: Creates a frame with the given attributes
+
+        See the class specification for the parameters.
+        """
+        self.picture = picture
+        self.pyramid = pyramid
+        self.level   = level
+        self.changed = changed
+        self.rect    = rect
+        self.data    = data
+        self.colorfmt = colorfmt
+        self.serial  = serial